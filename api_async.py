@@ -0,0 +1,389 @@
+"""
+Modo asíncrono (opcional) de la API del chatbot.
+Sirve sobre asyncio los endpoints de /api que llama n8n: las consultas usan
+el motor asíncrono de SQLAlchemy (aiosqlite / asyncpg) con los mismos
+modelos y los envíos a la Graph API usan httpx, así que una petición que
+espera a la base o a WhatsApp no ocupa un worker entero. Las respuestas
+tienen el mismo formato que las de funciones.py.
+Dependencias: pip install uvicorn aiosqlite httpx
+Uso: uvicorn api_async:app --workers <núcleos>
+Todavía no enruta particiones por ciudad: con PARTICIONES_CIUDADES no arranca.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import httpx
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import app as app_flask
+from basedatos import opciones_motor, registrar_pragmas
+from disponibilidad import FechaInvalida, TurnoNoDisponible, disponibilidad_negocios, rango_fechas, reservar_turno
+from funciones import (ORDENES_BUSQUEDA, claves_busqueda, condiciones_busqueda, consulta_catalogo_resumen,
+                       consulta_facetas, resumir_facetas)
+from limitador import token_n8n_valido, verificar_envio
+from menus import obtener_mensaje
+from messenger import API_URL, TIMEOUT, payload_mensaje, ws_app, ws_key
+from metricas import incrementar, observar, volcar
+from models import Agendamiento, Categoria, MensajePrerenderizado, Negocio, Subcategoria, db
+
+DRIVERS_ASYNC = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+_estado = {'motor': None, 'sesiones': None, 'http': None}
+
+
+class Peticion:
+    def __init__(self, scope, cuerpo):
+        self.metodo = scope['method']
+        self.ruta = scope['path']
+        self.args = {k: v[0] for k, v in parse_qs(scope['query_string'].decode()).items()}
+        self.headers = {k.decode().lower(): v.decode() for k, v in scope['headers']}
+        self.cuerpo = cuerpo
+        self.endpoint = None
+
+    def json(self):
+        try:
+            return json.loads(self.cuerpo or b'{}')
+        except ValueError:
+            return {}
+
+
+def _json(datos, status=200, cabeceras=()):
+    return status, json.dumps(datos, ensure_ascii=False).encode(), list(cabeceras)
+
+
+def _entero(valor, por_defecto=None):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+
+
+def _en_contexto_flask(funcion, *args):
+    """Ejecuta código síncrono de la app (con db.session) en un hilo aparte."""
+    def ejecutar():
+        with app_flask.app_context():
+            return funcion(*args)
+    return asyncio.to_thread(ejecutar)
+
+
+# ============================================
+# MOTOR Y CLIENTE HTTP
+# ============================================
+
+def crear_motor_async():
+    """Motor asíncrono sobre la misma base y con las mismas opciones que el síncrono."""
+    with app_flask.app_context():
+        url = db.engine.url
+    url = url.set(drivername=DRIVERS_ASYNC[url.get_backend_name()])
+    motor = create_async_engine(url, **opciones_motor(url.render_as_string(hide_password=False)))
+    registrar_pragmas(motor.sync_engine)
+    return motor
+
+
+async def iniciar():
+    if app_flask.config.get('PARTICIONES_CIUDADES'):
+        raise RuntimeError('El modo asíncrono aún no soporta PARTICIONES_CIUDADES')
+    _estado['motor'] = crear_motor_async()
+    _estado['sesiones'] = async_sessionmaker(_estado['motor'], expire_on_commit=False)
+    _estado['http'] = httpx.AsyncClient(
+        timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+        limits=httpx.Limits(max_connections=int(os.environ.get('WHATSAPP_POOL', 20))),
+    )
+
+
+async def detener():
+    await _estado['http'].aclose()
+    await _estado['motor'].dispose()
+
+
+async def enviar_mensaje_async(numero_telefono, mensaje, contenido=None, id_aplicacion=ws_app,
+                               token_acceso=ws_key, url_base=None):
+    """Versión no bloqueante de messenger.enviar_mensaje_detallado; devuelve lo mismo."""
+    inicio = time.perf_counter()
+    resultado = 'error'
+    try:
+        respuesta = await _estado['http'].post(
+            f"{url_base or API_URL}/{id_aplicacion}/messages",
+            headers={"Authorization": f"Bearer {token_acceso}"},
+            json=payload_mensaje(numero_telefono, mensaje, contenido),
+        )
+        if respuesta.status_code >= 400:
+            incrementar('whatsapp_errors_total', {'tipo': 'http', 'status': respuesta.status_code})
+            return respuesta.status_code, respuesta.text[:500]
+        resultado = 'ok'
+        return respuesta.status_code, (respuesta.json().get('messages') or [{}])[0].get('id')
+    except httpx.HTTPError as err:
+        incrementar('whatsapp_errors_total', {'tipo': 'red', 'status': ''})
+        return None, str(err)[:500]
+    finally:
+        observar('whatsapp_request_duration_seconds', time.perf_counter() - inicio, {'resultado': resultado})
+
+
+# ============================================
+# ENDPOINTS
+# ============================================
+
+async def get_categorias(peticion):
+    async with _estado['sesiones']() as sesion:
+        filas = (await sesion.execute(
+            select(Categoria.id, Categoria.nombre, Categoria.tipo).where(Categoria.nivel == 1).order_by(Categoria.orden)
+        )).all()
+    return _json([{'id': c.id, 'nombre': c.nombre, 'tipo': c.tipo} for c in filas])
+
+
+async def get_subcategorias(peticion, categoria_id):
+    async with _estado['sesiones']() as sesion:
+        filas = (await sesion.execute(
+            select(Subcategoria.id, Subcategoria.nombre).where(Subcategoria.categoria_id == categoria_id)
+        )).all()
+    return _json([{'id': s.id, 'nombre': s.nombre} for s in filas])
+
+
+async def buscar_negocios(peticion):
+    query = peticion.args.get('q', '').strip()
+    especialidad_id = _entero(peticion.args.get('especialidad_id'))
+    limit = max(1, min(_entero(peticion.args.get('limit'), 10), 50))
+    offset = max(_entero(peticion.args.get('offset'), 0), 0)
+    orden = peticion.args.get('sort', 'relevancia')
+    if orden not in ORDENES_BUSQUEDA:
+        return _json({'error': f"sort debe ser uno de: {', '.join(ORDENES_BUSQUEDA)}"}, 400)
+
+    condiciones = condiciones_busqueda(query, especialidad_id)
+    # Categoría y subcategoría en la misma consulta, sin una consulta por resultado
+    consulta = select(
+        Negocio.id, Negocio.nombre, Negocio.descripcion_corta, Negocio.precio_estimado,
+        Negocio.calificacion_promedio, Negocio.ubicacion, Negocio.destacado,
+        Subcategoria.nombre.label('subcategoria'), Categoria.nombre.label('categoria'),
+    ).outerjoin(Subcategoria, Subcategoria.id == Negocio.subcategoria_id).outerjoin(
+        Categoria, Categoria.id == Subcategoria.categoria_id
+    ).where(*condiciones).order_by(*claves_busqueda(orden)).limit(limit).offset(offset)
+
+    async with _estado['sesiones']() as sesion:
+        filas = (await sesion.execute(consulta)).all()
+        grupos = (await sesion.execute(consulta_facetas(condiciones))).all()
+    return _json({
+        'query': query,
+        'especialidad_id': especialidad_id,
+        'sort': orden,
+        'resultados': [{
+            'id': n.id,
+            'nombre': n.nombre,
+            'descripcion_corta': n.descripcion_corta,
+            'categoria': n.categoria or '',
+            'subcategoria': n.subcategoria or '',
+            'precio_estimado': float(n.precio_estimado) if n.precio_estimado else None,
+            'calificacion': float(n.calificacion_promedio) if n.calificacion_promedio else None,
+            'ubicacion': n.ubicacion,
+            'destacado': bool(n.destacado),
+        } for n in filas],
+        'total': sum(grupo[-1] for grupo in grupos),  # Cada negocio cae en exactamente un grupo
+        'facetas': resumir_facetas(grupos),
+        'limit': limit,
+        'offset': offset,
+    })
+
+
+async def get_detalle_negocio(peticion, negocio_id):
+    async with _estado['sesiones']() as sesion:
+        negocio = (await sesion.execute(
+            select(Negocio.id, Negocio.nombre, Negocio.descripcion_corta, Negocio.telefono_contacto, Negocio.usuario_id)
+            .where(Negocio.id == negocio_id)
+        )).first()
+        if negocio is None:
+            return _json({'error': 'Negocio no encontrado'}, 404)
+        items = []
+        if negocio.usuario_id is not None:
+            filas = (await sesion.execute(consulta_catalogo_resumen(negocio.usuario_id))).all()
+            items = [{'nombre': f.nombre, 'precio': f.precio, 'tipo': f.tipo} for f in filas]
+    return _json({
+        'id': negocio.id,
+        'nombre': negocio.nombre,
+        'descripcion': negocio.descripcion_corta,
+        'contacto': negocio.telefono_contacto,
+        'catalogo_resumen': items,
+    })
+
+
+async def get_disponibilidad(peticion, negocio_id):
+    try:
+        desde, hasta = rango_fechas(peticion.args.get('desde'), peticion.args.get('hasta'))
+    except ValueError:
+        return _json({'error': 'Fechas inválidas, use el formato YYYY-MM-DD'}, 400)
+    async with _estado['sesiones']() as sesion:
+        dias = (await sesion.run_sync(
+            lambda s: disponibilidad_negocios([negocio_id], desde, hasta, sesion=s)
+        )).get(negocio_id)
+    if dias is None:
+        return _json({'error': 'Negocio no encontrado'}, 404)
+    return _json({'negocio_id': negocio_id, 'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'dias': dias})
+
+
+async def registrar_agendamiento(peticion):
+    data = peticion.json()
+    datos = {
+        'cliente_nombre': data.get('nombre'),
+        'cliente_telefono': data.get('telefono'),
+        'nota': data.get('nota'),
+    }
+    async with _estado['sesiones']() as sesion:
+        try:
+            if data.get('fecha'):
+                fecha = datetime.fromisoformat(data['fecha'])
+                nuevo_age = await sesion.run_sync(
+                    lambda s: reservar_turno(data.get('negocio_id'), fecha, sesion=s, **datos)
+                )
+            else:
+                nuevo_age = Agendamiento(id_negocio=data.get('negocio_id'), estado='pendiente', **datos)
+                sesion.add(nuevo_age)
+                await sesion.commit()
+        except FechaInvalida as e:
+            return _json({'status': 'error', 'message': str(e)}, 400)
+        except TurnoNoDisponible as e:
+            return _json({'status': 'error', 'message': str(e)}, 409)
+        except Exception as e:
+            await sesion.rollback()
+            return _json({'status': 'error', 'message': str(e)}, 400)
+    return _json({
+        'status': 'success',
+        'message': 'Agendamiento registrado',
+        'id': nuevo_age.id,
+        'fecha_agendada': nuevo_age.fecha_agendada.isoformat() if nuevo_age.fecha_agendada else None,
+    }, 201)
+
+
+async def _mensaje_prerenderizado(tipo, nodo_id, pagina):
+    async with _estado['sesiones']() as sesion:
+        fila = (await sesion.execute(
+            select(MensajePrerenderizado.contenido, MensajePrerenderizado.etag)
+            .where(MensajePrerenderizado.clave == f'{tipo}:{nodo_id}:{pagina}')
+        )).first()
+    if fila is not None:
+        return fila.contenido, fila.etag
+    # Invalidado: se reconstruye con el código síncrono de menus.py (caso poco frecuente)
+    return await _en_contexto_flask(obtener_mensaje, tipo, nodo_id, pagina)
+
+
+async def get_menu_whatsapp(peticion, tipo='raiz', nodo_id=0):
+    resultado = await _mensaje_prerenderizado(tipo, nodo_id, _entero(peticion.args.get('pagina'), 1))
+    if resultado is None:
+        return _json({'error': 'Menú no encontrado'}, 404)
+    contenido, etag = resultado
+    cabeceras = [(b'etag', f'"{etag}"'.encode())]
+    if f'"{etag}"' in peticion.headers.get('if-none-match', ''):
+        return 304, b'', cabeceras
+    return 200, contenido.encode(), cabeceras
+
+
+async def enviar_menu_whatsapp(peticion, tipo='raiz', nodo_id=0):
+    # Sin sesiones de Flask: solo el token de n8n
+    if not token_n8n_valido(peticion.headers.get('authorization')):
+        return _json({'status': 'error', 'message': 'No autorizado'}, 401)
+    data = peticion.json()
+    if not data.get('telefono'):
+        return _json({'status': 'error', 'message': 'Falta el teléfono'}, 400)
+    espera = await asyncio.to_thread(verificar_envio, 'n8n', str(data['telefono']))
+    if espera is not None:
+        return _json({'status': 'error', 'message': f'Demasiados envíos. Intenta de nuevo en {espera} segundos.'},
+                     429, [(b'retry-after', str(espera).encode())])
+    resultado = await _mensaje_prerenderizado(tipo, nodo_id, _entero(data.get('pagina'), 1))
+    if resultado is None:
+        return _json({'status': 'error', 'message': 'Menú no encontrado'}, 404)
+    status, detalle = await enviar_mensaje_async(data['telefono'], '', contenido=json.loads(resultado[0]))
+    if status is None or status >= 400:
+        return _json({'status': 'error', 'message': detalle}, 502)
+    return _json({'status': 'success', 'wamid': detalle})
+
+
+_TIPO_MENU = r'(?P<tipo>categoria|subcategoria|negocio)/(?P<nodo_id>\d+)'
+
+RUTAS = [
+    ('GET', r'/api/categorias', get_categorias),
+    ('GET', r'/api/subcategorias/(?P<categoria_id>\d+)', get_subcategorias),
+    ('GET', r'/api/buscar', buscar_negocios),
+    ('GET', r'/api/negocios/(?P<negocio_id>\d+)', get_detalle_negocio),
+    ('GET', r'/api/disponibilidad/(?P<negocio_id>\d+)', get_disponibilidad),
+    ('POST', r'/api/agendar', registrar_agendamiento),
+    ('GET', r'/api/menus/raiz', get_menu_whatsapp),
+    ('GET', rf'/api/menus/{_TIPO_MENU}', get_menu_whatsapp),
+    ('POST', r'/api/menus/raiz/enviar', enviar_menu_whatsapp),
+    ('POST', rf'/api/menus/{_TIPO_MENU}/enviar', enviar_menu_whatsapp),
+]
+RUTAS = [(metodo, re.compile(patron + '$'), vista) for metodo, patron, vista in RUTAS]
+
+
+# ============================================
+# APLICACIÓN ASGI
+# ============================================
+
+async def _despachar(peticion):
+    metodo_no_permitido = False
+    for metodo, patron, vista in RUTAS:
+        encontrada = patron.match(peticion.ruta)
+        if encontrada is None:
+            continue
+        if metodo != peticion.metodo:
+            metodo_no_permitido = True
+            continue
+        argumentos = {k: int(v) if v.isdigit() else v for k, v in encontrada.groupdict().items()}
+        peticion.endpoint = f'async.{vista.__name__}'
+        return await vista(peticion, **argumentos)
+    if metodo_no_permitido:
+        return _json({'error': 'Método no permitido'}, 405)
+    return _json({'error': 'No encontrado'}, 404)
+
+
+async def _ciclo_de_vida(receive, send):
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'lifespan.startup':
+            try:
+                await iniciar()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensaje['type'] == 'lifespan.shutdown':
+            await detener()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """Aplicación ASGI: uvicorn api_async:app"""
+    if scope['type'] == 'lifespan':
+        return await _ciclo_de_vida(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    cuerpo = b''
+    while True:
+        mensaje = await receive()
+        cuerpo += mensaje.get('body', b'')
+        if not mensaje.get('more_body'):
+            break
+
+    inicio = time.perf_counter()
+    peticion = Peticion(scope, cuerpo)
+    try:
+        status, contenido, cabeceras = await _despachar(peticion)
+    except Exception:
+        app_flask.logger.exception('Error en %s %s', peticion.metodo, peticion.ruta)
+        status, contenido, cabeceras = _json({'error': 'Error interno'}, 500)
+    observar('http_request_duration_seconds', time.perf_counter() - inicio, {
+        'endpoint': peticion.endpoint or 'sin_ruta', 'method': peticion.metodo, 'status': status,
+    })
+    volcar()
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(contenido)).encode()),
+                    *cabeceras],
+    })
+    await send({'type': 'http.response.body', 'body': contenido})
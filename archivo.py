@@ -0,0 +1,211 @@
+"""
+Archivo histórico de agendamientos y ventas.
+Los agendamientos completados o cancelados cuya cita (o, sin cita, su
+creación) pasó hace más de ARCHIVO_RETENCION_DIAS (90) y las ventas de más
+de esos días se mueven, en lotes cortos por id, a una base
+SQLite aparte ('database_archivo.db' junto a cada base o partición) que las
+conexiones adjuntan como 'archivo' (basedatos.py). Las tablas calientes
+quedan con el movimiento reciente y sus índices caben en caché.
+contar_historial() lee el archivo solo cuando el rango de fechas llega a
+filas archivadas: el máximo de la fecha archivada sale de un índice, así
+que comprobarlo no cuesta un recorrido.
+Uso: flask --app app archivo mover
+"""
+import os
+import time
+from datetime import date, datetime, time as hora, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import MetaData, func, select
+from sqlalchemy.orm import aliased
+
+from basedatos import BIND_CIUDAD, ESQUEMA_ARCHIVO
+from models import Agendamiento, Venta, db
+from particiones import ciudades, en_todas_las_ciudades
+
+# tabla caliente -> modelo, columna de fecha de las consultas, antigüedad que
+# decide el archivo, filtro extra e índices de la copia
+ARCHIVABLES = {
+    'agendamientos': {
+        'modelo': Agendamiento,
+        'fecha': 'created_at',
+        # Una cita reservada con meses de anticipación se archiva cuando pasa, no por su alta
+        'antiguedad': lambda t: func.coalesce(t.c.fecha_agendada, t.c.created_at),
+        'condicion': lambda t: t.c.estado.in_(('completado', 'cancelado')),  # Los activos nunca se archivan
+        'indices': (('created_at',), ('id_negocio', 'created_at')),
+    },
+    'venta': {
+        'modelo': Venta,
+        'fecha': 'fecha',
+        'antiguedad': lambda t: t.c.fecha,
+        'condicion': None,
+        'indices': (('fecha',), ('vendedor_id', 'fecha')),
+    },
+}
+
+metadata_archivo = MetaData()
+
+
+def _tabla_archivada(tabla, indices):
+    # Mismas columnas sin FK ni defaults: las filas llegan completas y no cambian
+    columnas = [db.Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False) for c in tabla.columns]
+    return db.Table(
+        tabla.name, metadata_archivo, *columnas,
+        *(db.Index(f'ix_archivo_{tabla.name}_{"_".join(campos)}', *campos) for campos in indices),
+        schema=ESQUEMA_ARCHIVO,
+    )
+
+
+for _archivable in ARCHIVABLES.values():
+    _archivable['tabla'] = _tabla_archivada(_archivable['modelo'].__table__, _archivable['indices'])
+    # Entidad ORM sobre la copia: se enruta a la partición igual que el modelo
+    _archivable['archivado'] = aliased(_archivable['modelo'], _archivable['tabla'], adapt_on_names=True)
+
+
+def habilitado():
+    return current_app.config.get('ARCHIVO_HISTORIAL', False)
+
+
+def _archivable(modelo):
+    return ARCHIVABLES[modelo.__table__.name]
+
+
+# ============================================
+# CONSULTAS SOBRE CALIENTE + ARCHIVO
+# ============================================
+
+def necesita_archivo(modelo, desde=None):
+    """True si hay filas archivadas de `modelo` con fecha >= `desde` (sin `desde`, si hay alguna)."""
+    if not habilitado():
+        return False
+    if isinstance(desde, date) and not isinstance(desde, datetime):
+        desde = datetime.combine(desde, hora.min)
+    archivable = _archivable(modelo)
+    columna = getattr(archivable['archivado'], archivable['fecha'])
+    ultima = db.session.scalar(select(func.max(columna)))
+    return ultima is not None and (desde is None or ultima >= desde)
+
+
+def contar_historial(modelo, desde=None, **igualdades):
+    """
+    Filas de `modelo` con fecha >= `desde` que cumplen `igualdades`
+    (como filter_by). Cuenta la tabla caliente y, solo si hace falta, la
+    archivada, cada una con su índice. Los modelos por ciudad se cuentan en
+    todas las particiones.
+    """
+    archivable = _archivable(modelo)
+
+    def contar():
+        total = 0
+        entidades = [modelo, archivable['archivado']] if necesita_archivo(modelo, desde) else [modelo]
+        for entidad in entidades:
+            consulta = select(func.count()).select_from(entidad).filter_by(**igualdades)
+            if desde is not None:
+                consulta = consulta.where(getattr(entidad, archivable['fecha']) >= desde)
+            total += db.session.scalar(consulta)
+        return total
+
+    if modelo.__table__.info.get('por_ciudad'):
+        return sum(en_todas_las_ciudades(contar))
+    return contar()
+
+
+# ============================================
+# MOVIMIENTO AL ARCHIVO
+# ============================================
+
+def _motores():
+    """(ciudad, motor, tablas archivables que viven en él); None = base principal."""
+    principal = list(ARCHIVABLES.values())
+    yield None, db.engine, principal
+    por_ciudad = [a for a in principal if a['modelo'].__table__.info.get('por_ciudad')]
+    for ciudad in ciudades():
+        yield ciudad, db.engines[BIND_CIUDAD + ciudad], por_ciudad
+
+
+def preparar_archivo():
+    """Crea las tablas del archivo en cada base; el archivo queda en modo WAL."""
+    if not habilitado():
+        return
+    for _, motor, archivables in _motores():
+        with motor.connect() as conn:
+            conn.exec_driver_sql(f'PRAGMA {ESQUEMA_ARCHIVO}.journal_mode=WAL')
+            metadata_archivo.create_all(conn, tables=[a['tabla'] for a in archivables])
+            conn.commit()
+
+
+def _mover_tabla(motor, archivable, corte, lote, pausa):
+    caliente, archivada = archivable['modelo'].__table__, archivable['tabla']
+    criterio = [archivable['antiguedad'](caliente) < corte]
+    if archivable['condicion'] is not None:
+        criterio.append(archivable['condicion'](caliente))
+    movidas, ultimo_id = 0, 0
+    while True:
+        # Un lote por transacción: los escritores esperan a lo sumo un lote
+        with motor.begin() as conn:
+            ids = conn.execute(
+                select(caliente.c.id).where(caliente.c.id > ultimo_id, *criterio).order_by(caliente.c.id).limit(lote)
+            ).scalars().all()
+            if not ids:
+                return movidas
+            # OR IGNORE: si un lote anterior quedó a medias, las filas ya copiadas no fallan
+            conn.execute(archivada.insert().prefix_with('OR IGNORE').from_select(
+                [c.name for c in caliente.columns], select(caliente).where(caliente.c.id.in_(ids))
+            ))
+            conn.execute(caliente.delete().where(caliente.c.id.in_(ids)))
+        movidas += len(ids)
+        ultimo_id = ids[-1]
+        if pausa:
+            time.sleep(pausa)
+
+
+def mover_al_archivo(dias=None, lote=None, pausa=0.0):
+    """
+    Mueve al archivo las filas anteriores a `dias` días (ARCHIVO_RETENCION_DIAS)
+    en lotes de `lote` filas (ARCHIVO_LOTE). Devuelve {(ciudad, tabla): movidas}.
+    """
+    dias = dias if dias is not None else int(os.environ.get('ARCHIVO_RETENCION_DIAS', 90))
+    lote = lote or int(os.environ.get('ARCHIVO_LOTE', 1000))
+    corte = datetime.now() - timedelta(days=dias)
+    preparar_archivo()
+    return {
+        (ciudad, archivable['tabla'].name): _mover_tabla(motor, archivable, corte, lote, pausa)
+        for ciudad, motor, archivables in _motores()
+        for archivable in archivables
+    }
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+archivo_cli = AppGroup('archivo', help='Historial archivado de agendamientos y ventas.')
+
+
+@archivo_cli.command('mover')
+@click.option('--dias', type=int, default=None, help='Retención en días (ARCHIVO_RETENCION_DIAS, 90).')
+@click.option('--lote', type=int, default=None, help='Filas por transacción (ARCHIVO_LOTE, 1000).')
+@click.option('--pausa', type=float, default=0.0, help='Segundos de espera entre lotes.')
+def mover_command(dias, lote, pausa):
+    """Mueve al archivo los agendamientos cerrados y las ventas antiguas."""
+    if not habilitado():
+        raise click.ClickException('El archivo histórico está desactivado (ARCHIVO_HISTORIAL o base no SQLite)')
+    for (ciudad, tabla), movidas in mover_al_archivo(dias, lote, pausa).items():
+        click.echo(f'{ciudad or "(principal)"} {tabla}: {movidas} filas archivadas')
+
+
+@archivo_cli.command('estado')
+def estado_command():
+    """Filas calientes y archivadas por base y tabla."""
+    if not habilitado():
+        raise click.ClickException('El archivo histórico está desactivado (ARCHIVO_HISTORIAL o base no SQLite)')
+    preparar_archivo()
+    for ciudad, motor, archivables in _motores():
+        with motor.connect() as conn:
+            for archivable in archivables:
+                caliente = conn.scalar(select(func.count()).select_from(archivable['modelo'].__table__))
+                archivadas = conn.scalar(select(func.count()).select_from(archivable['tabla']))
+                click.echo(f'{ciudad or "(principal)"} {archivable["tabla"].name}: '
+                           f'{caliente} calientes, {archivadas} archivadas')
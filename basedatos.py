@@ -0,0 +1,257 @@
+"""
+Configuración del motor de base de datos.
+Ajusta SQLite para acceso concurrente desde varios workers de gunicorn
+(WAL, busy_timeout, synchronous, caché y mmap mediante PRAGMAs al conectar),
+dimensiona el pool de conexiones desde variables de entorno, separa un
+motor de solo lectura para los endpoints del chatbot y enruta las tablas
+particionadas por ciudad (particiones.py). Cada base SQLite adjunta además
+su archivo histórico como 'archivo' (archivo.py).
+"""
+import os
+import re
+import unicodedata
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.dml import UpdateBase
+
+# Bind de Flask-SQLAlchemy usado para las lecturas del chatbot
+BIND_LECTURA = 'lectura'
+
+# Prefijo de los binds de cada ciudad particionada: 'ciudad:quito'
+BIND_CIUDAD = 'ciudad:'
+
+# Esquema con el que cada conexión ve su base de historial archivado
+ESQUEMA_ARCHIVO = 'archivo'
+
+
+def _entero_entorno(nombre, por_defecto):
+    valor = os.environ.get(nombre)
+    return int(valor) if valor not in (None, '') else por_defecto
+
+
+def pragmas_desde_entorno():
+    """
+    PRAGMAs que se aplican a cada conexión SQLite nueva.
+    Variables: SQLITE_JOURNAL_MODE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_SYNCHRONOUS,
+    SQLITE_CACHE_SIZE (negativo = KiB) y SQLITE_MMAP_SIZE (bytes).
+    """
+    return {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'busy_timeout': _entero_entorno('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'cache_size': _entero_entorno('SQLITE_CACHE_SIZE', -20000),
+        'mmap_size': _entero_entorno('SQLITE_MMAP_SIZE', 128 * 1024 * 1024),
+    }
+
+
+def opciones_motor(uri):
+    """
+    Opciones de create_engine para `uri`. El pool se dimensiona con
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT y DB_POOL_RECYCLE.
+    """
+    opciones = {'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '0') == '1'}
+    if uri and uri.startswith('sqlite') and ':memory:' in uri:
+        return opciones  # SQLite en memoria usa su propio pool de una conexión
+
+    opciones.update({
+        'pool_size': _entero_entorno('DB_POOL_SIZE', 5),
+        'max_overflow': _entero_entorno('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _entero_entorno('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _entero_entorno('DB_POOL_RECYCLE', -1),
+    })
+    if uri and uri.startswith('sqlite'):
+        # El timeout del driver es el busy handler de sqlite3 (en segundos)
+        opciones['connect_args'] = {'timeout': pragmas_desde_entorno()['busy_timeout'] / 1000}
+    return opciones
+
+
+def registrar_pragmas(engine, pragmas=None):
+    """Aplica `pragmas` a cada conexión nueva de un motor SQLite."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = pragmas_desde_entorno() if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def _aplicar_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for nombre, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {nombre}={valor}')
+        cursor.close()
+
+
+# Dialectos con INSERT ... ON CONFLICT (on_conflict_do_nothing / do_update)
+_INSERT_CON_CONFLICTO = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def insert_con_conflicto(tabla, motor):
+    """INSERT de `tabla` con ON CONFLICT para el dialecto de `motor`."""
+    try:
+        return _INSERT_CON_CONFLICTO[motor.dialect.name](tabla)
+    except KeyError:
+        raise NotImplementedError(
+            f'INSERT ... ON CONFLICT no está soportado en {motor.dialect.name}; '
+            f'dialectos admitidos: {", ".join(_INSERT_CON_CONFLICTO)}'
+        ) from None
+
+
+# ============================================
+# SEPARACIÓN LECTURA / ESCRITURA
+# ============================================
+
+def _peticion_solo_lectura():
+    return has_app_context() and g.get('_solo_lectura', False)
+
+
+def solo_lectura(f):
+    """Marca un endpoint para que sus consultas usen el motor de lectura."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g._solo_lectura = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def ciudad_actual():
+    """Partición que atiende el contexto: g._ciudad o, fuera de él, CIUDAD de la config."""
+    if not has_app_context():
+        return None
+    if '_ciudad' in g:
+        return g._ciudad
+    return current_app.config.get('CIUDAD')
+
+
+class SesionEnrutada(Session):
+    """
+    Sesión que envía los SELECT de endpoints marcados con @solo_lectura al
+    motor de lectura. Los flush e INSERT/UPDATE/DELETE siempre van al
+    motor principal, de modo que una escritura accidental sigue funcionando.
+    Las tablas con info={'por_ciudad': True} van (lecturas y escrituras) a
+    la partición de ciudad_actual() si existe.
+    """
+
+    def _motor_ciudad(self, mapper, clause):
+        tabla = mapper.persist_selectable if mapper is not None else getattr(clause, 'table', None)
+        if tabla is None or not tabla.info.get('por_ciudad'):
+            return None
+        ciudad = ciudad_actual()
+        return self._db.engines.get(BIND_CIUDAD + ciudad) if ciudad else None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            motor = self._motor_ciudad(mapper, clause)
+            if motor is not None:
+                return motor
+        if (bind is None and not self._flushing
+                and not isinstance(clause, UpdateBase) and _peticion_solo_lectura()):
+            motor = self._db.engines.get(BIND_LECTURA)
+            if motor is not None:
+                return motor
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def opciones_lectura(uri):
+    """
+    Bind de lectura: DATABASE_READ_URI (réplica) o la misma base con un pool
+    propio de conexiones SQLite en modo query_only. Su pool se dimensiona
+    con DB_READ_POOL_SIZE y DB_READ_MAX_OVERFLOW.
+    """
+    url = os.environ.get('DATABASE_READ_URI') or uri
+    opciones = {'url': url, **opciones_motor(url)}
+    if 'pool_size' in opciones:
+        opciones['pool_size'] = _entero_entorno('DB_READ_POOL_SIZE', opciones['pool_size'])
+        opciones['max_overflow'] = _entero_entorno('DB_READ_MAX_OVERFLOW', opciones['max_overflow'])
+    return opciones
+
+
+# ============================================
+# PARTICIONES POR CIUDAD
+# ============================================
+
+def normalizar_ciudad(texto):
+    """'Santo Domingo' -> 'santo-domingo' (sin tildes ni mayúsculas)."""
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '-', texto.lower()).strip('-')
+
+
+def particiones_desde_config(app):
+    """
+    PARTICIONES_CIUDADES de la config o del entorno:
+    'quito=sqlite:///quito.db,guayaquil=sqlite:///guayaquil.db' (o un dict).
+    Devuelve {ciudad normalizada: uri}; vacío desactiva las particiones.
+    """
+    valor = app.config.get('PARTICIONES_CIUDADES', os.environ.get('PARTICIONES_CIUDADES', ''))
+    if isinstance(valor, str):
+        valor = dict(par.split('=', 1) for par in valor.split(',') if '=' in par)
+    return {normalizar_ciudad(ciudad): uri.strip() for ciudad, uri in valor.items()}
+
+
+def adjuntar_base_global(engine, ruta):
+    """Cada conexión de una partición ve las tablas globales como 'global'."""
+    @event.listens_for(engine, 'connect')
+    def _adjuntar(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('ATTACH DATABASE ? AS global', (ruta,))
+        cursor.close()
+
+
+def ruta_archivo(ruta):
+    """'instance/database.db' -> 'instance/database_archivo.db'."""
+    base, extension = os.path.splitext(ruta)
+    return f'{base}_archivo{extension or ".db"}'
+
+
+def adjuntar_archivo(engine):
+    """Cada conexión ve el historial archivado de su base como 'archivo'."""
+    ruta = ruta_archivo(engine.url.database)
+
+    @event.listens_for(engine, 'connect')
+    def _adjuntar(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'ATTACH DATABASE ? AS {ESQUEMA_ARCHIVO}', (ruta,))
+        cursor.close()
+
+
+def archivo_habilitado(uri):
+    """ARCHIVO_HISTORIAL (1 por defecto); solo aplica a bases SQLite en archivo."""
+    return (os.environ.get('ARCHIVO_HISTORIAL', '1') == '1' and bool(uri)
+            and uri.startswith('sqlite') and ':memory:' not in uri and uri.rstrip('/') != 'sqlite:')
+
+
+def configurar_base_datos(app):
+    """
+    Inicializa Flask-SQLAlchemy con las opciones de motor, el bind de lectura
+    y los PRAGMAs. No abre conexiones: los PRAGMAs se aplican cuando el pool
+    crea cada una.
+    """
+    from models import db
+
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+    opciones = opciones_motor(uri)
+    opciones.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    if uri and app.config.get('SEPARAR_LECTURAS', True):
+        binds.setdefault(BIND_LECTURA, opciones_lectura(uri))
+    particiones = particiones_desde_config(app)
+    for ciudad, url in particiones.items():
+        binds.setdefault(BIND_CIUDAD + ciudad, {'url': url, **opciones_motor(url)})
+    app.config['PARTICIONES_CIUDADES'] = particiones
+    app.config.setdefault('ARCHIVO_HISTORIAL', archivo_habilitado(uri))
+
+    db.init_app(app)
+    with app.app_context():
+        registrar_pragmas(db.engine)
+        if BIND_LECTURA in db.engines:
+            registrar_pragmas(db.engines[BIND_LECTURA], {**pragmas_desde_entorno(), 'query_only': 'ON'})
+        for ciudad in particiones:
+            # Los PRAGMAs van antes del ATTACH para no cambiar el modo de la base global
+            registrar_pragmas(db.engines[BIND_CIUDAD + ciudad])
+            adjuntar_base_global(db.engines[BIND_CIUDAD + ciudad], db.engine.url.database)
+        if app.config['ARCHIVO_HISTORIAL']:
+            for motor in db.engines.values():
+                if motor.dialect.name == 'sqlite':
+                    adjuntar_archivo(motor)
@@ -0,0 +1,474 @@
+"""
+Benchmarks de rendimiento ejecutables como comandos de Flask.
+Uso: flask --app app bench <comando>
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+from flask.cli import AppGroup
+
+bench_cli = AppGroup('bench', help='Benchmarks de rendimiento de la aplicación.')
+
+DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+
+
+def _medir_subproceso(codigo, repeticiones, entorno=None):
+    """
+    Ejecuta `codigo` en un intérprete nuevo `repeticiones` veces y devuelve
+    los tiempos medidos dentro del proceso (sin el arranque del intérprete).
+    """
+    envoltura = (
+        'import time\n'
+        '_inicio = time.perf_counter()\n'
+        f'{codigo}\n'
+        'print(time.perf_counter() - _inicio)'
+    )
+    tiempos = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, '-c', envoltura],
+            cwd=DIRECTORIO_APP,
+            env={**os.environ, **(entorno or {})},
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        tiempos.append(float(salida.stdout.strip().splitlines()[-1]))
+    return tiempos
+
+
+def _reportar(nombre, tiempos):
+    click.echo(
+        f'{nombre:<36} mediana {statistics.median(tiempos) * 1000:8.1f} ms'
+        f'   min {min(tiempos) * 1000:8.1f} ms   max {max(tiempos) * 1000:8.1f} ms'
+    )
+
+
+# ============================================
+# ARRANQUE DE WORKERS
+# ============================================
+
+@bench_cli.command('arranque')
+@click.option('--repeticiones', default=5, show_default=True, help='Arranques medidos por escenario.')
+def bench_arranque(repeticiones):
+    """
+    Costo de arranque de un worker de gunicorn.
+    'antes' reproduce la inicialización de la BD al importar app.py;
+    'después' es la importación sin efectos secundarios actual.
+    """
+    escenarios = {
+        'antes (create_all + seed al importar)': (
+            'import app\n'
+            'with app.app.app_context():\n'
+            '    app.inicializar_base_datos()'
+        ),
+        'después (sin efectos al importar)': 'import app',
+    }
+    for nombre, codigo in escenarios.items():
+        _reportar(nombre, _medir_subproceso(codigo, repeticiones))
+
+
+# ============================================
+# CONTENCIÓN DE ESCRITURAS EN SQLITE
+# ============================================
+
+def _trabajador_contencion(uri, pragmas, opciones, inicio, rol, duracion):
+    """
+    Simula un worker: 'perfil' lee un negocio y suma una visita en la misma
+    transacción (como /api/perfil); 'admin' edita productos. La transacción
+    se abre con `inicio` ('BEGIN' o 'BEGIN IMMEDIATE') antes de la lectura.
+    Devuelve (operaciones completadas, errores 'database is locked').
+    """
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+    from basedatos import registrar_pragmas
+
+    engine = create_engine(uri, **opciones)
+    registrar_pragmas(engine, pragmas)
+    operaciones = errores = 0
+    fin = time.monotonic() + duracion
+    while time.monotonic() < fin:
+        try:
+            with engine.begin() as conn:
+                # pysqlite solo abre la transacción en el UPDATE; aquí la lectura queda dentro
+                conn.exec_driver_sql(inicio)
+                if rol == 'perfil':
+                    conn.execute(text('SELECT visitas FROM negocios WHERE id = 1')).all()
+                    conn.execute(text('UPDATE negocios SET visitas = visitas + 1 WHERE id = 1'))
+                else:
+                    conn.execute(text('SELECT COUNT(*) FROM producto')).all()
+                    conn.execute(text('UPDATE producto SET stock = stock + 1 WHERE id = 1'))
+            operaciones += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            errores += 1
+    engine.dispose()
+    return operaciones, errores
+
+
+@bench_cli.command('contencion')
+@click.option('--procesos', default=8, show_default=True, help='Procesos concurrentes (mitad perfil, mitad admin).')
+@click.option('--duracion', default=5.0, show_default=True, help='Segundos por escenario.')
+def bench_contencion(procesos, duracion):
+    """
+    Varios procesos con transacciones que leen y luego escriben sobre una
+    copia temporal de SQLite:
+    'antes': journal por defecto (DELETE), sin espera (timeout=0) y BEGIN
+    diferido, así que la subida del bloqueo de lectura a escritura falla.
+    'WAL sin IMMEDIATE': la configuración de basedatos.py con BEGIN diferido;
+    si otro proceso escribió desde la lectura, SQLite devuelve 'locked' sin
+    pasar por busy_timeout.
+    'después': WAL + busy_timeout + PRAGMAs de basedatos.py y BEGIN
+    IMMEDIATE, que toma el bloqueo de escritura al empezar y sí espera.
+    """
+    import multiprocessing
+    import tempfile
+    from sqlalchemy import create_engine, text
+    from basedatos import opciones_motor, pragmas_desde_entorno
+    from models import db
+
+    escenarios = {
+        'antes (DELETE, timeout=0, BEGIN)': ({}, {'connect_args': {'timeout': 0}}, 'BEGIN'),
+        'WAL sin IMMEDIATE (BEGIN)': (pragmas_desde_entorno(), None, 'BEGIN'),
+        'después (WAL + busy_timeout, IMMEDIATE)': (pragmas_desde_entorno(), None, 'BEGIN IMMEDIATE'),
+    }
+    for nombre, (pragmas, opciones, inicio) in escenarios.items():
+        with tempfile.TemporaryDirectory() as directorio:
+            uri = f'sqlite:///{os.path.join(directorio, "contencion.db")}'
+            engine = create_engine(uri)
+            db.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(text("INSERT INTO negocios (id, nombre, descripcion_corta, visitas) VALUES (1, 'n', 'd', 0)"))
+                conn.execute(text("INSERT INTO producto (id, nombre, precio, stock) VALUES (1, 'p', 1, 0)"))
+            engine.dispose()
+
+            tareas = [
+                (uri, pragmas, opciones if opciones is not None else opciones_motor(uri), inicio,
+                 'perfil' if i % 2 == 0 else 'admin', duracion)
+                for i in range(procesos)
+            ]
+            with multiprocessing.get_context('spawn').Pool(procesos) as pool:
+                resultados = pool.starmap(_trabajador_contencion, tareas)
+
+        operaciones = sum(r[0] for r in resultados)
+        errores = sum(r[1] for r in resultados)
+        click.echo(
+            f'{nombre:<40} {operaciones / duracion:9.1f} tx/s   '
+            f'{errores:6d} errores "database is locked"'
+        )
+
+
+# ============================================
+# ATAQUE DE FUERZA BRUTA AL LOGIN
+# ============================================
+
+def _esperar_servidor(url, limite=20.0):
+    import urllib.request
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise click.ClickException(f'El servidor no respondió en {url}')
+
+
+def _peticion(url, datos=None):
+    """Devuelve (código HTTP, segundos) de una petición, incluidas las 4xx."""
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+    cuerpo = urllib.parse.urlencode(datos).encode() if datos is not None else None
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, data=cuerpo, timeout=30) as respuesta:
+            respuesta.read()
+            codigo = respuesta.status
+    except urllib.error.HTTPError as e:
+        codigo = e.code
+    return codigo, time.perf_counter() - inicio
+
+
+@bench_cli.command('login')
+@click.option('--atacantes', default=16, show_default=True, help='Clientes enviando contraseñas erróneas.')
+@click.option('--workers', default=2, show_default=True, help='Workers de gunicorn.')
+@click.option('--duracion', default=5.0, show_default=True, help='Segundos por escenario.')
+@click.option('--puerto', default=8765, show_default=True)
+def bench_login(atacantes, workers, duracion, puerto):
+    """
+    Levanta gunicorn sobre una base temporal y lanza un ataque de
+    contraseñas contra /login mientras un cliente legítimo pide /login (GET).
+    Compara la latencia del cliente legítimo sin limitador y con él.
+    """
+    import tempfile
+    import threading
+    import uuid
+    from sqlalchemy import create_engine, text
+    from werkzeug.security import generate_password_hash
+    from models import db
+
+    escenarios = {'sin limitador': '0', 'con limitador': '1'}
+    base = f'http://127.0.0.1:{puerto}'
+    for nombre, activo in escenarios.items():
+        with tempfile.TemporaryDirectory() as directorio:
+            uri = f'sqlite:///{os.path.join(directorio, "login.db")}'
+            engine = create_engine(uri)
+            db.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO user (username, email, password_hash, role, is_active) "
+                         "VALUES ('victima', 'v@example.com', :h, 'usuario', 1)"),
+                    {'h': generate_password_hash('correcta')},
+                )
+            engine.dispose()
+
+            entorno = {
+                **os.environ,
+                'SQLALCHEMY_DATABASE_URI': uri,
+                'SECRET_KEY': 'bench',
+                'LOGIN_LIMITADOR_ACTIVO': activo,
+                'LOGIN_LIMITADOR_DB': os.path.join(directorio, 'limitador.db'),
+                'METRICAS_DIR': os.path.join(directorio, 'metricas'),
+                'CONSULTAS_LENTAS_LOG': os.path.join(directorio, 'lentas.log'),
+                'IDENTIDAD_GENERACION': os.path.join(directorio, 'identidades.gen'),
+            }
+            servidor = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{puerto}', 'app:app'],
+                cwd=DIRECTORIO_APP, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                _esperar_servidor(f'{base}/login')
+                fin = time.monotonic() + duracion
+                codigos = []
+                latencias = []
+
+                def atacar():
+                    while time.monotonic() < fin:
+                        datos = {'username': 'victima', 'password': uuid.uuid4().hex}
+                        codigos.append(_peticion(f'{base}/login', datos)[0])
+
+                hilos = [threading.Thread(target=atacar) for _ in range(atacantes)]
+                for hilo in hilos:
+                    hilo.start()
+                while time.monotonic() < fin:
+                    latencias.append(_peticion(f'{base}/login')[1])
+                    time.sleep(0.05)
+                for hilo in hilos:
+                    hilo.join()
+            finally:
+                servidor.terminate()
+                servidor.wait()
+
+        latencias.sort()
+        p95 = latencias[int(len(latencias) * 0.95) - 1] if len(latencias) >= 20 else latencias[-1]
+        click.echo(
+            f'{nombre:<16} legítimo mediana {statistics.median(latencias) * 1000:8.1f} ms'
+            f'   p95 {p95 * 1000:8.1f} ms   ataque {len(codigos) / duracion:7.1f} req/s'
+            f'   429: {codigos.count(429)}/{len(codigos)}'
+        )
+
+
+# ============================================
+# CAMPAÑAS DE DIFUSIÓN
+# ============================================
+
+@bench_cli.command('difusion')
+@click.option('--mensajes', default=300, show_default=True, help='Destinatarios de la campaña.')
+@click.option('--latencia', default=0.02, show_default=True, help='Latencia simulada de la Graph API (s).')
+@click.option('--hilos', default=8, show_default=True)
+@click.option('--por-segundo', default=1000.0, show_default=True, help='Límite de la cubeta de tokens.')
+def bench_difusion(mensajes, latencia, hilos, por_segundo):
+    """
+    Mensajes por segundo contra una Graph API falsa local: una conexión
+    nueva por mensaje en serie (antes) frente a difusion.ejecutar_campana
+    con sesión keep-alive, pool de hilos y cubeta de tokens (después).
+    """
+    import tempfile
+    import requests
+    from app import create_app
+    from difusion import crear_campana, ejecutar_campana
+    from messenger import enviar_mensaje_detallado, servidor_graph_falso
+    from models import Negocio, db
+
+    servidor = servidor_graph_falso(latencia)
+    url = f'{servidor.url}/app/messages'
+
+    inicio = time.perf_counter()
+    for i in range(mensajes):
+        requests.post(url, json={'to': f'57300{i:07d}', 'text': {'body': 'Hola'}}).raise_for_status()
+    antes = time.perf_counter() - inicio
+
+    with tempfile.TemporaryDirectory() as directorio:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directorio, "difusion.db")}',
+            'SEPARAR_LECTURAS': False,
+        })
+        with app.app_context():
+            db.create_all(bind_key=None)
+            db.session.add_all(
+                Negocio(nombre=f'Negocio {i}', descripcion_corta='d', whatsapp_contacto=f'57300{i:07d}')
+                for i in range(mensajes)
+            )
+            db.session.commit()
+            campana = crear_campana('bench', 'Hola {nombre}, tenemos novedades.', 'duenos_negocios_activos')
+            enviar = lambda telefono, mensaje: enviar_mensaje_detallado(telefono, mensaje, url_base=servidor.url)
+            inicio = time.perf_counter()
+            resumen = ejecutar_campana(campana.id, enviar=enviar, hilos=hilos, por_segundo=por_segundo)
+            despues = time.perf_counter() - inicio
+    servidor.shutdown()
+
+    click.echo(f'{"antes (conexión nueva, en serie)":<40} {mensajes / antes:8.1f} mensajes/s')
+    click.echo(f'{f"después (keep-alive, {hilos} hilos)":<40} {mensajes / despues:8.1f} mensajes/s   {resumen}')
+
+
+# ============================================
+# API SÍNCRONA VS ASÍNCRONA
+# ============================================
+
+async def _conexion_keepalive(host, puerto, peticiones, fin, latencias, errores):
+    """Una conexión HTTP/1.1 que repite `peticiones`; reconecta si el servidor la cierra."""
+    import asyncio
+    lector = escritor = None
+    i = 0
+    while time.monotonic() < fin:
+        metodo, ruta, cuerpo = peticiones[i % len(peticiones)]
+        i += 1
+        inicio = time.perf_counter()
+        try:
+            if escritor is None:
+                lector, escritor = await asyncio.open_connection(host, puerto)
+            escritor.write(
+                f'{metodo} {ruta} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(cuerpo)}\r\n\r\n'.encode() + cuerpo
+            )
+            await escritor.drain()
+            codigo = int((await asyncio.wait_for(lector.readline(), 30)).split()[1])
+            largo, cerrar = 0, False
+            while (cabecera := await lector.readline()) not in (b'\r\n', b''):
+                nombre, _, valor = cabecera.decode().partition(':')
+                if nombre.lower() == 'content-length':
+                    largo = int(valor)
+                elif nombre.lower() == 'connection' and 'close' in valor.lower():
+                    cerrar = True
+            await lector.readexactly(largo)
+            if cerrar:
+                escritor.close()
+                escritor = None
+            if codigo >= 500:
+                errores.append(codigo)
+            else:
+                latencias.append(time.perf_counter() - inicio)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            errores.append(None)
+            if escritor is not None:
+                escritor.close()
+            escritor = None
+    if escritor is not None:
+        escritor.close()
+
+
+@bench_cli.command('async')
+@click.option('--conexiones', default=200, show_default=True, help='Conexiones concurrentes de n8n simuladas.')
+@click.option('--duracion', default=10.0, show_default=True, help='Segundos por escenario.')
+@click.option('--latencia', default=0.1, show_default=True, help='Latencia simulada de la Graph API (s).')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Procesos por despliegue.')
+@click.option('--puerto', default=8766, show_default=True)
+def bench_async(conexiones, duracion, latencia, workers, puerto):
+    """
+    Mismo tráfico contra gunicorn con workers síncronos (app:app) y contra
+    uvicorn con api_async:app, sobre una base temporal. Cada conexión alterna
+    /api/buscar con el envío de un menú a una Graph API falsa que tarda
+    `latencia` segundos. Requiere uvicorn, aiosqlite y httpx.
+    """
+    import asyncio
+    import importlib.util
+    import json
+    import tempfile
+    from app import create_app
+    from menus import regenerar_menus
+    from messenger import servidor_graph_falso
+    from models import Categoria, Negocio, Subcategoria, db
+
+    faltantes = [m for m in ('uvicorn', 'aiosqlite', 'httpx') if importlib.util.find_spec(m) is None]
+    if faltantes:
+        raise click.ClickException(f'Faltan dependencias opcionales: pip install {" ".join(faltantes)}')
+
+    servidor_graph = servidor_graph_falso(latencia)
+    escenarios = {
+        f'síncrono (gunicorn x{workers})': [sys.executable, '-m', 'gunicorn', '-w', str(workers),
+                                            '-b', f'127.0.0.1:{puerto}', 'app:app'],
+        f'asíncrono (uvicorn x{workers})': [sys.executable, '-m', 'uvicorn', '--workers', str(workers),
+                                            '--host', '127.0.0.1', '--port', str(puerto),
+                                            '--log-level', 'warning', '--no-access-log', 'api_async:app'],
+    }
+    peticiones = [
+        ('GET', '/api/buscar?q=Negocio&limit=10', b''),
+        ('POST', '/api/menus/negocio/1/enviar', json.dumps({'telefono': '593900000000'}).encode()),
+    ]
+    nucleos = os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as directorio:
+        uri = f'sqlite:///{os.path.join(directorio, "api.db")}'
+        app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'SEPARAR_LECTURAS': False, 'PARTICIONES_CIUDADES': ''})
+        with app.app_context():
+            db.create_all(bind_key=None)
+            categoria = Categoria(nombre='Servicios', tipo='servicio', nivel=1)
+            db.session.add(categoria)
+            db.session.flush()
+            subcategoria = Subcategoria(nombre='Hogar', categoria_id=categoria.id)
+            db.session.add(subcategoria)
+            db.session.flush()
+            db.session.add_all(
+                Negocio(nombre=f'Negocio {i}', descripcion_corta='Servicio a domicilio',
+                        subcategoria_id=subcategoria.id, whatsapp_contacto=f'57300{i:07d}')
+                for i in range(200)
+            )
+            db.session.commit()
+            regenerar_menus()
+
+        entorno = {
+            **os.environ,
+            'SQLALCHEMY_DATABASE_URI': uri,
+            'SECRET_KEY': 'bench',
+            'PARTICIONES_CIUDADES': '',
+            'WHATSAPP_API_URL': servidor_graph.url,
+            'WHATSAPP_POOL': str(conexiones),
+            'DB_POOL_SIZE': '10',
+            'METRICAS_DIR': os.path.join(directorio, 'metricas'),
+            'CONSULTAS_LENTAS_LOG': os.path.join(directorio, 'lentas.log'),
+            'IDENTIDAD_GENERACION': os.path.join(directorio, 'identidades.gen'),
+            'LOGIN_LIMITADOR_DB': os.path.join(directorio, 'limitador.db'),
+        }
+        for nombre, comando in escenarios.items():
+            servidor = subprocess.Popen(comando, cwd=DIRECTORIO_APP, env=entorno,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            latencias, errores = [], []
+            try:
+                _esperar_servidor(f'http://127.0.0.1:{puerto}/api/categorias')
+                fin = time.monotonic() + duracion
+
+                async def carga():
+                    await asyncio.gather(*(
+                        _conexion_keepalive('127.0.0.1', puerto, peticiones, fin, latencias, errores)
+                        for _ in range(conexiones)
+                    ))
+                asyncio.run(carga())
+            finally:
+                servidor.terminate()
+                servidor.wait()
+
+            latencias.sort()
+            p99 = latencias[int(len(latencias) * 0.99) - 1] if len(latencias) >= 100 else (latencias or [0])[-1]
+            click.echo(
+                f'{nombre:<28} {len(latencias) / duracion:8.1f} req/s ({len(latencias) / duracion / nucleos:7.1f} por núcleo)'
+                f'   mediana {statistics.median(latencias or [0]) * 1000:8.1f} ms   p99 {p99 * 1000:8.1f} ms'
+                f'   errores {len(errores)}'
+            )
+    servidor_graph.shutdown()
+    click.echo(f'{conexiones} conexiones concurrentes, {nucleos} núcleo(s), Graph API falsa con {latencia * 1000:.0f} ms')
@@ -0,0 +1,222 @@
+"""
+Búsqueda unificada de productos y servicios (/api/catalogo/buscar).
+El texto se busca en índices FTS5 de contenido externo (producto_fts,
+servicio_fts): guardan solo el índice invertido de nombre y descripción y
+los triggers los mantienen al día con cada INSERT, UPDATE o DELETE. Precio,
+categoría y orden usan los índices compuestos de Producto y Servicio.
+Cada rama (productos, servicios) se detiene en offset + limit filas y un
+UNION ALL mezcla las dos páginas; por relevancia se intercalan por posición,
+porque el bm25 de dos índices FTS no es comparable. El total se cuenta hasta
+TOTAL_MAXIMO y el negocio dueño se resuelve solo para la página devuelta.
+Fuera de SQLite el texto se busca con ILIKE.
+Uso: flask --app app catalogo reindexar
+"""
+import re
+from itertools import zip_longest
+
+import click
+from flask.cli import AppGroup
+
+from models import Categoria, Negocio, Producto, Servicio, Subcategoria, db, filtro_subarbol
+from particiones import en_todas_las_ciudades
+
+MODELOS = {'producto': Producto, 'servicio': Servicio}
+ORDENES = ('relevancia', 'precio_asc', 'precio_desc', 'vendidos', 'recientes')
+MAX_LIMIT = 50
+# Contar todas las coincidencias de un término amplio cuesta más que la página
+TOTAL_MAXIMO = 1000
+
+# Sin acentos ('cafe' encuentra 'café') y con índice de prefijos para 'lap*'
+TOKENIZADOR = "unicode61 remove_diacritics 2"
+
+
+def _tabla_fts(modelo):
+    return f'{modelo.__tablename__}_fts'
+
+
+def usa_fts():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def expresion_fts(texto):
+    """'Laptop 15" gamer' -> '"laptop"* "15"* "gamer"*': todas las palabras, por prefijo."""
+    return ' '.join(f'"{palabra}"*' for palabra in re.findall(r'\w+', (texto or '').lower()))
+
+
+# ============================================
+# ÍNDICE DE TEXTO
+# ============================================
+
+def preparar_catalogo(reconstruir=False):
+    """Crea las tablas FTS5 y sus triggers; las llena si son nuevas o si `reconstruir`."""
+    if not usa_fts():
+        return
+    with db.engine.begin() as conn:
+        for modelo in MODELOS.values():
+            tabla, fts = modelo.__tablename__, _tabla_fts(modelo)
+            nueva = conn.execute(
+                db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :nombre"), {'nombre': fts}
+            ).first() is None
+            conn.execute(db.text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"nombre, descripcion, content='{tabla}', content_rowid='id', "
+                f"tokenize='{TOKENIZADOR}', prefix='2 3')"
+            ))
+            conn.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabla} BEGIN "
+                f"INSERT INTO {fts}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion); END"
+            ))
+            conn.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabla} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, nombre, descripcion) "
+                f"VALUES ('delete', old.id, old.nombre, old.descripcion); END"
+            ))
+            conn.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF nombre, descripcion ON {tabla} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, nombre, descripcion) "
+                f"VALUES ('delete', old.id, old.nombre, old.descripcion); "
+                f"INSERT INTO {fts}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion); END"
+            ))
+            if nueva or reconstruir:
+                conn.execute(db.text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+# ============================================
+# BÚSQUEDA
+# ============================================
+
+def _claves_orden(c, orden, con_texto):
+    """Claves ORDER BY sobre las columnas `c` (modelo o subconsulta)."""
+    if orden == 'precio_asc':
+        return [c['precio'].asc(), c['id'].asc()]
+    if orden == 'precio_desc':
+        return [c['precio'].desc(), c['id'].desc()]
+    if orden == 'recientes':
+        return [c['id'].desc()]  # Los ids crecen con la fecha de alta
+    if orden == 'relevancia' and con_texto:
+        return [c['rango'].asc(), c['vendidos'].desc()]  # bm25: más negativo, más relevante
+    return [c['vendidos'].desc(), c['id'].desc()]
+
+
+def _rama(modelo, tipo, texto, filtros, orden):
+    """SELECT de productos o servicios con los filtros aplicados, sin ordenar."""
+    fts = db.table(_tabla_fts(modelo), db.column('rowid'), db.column('rank')) if texto and usa_fts() else None
+    # bm25 se calcula por cada coincidencia: solo se pide si se ordena por él
+    rango = fts.c.rank if fts is not None and orden == 'relevancia' else db.literal(0.0)
+    consulta = db.select(
+        db.literal(tipo).label('tipo'), modelo.id, modelo.nombre, modelo.descripcion, modelo.precio,
+        modelo.imagen_url, modelo.categoria_id, modelo.subcategoria_id, modelo.created_by,
+        modelo.vendidos, rango.label('rango'),
+    )
+    if fts is not None:
+        consulta = consulta.join_from(modelo, fts, fts.c.rowid == modelo.id).where(
+            db.literal_column(fts.name).op('MATCH')(expresion_fts(texto))
+        )
+    elif texto:
+        patron = f'%{texto}%'
+        consulta = consulta.where(db.or_(modelo.nombre.ilike(patron), modelo.descripcion.ilike(patron)))
+
+    if filtros.get('precio_min') is not None:
+        consulta = consulta.where(modelo.precio >= filtros['precio_min'])
+    if filtros.get('precio_max') is not None:
+        consulta = consulta.where(modelo.precio <= filtros['precio_max'])
+    if filtros.get('ruta_categoria'):
+        ruta = filtros['ruta_categoria']
+        consulta = consulta.where(db.or_(
+            modelo.categoria_id.in_(db.select(Categoria.id).where(filtro_subarbol(Categoria.ruta, ruta))),
+            modelo.subcategoria_id.in_(db.select(Subcategoria.id).where(filtro_subarbol(Subcategoria.ruta, ruta))),
+        ))
+    if filtros.get('ruta_subcategoria'):
+        consulta = consulta.where(modelo.subcategoria_id.in_(
+            db.select(Subcategoria.id).where(filtro_subarbol(Subcategoria.ruta, filtros['ruta_subcategoria']))
+        ))
+    return consulta
+
+
+def buscar_catalogo(texto='', tipo=None, filtros=None, orden='relevancia', limit=10, offset=0, contar=True):
+    """
+    Página de ítems y total. `tipo` ('producto', 'servicio' o None para ambos);
+    `filtros`: precio_min, precio_max, ruta_categoria, ruta_subcategoria.
+    `limit` se acota a 1..MAX_LIMIT. El total se cuenta hasta TOTAL_MAXIMO
+    (un total igual a TOTAL_MAXIMO significa "al menos") y es None sin `contar`.
+    """
+    filtros = filtros or {}
+    limit = max(1, min(limit, MAX_LIMIT))
+    offset = max(offset, 0)
+    texto = texto if expresion_fts(texto) else ''
+    con_texto = bool(texto)
+    ramas = [_rama(modelo, nombre, texto, filtros, orden)
+             for nombre, modelo in MODELOS.items() if tipo in (None, nombre)]
+
+    # Cada rama corta en offset + limit filas por su índice antes de mezclarse
+    paginas = [
+        rama.order_by(*_claves_orden(rama.selected_columns, orden, con_texto)).limit(offset + limit)
+        for rama in ramas
+    ]
+    if orden == 'relevancia' and con_texto and len(paginas) > 1:
+        # El bm25 de cada tabla FTS usa sus propias estadísticas: se intercalan
+        # las páginas por posición (1.º producto, 1.º servicio, 2.º producto...)
+        por_tipo = [db.session.execute(pagina).all() for pagina in paginas]
+        filas = [f for grupo in zip_longest(*por_tipo) for f in grupo if f is not None][offset:offset + limit]
+    else:
+        subconsultas = [db.select(pagina.subquery()) for pagina in paginas]
+        catalogo = (db.union_all(*subconsultas) if len(subconsultas) > 1 else subconsultas[0]).subquery()
+        filas = db.session.execute(
+            db.select(catalogo).order_by(*_claves_orden(catalogo.c, orden, con_texto)).limit(limit).offset(offset)
+        ).all()
+
+    total = None
+    if contar:
+        conteos = [db.select(db.func.count()).select_from(rama.limit(TOTAL_MAXIMO).subquery()).scalar_subquery()
+                   for rama in ramas]
+        total = min(db.session.scalar(db.select(sum(conteos[1:], conteos[0]))), TOTAL_MAXIMO)
+
+    propietarios = negocios_de_usuarios({f.created_by for f in filas if f.created_by is not None})
+    resultados = [{
+        'tipo': f.tipo,
+        'id': f.id,
+        'nombre': f.nombre,
+        'descripcion': f.descripcion,
+        'precio': f.precio,
+        'imagen_url': f.imagen_url,
+        'categoria_id': f.categoria_id,
+        'subcategoria_id': f.subcategoria_id,
+        'vendidos': f.vendidos,
+        'negocio': propietarios.get(f.created_by),
+    } for f in filas]
+    return resultados, total
+
+
+def negocios_de_usuarios(usuario_ids):
+    """{usuario_id: negocio activo de menor id} buscando en todas las particiones."""
+    if not usuario_ids:
+        return {}
+
+    def en_particion():
+        filas = db.session.execute(
+            db.select(Negocio.id, Negocio.nombre, Negocio.ubicacion, Negocio.telefono_contacto, Negocio.usuario_id)
+            .where(Negocio.usuario_id.in_(usuario_ids), Negocio.activo == True)
+        ).all()
+        return [dict(f._mapping) for f in filas]
+
+    propietarios = {}
+    for negocio in sorted((n for parte in en_todas_las_ciudades(en_particion) for n in parte),
+                          key=lambda n: n['id']):
+        propietarios.setdefault(negocio.pop('usuario_id'), negocio)
+    return propietarios
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+catalogo_cli = AppGroup('catalogo', help='Índice de búsqueda de productos y servicios.')
+
+
+@catalogo_cli.command('reindexar')
+def reindexar_command():
+    """Reconstruye los índices FTS5 desde las tablas de productos y servicios."""
+    if not usa_fts():
+        raise click.ClickException('El índice de texto solo existe en SQLite')
+    preparar_catalogo(reconstruir=True)
+    click.echo('Índices de texto reconstruidos.')
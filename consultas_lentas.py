@@ -0,0 +1,187 @@
+"""
+Registro de consultas lentas.
+Las sentencias que superan CONSULTAS_LENTAS_MS se escriben como JSON en un
+log rotativo junto con la forma de sus parámetros, la ruta que las originó y
+el resultado de EXPLAIN QUERY PLAN. La captura se muestrea
+(CONSULTAS_LENTAS_MUESTREO) y se limita por minuto para poder dejarla
+activa en producción.
+La duración cubre solo cursor.execute() (before/after_cursor_execute), no la
+lectura de las filas. En SQLite un SELECT avanza hasta la primera fila al
+ejecutarse y el resto del recorrido ocurre en fetchall(): un escaneo largo
+que devuelve muchas filas puede quedar por debajo del umbral. Esos casos
+se ven en la duración por endpoint de metricas.py y los planes de
+/api/buscar se verifican en tests/test_planes.py.
+"""
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import click
+from flask import has_request_context, request
+from flask.cli import AppGroup
+from sqlalchemy import event
+
+from perfilado import huella_sql
+
+logger = logging.getLogger('consultas_lentas')
+
+_config = {'umbral': 0.2, 'muestreo': 0.5, 'max_por_minuto': 60}
+_ventana = {'inicio': 0.0, 'capturas': 0}
+_candado = threading.Lock()
+
+
+def _forma_parametros(parametros):
+    """Tipos (y longitud de textos) de los parámetros, nunca sus valores."""
+    if isinstance(parametros, dict):
+        parametros = list(parametros.values())
+    forma = []
+    for valor in parametros or ():
+        if isinstance(valor, str):
+            forma.append(f'str({len(valor)})')
+        else:
+            forma.append(type(valor).__name__)
+    return forma
+
+
+def _permitir_captura():
+    if random.random() >= _config['muestreo']:
+        return False
+    with _candado:
+        ahora = time.monotonic()
+        if ahora - _ventana['inicio'] >= 60:
+            _ventana['inicio'], _ventana['capturas'] = ahora, 0
+        if _ventana['capturas'] >= _config['max_por_minuto']:
+            return False
+        _ventana['capturas'] += 1
+        return True
+
+
+def _explicar(conn, statement, parameters, executemany):
+    """EXPLAIN QUERY PLAN en un cursor aparte de la misma conexión (solo SQLite)."""
+    if conn.dialect.name != 'sqlite' or executemany:
+        return None
+    if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH', 'INSERT')):
+        return None
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ())
+        return [fila[-1] for fila in cursor.fetchall()]
+    except Exception as e:
+        return [f'(no disponible: {e})']
+    finally:
+        cursor.close()
+
+
+def _instrumentar_motor(bind, engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_inicios_lentas', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        inicios = conn.info.get('_inicios_lentas')
+        if not inicios:
+            return
+        duracion = time.perf_counter() - inicios.pop()
+        if duracion < _config['umbral'] or not _permitir_captura():
+            return
+        registro = {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'duracion_ms': round(duracion * 1000, 2),
+            'bind': bind or 'principal',
+            'huella': huella_sql(statement),
+            'sentencia': statement,
+            'parametros': _forma_parametros(parameters) if not executemany else [f'executemany({len(parameters)})'],
+            'ruta': f'{request.method} {request.endpoint or request.path}' if has_request_context() else None,
+            'plan': _explicar(conn, statement, parameters, executemany),
+        }
+        logger.warning(json.dumps(registro, ensure_ascii=False))
+
+
+def _archivo_log(app):
+    return os.environ.get('CONSULTAS_LENTAS_LOG') or os.path.join(app.instance_path, 'consultas_lentas.log')
+
+
+def configurar_consultas_lentas(app):
+    """
+    Activa el registro salvo CONSULTAS_LENTAS_MS=0. Variables:
+    CONSULTAS_LENTAS_MS (umbral, 200), CONSULTAS_LENTAS_MUESTREO (0.5),
+    CONSULTAS_LENTAS_MAX_MINUTO (60) y CONSULTAS_LENTAS_LOG (ruta del log).
+    El umbral se compara con el tiempo de cursor.execute(), sin la lectura
+    de filas (ver el docstring del módulo): en SQLite conviene bajarlo.
+    """
+    umbral_ms = float(os.environ.get('CONSULTAS_LENTAS_MS', 200))
+    app.config.setdefault('CONSULTAS_LENTAS_MS', umbral_ms)
+    if not app.config['CONSULTAS_LENTAS_MS']:
+        return
+    _config['umbral'] = app.config['CONSULTAS_LENTAS_MS'] / 1000
+    _config['muestreo'] = float(os.environ.get('CONSULTAS_LENTAS_MUESTREO', 0.5))
+    _config['max_por_minuto'] = int(os.environ.get('CONSULTAS_LENTAS_MAX_MINUTO', 60))
+
+    if not logger.handlers:
+        # delay=True: el archivo se crea con la primera consulta lenta, no al arrancar
+        manejador = RotatingFileHandler(_archivo_log(app), maxBytes=5 * 1024 * 1024, backupCount=5, delay=True)
+        manejador.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(manejador)
+        logger.propagate = False
+
+    from models import db
+    with app.app_context():
+        for bind, engine in db.engines.items():
+            _instrumentar_motor(bind, engine)
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+consultas_lentas_cli = AppGroup('consultas-lentas', help='Análisis del log de consultas lentas.')
+
+
+@consultas_lentas_cli.command('resumen')
+@click.option('--top', default=10, show_default=True, help='Número de sentencias a mostrar.')
+@click.option('--archivo', default=None, help='Log a analizar (incluye sus rotaciones .1, .2...).')
+def resumen_command(top, archivo):
+    """Sentencias con mayor tiempo total acumulado en el log."""
+    from flask import current_app
+    archivo = archivo or _archivo_log(current_app)
+
+    grupos = defaultdict(lambda: {'veces': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rutas': set(), 'plan': None})
+    for ruta in sorted(glob.glob(archivo + '*')):
+        with open(ruta, encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue
+                grupo = grupos[registro['huella']]
+                grupo['veces'] += 1
+                grupo['total_ms'] += registro['duracion_ms']
+                grupo['max_ms'] = max(grupo['max_ms'], registro['duracion_ms'])
+                if registro.get('ruta'):
+                    grupo['rutas'].add(registro['ruta'])
+                grupo['plan'] = registro.get('plan') or grupo['plan']
+
+    if not grupos:
+        click.echo(f'Sin consultas lentas registradas en {archivo}')
+        return
+
+    peores = sorted(grupos.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:top]
+    for posicion, (huella, grupo) in enumerate(peores, start=1):
+        click.echo(
+            f'{posicion:>2}. total {grupo["total_ms"]:10.1f} ms  veces {grupo["veces"]:5d}  '
+            f'prom {grupo["total_ms"] / grupo["veces"]:8.1f} ms  max {grupo["max_ms"]:8.1f} ms'
+        )
+        click.echo(f'    {huella[:200]}')
+        if grupo['rutas']:
+            click.echo(f'    rutas: {", ".join(sorted(grupo["rutas"]))}')
+        for paso in grupo['plan'] or []:
+            click.echo(f'    plan: {paso}')
+
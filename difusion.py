@@ -0,0 +1,273 @@
+"""
+Campañas de difusión por WhatsApp.
+Una campaña guarda una plantilla y una consulta de destinatarios; al crearla
+se materializan sus destinatarios en campana_destinatarios con un solo
+INSERT ... SELECT. El envío usa un pool de hilos sobre la sesión keep-alive
+de messenger y una cubeta de tokens global, y registra el resultado de cada
+destinatario por lotes, así que una campaña interrumpida se reanuda desde
+los pendientes sin repetir los ya enviados.
+"""
+import json
+import os
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, select, update
+
+from basedatos import insert_con_conflicto
+from messenger import enviar_mensaje_detallado
+from models import Campana, CampanaDestinatario, Negocio, Subcategoria, Categoria, db, filtro_subarbol
+from particiones import ciudades, en_todas_las_ciudades
+
+HILOS = int(os.environ.get('CAMPANAS_HILOS', 8))
+POR_SEGUNDO = float(os.environ.get('CAMPANAS_POR_SEGUNDO', 20))
+TAMANO_LOTE = 100  # Resultados por commit; tras una caída se reenvía como mucho un lote
+
+# Sin latido durante este tiempo, una campaña 'en_curso' se considera interrumpida
+LATIDO_MAXIMO = timedelta(minutes=2)
+# Cada cuánto el proceso que envía renueva el latido, aunque el lote no haya terminado
+INTERVALO_LATIDO = LATIDO_MAXIMO / 4
+
+# Únicos campos que puede usar una plantilla, sin atributos, índices ni formato
+CAMPOS_PLANTILLA = ('nombre', 'ubicacion')
+
+
+class CampanaEnCurso(Exception):
+    """Otro proceso está enviando la campaña."""
+
+
+class CubetaTokens:
+    """Limitador global de mensajes por segundo compartido por todos los hilos."""
+
+    def __init__(self, por_segundo, capacidad=None):
+        self.por_segundo = por_segundo
+        self.capacidad = capacidad or max(por_segundo, 1)
+        self._tokens = self.capacidad
+        self._actualizado = time.monotonic()
+        self._candado = threading.Lock()
+
+    def tomar(self):
+        while True:
+            with self._candado:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._actualizado) * self.por_segundo)
+                self._actualizado = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.por_segundo
+            time.sleep(espera)
+
+
+# ============================================
+# CONSULTAS DE DESTINATARIOS
+# ============================================
+
+def _duenos_negocios_activos(filtros):
+    """Negocios activos con WhatsApp (o teléfono); filtros: categoria_id, ubicacion, verificacion."""
+    telefono = db.func.coalesce(Negocio.whatsapp_contacto, Negocio.telefono_contacto)
+    consulta = select(db.func.min(Negocio.id).label('id')).where(
+        Negocio.activo.is_(True), telefono.isnot(None), telefono != ''
+    )
+    if filtros.get('categoria_id'):
+        ruta = db.session.scalar(select(Categoria.ruta).where(Categoria.id == int(filtros['categoria_id'])))
+        if ruta is None:
+            raise ValueError('Categoría no encontrada')
+        subarbol = select(Subcategoria.id).where(filtro_subarbol(Subcategoria.ruta, ruta))
+        consulta = consulta.where(Negocio.subcategoria_id.in_(subarbol))
+    if filtros.get('ubicacion'):
+        consulta = consulta.where(Negocio.ubicacion.ilike(f"%{filtros['ubicacion']}%"))
+    if filtros.get('verificacion'):
+        consulta = consulta.where(Negocio.verificacion == filtros['verificacion'])
+    # Un mensaje por número aunque tenga varios negocios: nombre y ubicación
+    # salen de la misma fila (la de menor id), no de mínimos por separado
+    elegidos = consulta.group_by(telefono).subquery()
+    return select(Negocio.id, Negocio.nombre, Negocio.ubicacion, telefono).join(
+        elegidos, elegidos.c.id == Negocio.id
+    )
+
+
+DESTINATARIOS = {
+    'duenos_negocios_activos': _duenos_negocios_activos,
+}
+
+
+def validar_plantilla(plantilla):
+    """Lanza ValueError si la plantilla no es válida o usa algo más que {nombre} y {ubicacion}."""
+    try:
+        partes = list(string.Formatter().parse(plantilla))
+    except ValueError as e:
+        raise ValueError(f'Plantilla inválida: {e}. Use {{{{ y }}}} para escribir llaves')
+    for _, campo, formato, conversion in partes:
+        if campo is None:
+            continue
+        if campo not in CAMPOS_PLANTILLA or formato or conversion:
+            raise ValueError(f'Campo no permitido en la plantilla: {{{campo}}}. '
+                             f'Campos disponibles: {", ".join("{" + c + "}" for c in CAMPOS_PLANTILLA)}')
+
+
+def crear_campana(nombre, plantilla, destinatarios, filtros=None, usuario_id=None):
+    """Crea la campaña y materializa sus destinatarios. Devuelve la Campana."""
+    validar_plantilla(plantilla)
+    if destinatarios not in DESTINATARIOS:
+        raise ValueError(f'Destinatarios desconocidos: {destinatarios}. Opciones: {", ".join(DESTINATARIOS)}')
+    filtros = filtros or {}
+    campana = Campana(nombre=nombre, plantilla=plantilla, destinatarios=destinatarios,
+                      filtros=json.dumps(filtros), created_by=usuario_id)
+    db.session.add(campana)
+    db.session.flush()
+
+    columnas = ['negocio_id', 'nombre', 'ubicacion', 'telefono', 'campana_id', 'estado']
+    origen = DESTINATARIOS[destinatarios](filtros).add_columns(db.literal(campana.id), db.literal('pendiente'))
+    if not ciudades():
+        db.session.execute(insert(CampanaDestinatario).from_select(columnas, origen))
+    else:
+        # Los negocios están repartidos en particiones: se leen en cada una y
+        # se insertan aquí; un teléfono repetido entre ciudades se ignora
+        partes = en_todas_las_ciudades(lambda: [tuple(fila) for fila in db.session.execute(origen)])
+        filas = [dict(zip(columnas, fila)) for parte in partes for fila in parte]
+        if filas:
+            db.session.execute(insert_con_conflicto(CampanaDestinatario, db.engine).on_conflict_do_nothing(
+                index_elements=['campana_id', 'telefono']
+            ), filas)
+    db.session.commit()
+    return campana
+
+
+def resumen_campana(campana_id):
+    """Conteo de destinatarios por estado en una consulta."""
+    filas = db.session.query(CampanaDestinatario.estado, db.func.count()).filter(
+        CampanaDestinatario.campana_id == campana_id
+    ).group_by(CampanaDestinatario.estado).all()
+    return {estado: total for estado, total in filas}
+
+
+# ============================================
+# ENVÍO
+# ============================================
+
+def _tomar_campana(campana_id):
+    """Marca la campaña como en curso salvo que otro proceso la esté enviando."""
+    ahora = datetime.now()
+    resultado = db.session.execute(
+        update(Campana).where(
+            Campana.id == campana_id,
+            db.or_(Campana.estado != 'en_curso', Campana.latido.is_(None), Campana.latido < ahora - LATIDO_MAXIMO),
+        ).values(estado='en_curso', latido=ahora)
+    )
+    db.session.commit()
+    if resultado.rowcount == 0:
+        raise CampanaEnCurso(f'La campaña {campana_id} ya se está enviando')
+
+
+def ejecutar_campana(campana_id, enviar=enviar_mensaje_detallado, hilos=HILOS, por_segundo=POR_SEGUNDO,
+                     reintentar_errores=False):
+    """
+    Envía los destinatarios pendientes (y los fallidos si `reintentar_errores`)
+    por lotes en orden de id. Devuelve el resumen por estado al terminar.
+    Si algo falla la campaña queda 'fallida' y se puede reanudar.
+    """
+    _tomar_campana(campana_id)
+    try:
+        resumen = _enviar_pendientes(campana_id, enviar, hilos, por_segundo, reintentar_errores)
+    except Exception:
+        db.session.rollback()
+        db.session.execute(update(Campana).where(Campana.id == campana_id).values(estado='fallida'))
+        db.session.commit()
+        raise
+    return resumen
+
+
+def _latir(campana_id):
+    db.session.execute(update(Campana).where(Campana.id == campana_id).values(latido=datetime.now()))
+    db.session.commit()
+
+
+def _enviar_pendientes(campana_id, enviar, hilos, por_segundo, reintentar_errores):
+    campana = db.session.get(Campana, campana_id)
+    validar_plantilla(campana.plantilla)
+    plantilla = campana.plantilla
+    estados = ['pendiente', 'error'] if reintentar_errores else ['pendiente']
+    cubeta = CubetaTokens(por_segundo)
+
+    def enviar_uno(destinatario):
+        cubeta.tomar()
+        mensaje = plantilla.format(nombre=destinatario.nombre or '', ubicacion=destinatario.ubicacion or '')
+        status, detalle = enviar(destinatario.telefono, mensaje)
+        return {
+            'id': destinatario.id,
+            'estado': 'enviado' if status is not None and status < 400 else 'error',
+            'status_http': status,
+            'respuesta': detalle,
+            'enviado_at': datetime.now(),
+        }
+
+    ultimo_id = 0
+    ultimo_latido = time.monotonic()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        while True:
+            lote = db.session.execute(
+                select(CampanaDestinatario.id, CampanaDestinatario.telefono,
+                       CampanaDestinatario.nombre, CampanaDestinatario.ubicacion)
+                .where(CampanaDestinatario.campana_id == campana_id,
+                       CampanaDestinatario.estado.in_(estados),
+                       CampanaDestinatario.id > ultimo_id)
+                .order_by(CampanaDestinatario.id)
+                .limit(TAMANO_LOTE)
+            ).all()
+            if not lote:
+                break
+            resultados = []
+            # Un lote lento (pocos mensajes por segundo) no debe dejar vencer el latido
+            for resultado in pool.map(enviar_uno, lote):
+                resultados.append(resultado)
+                if time.monotonic() - ultimo_latido >= INTERVALO_LATIDO.total_seconds():
+                    _latir(campana_id)
+                    ultimo_latido = time.monotonic()
+            db.session.execute(update(CampanaDestinatario), resultados)
+            _latir(campana_id)
+            ultimo_latido = time.monotonic()
+            ultimo_id = lote[-1].id
+
+    db.session.execute(update(Campana).where(Campana.id == campana_id).values(estado='completada'))
+    db.session.commit()
+    return resumen_campana(campana_id)
+
+
+def lanzar_campana(app, campana_id, **opciones):
+    """Envía la campaña en un hilo de fondo con su propio contexto de aplicación."""
+    def trabajo():
+        with app.app_context():
+            try:
+                ejecutar_campana(campana_id, **opciones)
+            except CampanaEnCurso:
+                pass
+            except Exception:
+                app.logger.exception('La campaña %s falló y quedó marcada como fallida', campana_id)
+    hilo = threading.Thread(target=trabajo, name=f'campana-{campana_id}', daemon=True)
+    hilo.start()
+    return hilo
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+campanas_cli = AppGroup('campanas', help='Campañas de difusión por WhatsApp.')
+
+
+@campanas_cli.command('reanudar')
+@click.argument('campana_id', type=int)
+@click.option('--reintentar-errores', is_flag=True, help='Vuelve a enviar también los destinatarios con error.')
+def reanudar_command(campana_id, reintentar_errores):
+    """Continúa una campaña interrumpida desde sus destinatarios pendientes."""
+    try:
+        resumen = ejecutar_campana(campana_id, reintentar_errores=reintentar_errores)
+    except CampanaEnCurso as e:
+        raise click.ClickException(str(e))
+    click.echo(', '.join(f'{estado}: {total}' for estado, total in sorted(resumen.items())))
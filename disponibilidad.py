@@ -0,0 +1,209 @@
+"""
+Motor de disponibilidad de citas.
+Compila Negocio.horarios (JSON como {'lunes_viernes': '8:00-18:00',
+'sabado': '9:00-13:00'}) en un mapa de bits por día de la semana, donde cada
+bit es un turno de AGENDA_TURNO_MINUTOS. Los turnos libres de una fecha son
+`abierto & ~ocupado`, con los agendamientos pendientes o confirmados como
+ocupados. La compilación se cachea por texto de horarios, así que solo se
+repite cuando un negocio cambia su horario.
+"""
+import json
+import os
+import unicodedata
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+from sqlalchemy.exc import IntegrityError
+
+from models import Agendamiento, Negocio, db
+
+MINUTOS_TURNO = int(os.environ.get('AGENDA_TURNO_MINUTOS', 30))
+
+# Estados que ocupan un turno (ver índice uq_agendamiento_turno en models.py)
+ESTADOS_OCUPADOS = ('pendiente', 'confirmado')
+
+DIAS = ('lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo')
+
+
+class TurnoNoDisponible(Exception):
+    """El turno pedido está fuera del horario o ya fue reservado."""
+
+
+class FechaInvalida(ValueError):
+    """La fecha pedida no coincide con el inicio de un turno."""
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode()
+    return texto.strip().lower().replace(' ', '_').replace('-', '_')
+
+
+def _dias_de_clave(clave):
+    """'lunes_viernes' -> lunes..viernes; 'sabado' -> sabado; 'lunes_domingo' -> todos."""
+    partes = [p for p in _normalizar(clave).split('_') if p in DIAS]
+    if len(partes) == 1:
+        return [DIAS.index(partes[0])]
+    if len(partes) == 2:
+        inicio, fin = DIAS.index(partes[0]), DIAS.index(partes[1])
+        return [(inicio + i) % 7 for i in range((fin - inicio) % 7 + 1)]
+    return []
+
+
+def _minutos(hora):
+    horas, _, minutos = hora.strip().partition(':')
+    return int(horas) * 60 + int(minutos or 0)
+
+
+def _mascara_intervalos(valor, minutos_turno):
+    """'8:00-12:00, 14:00-18:00' (o lista) -> bits de los turnos que caben completos."""
+    if isinstance(valor, str):
+        if _normalizar(valor) in ('cerrado', ''):
+            return 0
+        valor = valor.split(',')
+    mascara = 0
+    for intervalo in valor:
+        inicio, _, fin = str(intervalo).partition('-')
+        inicio, fin = _minutos(inicio), _minutos(fin)
+        primero = -(-inicio // minutos_turno)  # el turno debe empezar dentro del horario
+        ultimo = fin // minutos_turno
+        if ultimo > primero:
+            mascara |= ((1 << (ultimo - primero)) - 1) << primero
+    return mascara
+
+
+@lru_cache(maxsize=4096)
+def compilar_horarios(horarios, minutos_turno=MINUTOS_TURNO):
+    """
+    Texto JSON de horarios -> tupla de 7 máscaras (lunes a domingo).
+    Las claves de un solo día prevalecen sobre los rangos ('domingo' sobre
+    'lunes_domingo'). Un horario ilegible se trata como cerrado.
+    """
+    semana = [0] * 7
+    try:
+        datos = json.loads(horarios) if horarios else {}
+        # Primero los rangos y después los días sueltos, que los sobrescriben
+        for clave, valor in sorted(datos.items(), key=lambda item: len(_dias_de_clave(item[0])) == 1):
+            mascara = _mascara_intervalos(valor, minutos_turno)
+            for dia in _dias_de_clave(clave):
+                semana[dia] = mascara
+    except (AttributeError, TypeError, ValueError):
+        return (0,) * 7
+    return tuple(semana)
+
+
+def _indice_turno(momento, minutos_turno):
+    return (momento.hour * 60 + momento.minute) // minutos_turno
+
+
+@lru_cache(maxsize=4096)
+def _turnos_de_mascara(mascara, minutos_turno):
+    """Máscara -> horas de inicio ('08:00', ...). Casi todos los días repiten máscara."""
+    return tuple(
+        f'{i * minutos_turno // 60:02d}:{i * minutos_turno % 60:02d}'
+        for i in range(mascara.bit_length()) if mascara >> i & 1
+    )
+
+
+def disponibilidad_negocios(negocio_ids, desde, hasta, ahora=None, minutos_turno=MINUTOS_TURNO, sesion=None):
+    """
+    Turnos libres de varios negocios entre las fechas `desde` y `hasta`
+    (incluidas) con dos consultas en total. `sesion` permite usarla fuera de
+    Flask-SQLAlchemy (p. ej. AsyncSession.run_sync en api_async.py).
+    Devuelve {negocio_id: [{'fecha': 'YYYY-MM-DD', 'turnos': ['08:00', ...]}]}.
+    """
+    ahora = ahora or datetime.now()
+    sesion = sesion or db.session
+    horarios = dict(
+        sesion.query(Negocio.id, Negocio.horarios).filter(Negocio.id.in_(negocio_ids)).all()
+    )
+    ocupados = {}
+    reservas = sesion.query(Agendamiento.id_negocio, Agendamiento.fecha_agendada).filter(
+        Agendamiento.id_negocio.in_(list(horarios)),
+        Agendamiento.fecha_agendada >= datetime.combine(desde, time.min),
+        Agendamiento.fecha_agendada < datetime.combine(hasta + timedelta(days=1), time.min),
+        Agendamiento.estado.in_(ESTADOS_OCUPADOS),
+    )
+    for negocio_id, fecha_agendada in reservas:
+        clave = (negocio_id, fecha_agendada.date())
+        ocupados[clave] = ocupados.get(clave, 0) | (1 << _indice_turno(fecha_agendada, minutos_turno))
+
+    # Turnos del día de hoy que ya empezaron
+    pasados_hoy = (1 << (_indice_turno(ahora, minutos_turno) + 1)) - 1
+
+    resultado = {}
+    for negocio_id, texto in horarios.items():
+        semana = compilar_horarios(texto, minutos_turno)
+        dias = []
+        fecha = desde
+        while fecha <= hasta:
+            libres = semana[fecha.weekday()] & ~ocupados.get((negocio_id, fecha), 0)
+            if fecha == ahora.date():
+                libres &= ~pasados_hoy
+            elif fecha < ahora.date():
+                libres = 0
+            if libres:
+                dias.append({
+                    'fecha': fecha.isoformat(),
+                    'turnos': list(_turnos_de_mascara(libres, minutos_turno)),
+                })
+            fecha += timedelta(days=1)
+        resultado[negocio_id] = dias
+    return resultado
+
+
+def _hora_local(momento):
+    """Fecha con zona -> hora local sin zona, como se guardan los agendamientos."""
+    if momento.tzinfo is not None:
+        return momento.astimezone().replace(tzinfo=None)
+    return momento
+
+
+def reservar_turno(negocio_id, fecha_agendada, minutos_turno=MINUTOS_TURNO, sesion=None, **datos):
+    """
+    Crea un Agendamiento en el turno que empieza en `fecha_agendada` si está
+    dentro del horario del negocio. La fecha debe caer en la grilla de turnos
+    (10:00 o 10:30 con turnos de 30 minutos, no 10:15); con zona horaria se
+    convierte a la hora local. Una reserva previa dentro del turno, aunque no
+    esté alineada, lo ocupa. La exclusión entre reservas simultáneas la
+    garantiza el índice único parcial (id_negocio, fecha_agendada).
+    Lanza FechaInvalida o TurnoNoDisponible.
+    """
+    sesion = sesion or db.session
+    inicio = _hora_local(fecha_agendada)
+    indice = _indice_turno(inicio, minutos_turno)
+    if inicio != datetime.combine(inicio.date(), time.min) + timedelta(minutes=indice * minutos_turno):
+        raise FechaInvalida(f'La fecha debe coincidir con el inicio de un turno de {minutos_turno} minutos')
+
+    negocio = sesion.get(Negocio, negocio_id)
+    if negocio is None:
+        raise TurnoNoDisponible('Negocio no encontrado')
+    if inicio < datetime.now() or not compilar_horarios(negocio.horarios, minutos_turno)[inicio.weekday()] >> indice & 1:
+        raise TurnoNoDisponible('El horario solicitado está fuera de la atención del negocio')
+
+    # Reservas antiguas fuera de la grilla: el índice único no las ve
+    ocupado = sesion.query(Agendamiento.id).filter(
+        Agendamiento.id_negocio == negocio_id,
+        Agendamiento.fecha_agendada >= inicio,
+        Agendamiento.fecha_agendada < inicio + timedelta(minutes=minutos_turno),
+        Agendamiento.estado.in_(ESTADOS_OCUPADOS),
+    ).first()
+    if ocupado is not None:
+        raise TurnoNoDisponible('El horario solicitado ya fue reservado')
+
+    agendamiento = Agendamiento(id_negocio=negocio_id, fecha_agendada=inicio, estado='pendiente', **datos)
+    sesion.add(agendamiento)
+    try:
+        sesion.commit()
+    except IntegrityError:
+        sesion.rollback()
+        raise TurnoNoDisponible('El horario solicitado ya fue reservado')
+    return agendamiento
+
+
+def rango_fechas(desde, hasta, dias_por_defecto=7, maximo=31):
+    """Interpreta ?desde=&hasta= (YYYY-MM-DD); lanza ValueError si no son válidas."""
+    desde = date.fromisoformat(desde) if desde else date.today()
+    hasta = date.fromisoformat(hasta) if hasta else desde + timedelta(days=dias_por_defecto - 1)
+    if hasta < desde:
+        raise ValueError('hasta debe ser posterior a desde')
+    return desde, min(hasta, desde + timedelta(days=maximo - 1))
@@ -3,71 +3,40 @@ Módulo para funciones relacionadas con el chatbot y API de búsqueda.
 Contiene endpoints y lógica para el agente IA en n8n.
 """
 import time
-from flask import Blueprint, jsonify, request
-from flask_login import login_required
-from models import Producto, Servicio, db, Categoria, Subcategoria, Negocio, Agendamiento, User
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user, login_required
+from models import Producto, Servicio, db, Categoria, Subcategoria, Negocio, Agendamiento, User, Campana, filtro_subarbol
 from datetime import datetime, timedelta
+from archivo import contar_historial
+from basedatos import solo_lectura
+from limitador import token_n8n_valido, verificar_envio
+from catalogo import MAX_LIMIT, ORDENES, TOTAL_MAXIMO, buscar_catalogo
+from difusion import crear_campana, lanzar_campana, resumen_campana
+from disponibilidad import FechaInvalida, TurnoNoDisponible, disponibilidad_negocios, rango_fechas, reservar_turno
+from menus import obtener_mensaje, preparar_respuesta_whatsapp
+from messenger import enviar_mensaje_detallado
+from particiones import en_todas_las_ciudades, seleccionar_ciudad
 import json
 
 # Crear blueprint para las rutas de API
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Negocios, agendamientos y reseñas se leen de la partición de la ciudad (particiones.py)
+api_bp.before_request(seleccionar_ciudad)
+
 # ============================================
 # 1. ESTRUCTURA DE BASE DE DATOS MEJORADA
 # ============================================
 
-def inicializar_estructura_chatbot():
-    """
-    Inicializa la estructura de categorías jerárquicas para el chatbot.
-    Se ejecuta al inicio de la aplicación.
-    """
-    # Categorías principales (Nivel 1)
-    categorias_principales = [
-        ('Servicios Profesionales', 'servicio'),
-        ('Alimentos y Bebidas', 'producto'),
-        ('Salud y Bienestar', 'servicio'),
-        ('Educación', 'servicio'),
-        ('Tecnología', 'producto'),
-        ('Hogar y Construcción', 'producto'),
-        ('Automotriz', 'servicio'),
-        ('Entretenimiento', 'servicio'),
-        ('Moda y Belleza', 'producto'),
-        ('Otros', 'mixto')
-    ]
-    
-    admin_user = User.query.filter_by(username='admin').first()
-    if not admin_user:
-        return
-    
-    # Crear categorías principales
-    for nombre, tipo in categorias_principales:
-        if not Categoria.query.filter_by(nombre=nombre).first():
-            categoria = Categoria(
-                nombre=nombre,
-                tipo=tipo,
-                nivel=1,
-                orden=len(Categoria.query.filter_by(nivel=1).all()) + 1,
-                created_by=admin_user.id
-            )
-            db.session.add(categoria)
-            db.session.flush()
-            
-            # Crear subcategorías según la categoría principal
-            subcategorias = obtener_subcategorias_por_categoria(nombre)
-            for subcat_nombre in subcategorias:
-                subcategoria = Subcategoria(
-                    nombre=subcat_nombre,
-                    categoria_id=categoria.id,
-                    nivel=2,
-                    created_by=admin_user.id
-                )
-                db.session.add(subcategoria)
+# Las categorías del chatbot se declaran en taxonomia.json y se sincronizan
+# con taxonomia.sincronizar_taxonomia() (flask --app app taxonomia sync).
 
 # ============================================
 # 2. ENDPOINTS PARA EL CHATBOT (n8n)
 # ============================================
 
 @api_bp.route('/categorias', methods=['GET'])
+@solo_lectura
 def get_categorias():
     """Retorna las categorías principales para el primer nivel del chatbot."""
     categorias = Categoria.query.filter_by(nivel=1).order_by(Categoria.orden).all()
@@ -75,10 +44,9 @@ def get_categorias():
         {'id': c.id, 'nombre': c.nombre, 'tipo': c.tipo} 
         for c in categorias
     ])
-    
-    return jsonify({'categorias': resultado, 'total': len(resultado)})
 
 @api_bp.route('/subcategorias/<int:categoria_id>', methods=['GET'])
+@solo_lectura
 def get_subcategorias(categoria_id):
     """Retorna las subcategorías de una categoría específica."""
     subcategorias = Subcategoria.query.filter_by(categoria_id=categoria_id).all()
@@ -87,7 +55,61 @@ def get_subcategorias(categoria_id):
         for s in subcategorias
     ])
 
+@api_bp.route('/categorias/<int:categoria_id>/negocios', methods=['GET'])
+@solo_lectura
+def get_negocios_subarbol(categoria_id):
+    """
+    Negocios activos en cualquier nivel bajo una categoría: por su subcategoría
+    o por los productos/servicios de su dueño. Una sola consulta sobre el
+    índice de rutas, sin recorrer la jerarquía nodo por nodo.
+    Endpoint: GET /api/categorias/<id>/negocios?limit=10&offset=0
+    """
+    categoria = Categoria.query.get_or_404(categoria_id)
+    if categoria.ruta is None:
+        # Fila anterior a reconstruir_rutas (init-db): sin ruta no hay subárbol que buscar
+        return jsonify({'error': 'Categoría sin ruta; ejecute flask --app app init-db'}), 404
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    
+    paginas = en_todas_las_ciudades(_negocios_subarbol_en_particion, categoria.ruta, limit + offset)
+    negocios = sorted((n for pagina, _ in paginas for n in pagina), key=lambda n: n['id'])[offset:offset + limit]
+    
+    return jsonify({
+        'categoria': {'id': categoria.id, 'nombre': categoria.nombre},
+        'breadcrumb': categoria.breadcrumb(),
+        'resultados': negocios,
+        'total': sum(total for _, total in paginas),
+        'limit': limit,
+        'offset': offset
+    })
+
+def _negocios_subarbol_en_particion(ruta, limit):
+    """Primeros `limit` negocios del subárbol y total en la partición actual."""
+    categorias_ids = db.select(Categoria.id).where(filtro_subarbol(Categoria.ruta, ruta))
+    subcategorias_ids = db.select(Subcategoria.id).where(filtro_subarbol(Subcategoria.ruta, ruta))
+    duenos = db.union(
+        db.select(Producto.created_by).where(db.or_(
+            Producto.categoria_id.in_(categorias_ids),
+            Producto.subcategoria_id.in_(subcategorias_ids)
+        )),
+        db.select(Servicio.created_by).where(db.or_(
+            Servicio.categoria_id.in_(categorias_ids),
+            Servicio.subcategoria_id.in_(subcategorias_ids)
+        ))
+    )
+    
+    consulta = Negocio.query.filter(
+        Negocio.activo == True,
+        db.or_(
+            Negocio.subcategoria_id.in_(subcategorias_ids),
+            Negocio.usuario_id.in_(duenos)
+        )
+    )
+    negocios = consulta.order_by(Negocio.id).limit(limit).all()
+    return [n.to_dict() for n in negocios], consulta.count()
+
 @api_bp.route('/vendedores/<int:subcategoria_id>', methods=['GET'])
+@solo_lectura
 def get_vendedores_por_subcategoria(subcategoria_id):
     """
     Busca negocios que tengan productos o servicios en una subcategoría.
@@ -99,70 +121,234 @@ def get_vendedores_por_subcategoria(subcategoria_id):
     user_ids = [r[0] for r in prod_users.all()] + [r[0] for r in serv_users.all()]
     user_ids = list(set(user_ids)) # Unificar IDs únicos
 
-    # Obtener los negocios de esos usuarios
-    negocios = Negocio.query.filter(Negocio.usuario_id.in_(user_ids), Negocio.activo == True).all()
+    # Obtener los negocios de esos usuarios en todas las particiones
+    def negocios_de_usuarios():
+        negocios = Negocio.query.filter(Negocio.usuario_id.in_(user_ids), Negocio.activo == True).all()
+        return [{'id': n.id, 'nombre': n.nombre, 'descripcion': n.descripcion_corta} for n in negocios]
     
-    return jsonify([
-        {'id': n.id, 'nombre': n.nombre, 'descripcion': n.descripcion_corta} 
-        for n in negocios
-    ])
+    return jsonify([n for parte in en_todas_las_ciudades(negocios_de_usuarios) for n in parte])
 
 @api_bp.route('/buscar', methods=['GET'])
+@solo_lectura
 def buscar_negocios():
     """
     Buscar negocios por especialidad o palabra clave.
-    Endpoint: GET /api/buscar?q=palabra&especialidad_id=X&limit=10
+    Endpoint: GET /api/buscar?q=palabra&especialidad_id=X&sort=calificacion&limit=10
+    sort: relevancia (destacados y mejor calificados, por defecto), calificacion,
+    precio_asc, precio_desc, destacados, popularidad.
+    Incluye 'facetas': conteos por categoría, subcategoría, ciudad y banda de
+    precio sobre todos los resultados, para que el chatbot ofrezca refinar.
     """
     query = request.args.get('q', '').strip()
     especialidad_id = request.args.get('especialidad_id', type=int)
-    limit = request.args.get('limit', 10, type=int)
-    offset = request.args.get('offset', 0, type=int)
+    orden = request.args.get('sort', 'relevancia')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if orden not in ORDENES_BUSQUEDA:
+        return jsonify({'error': f"sort debe ser uno de: {', '.join(ORDENES_BUSQUEDA)}"}), 400
+    
+    # Cada partición devuelve sus primeros offset+limit en el orden pedido; se mezclan por la misma clave
+    paginas = en_todas_las_ciudades(_buscar_en_particion, query, especialidad_id, orden, limit + offset)
+    descendente, _ = ORDENES_BUSQUEDA[orden]
+    filas = sorted((f for pagina, _, _ in paginas for f in pagina), key=lambda f: f[0], reverse=descendente)
+    negocios = [negocio for _, negocio in filas[offset:offset + limit]]
     
-    # Construir consulta base
-    consulta = Negocio.query.filter_by(activo=True)
+    return jsonify({
+        'query': query,
+        'especialidad_id': especialidad_id,
+        'sort': orden,
+        'resultados': negocios,
+        'total': sum(total for _, total, _ in paginas),
+        'facetas': resumir_facetas(grupo for _, _, grupos in paginas for grupo in grupos),
+        'limit': limit,
+        'offset': offset
+    })
+
+# sort= de /api/buscar -> (descendente, columnas de Negocio). Cada orden tiene
+# un índice (activo, columnas...) en models.py: SQLite lo recorre en orden y
+# se detiene en LIMIT, sin ordenar en memoria. El id (rowid, al final de todo
+# índice) desempata. Verificación: tests/test_planes.py
+ORDENES_BUSQUEDA = {
+    'relevancia': (True, ('destacado', 'calificacion_promedio', 'id')),
+    'calificacion': (True, ('calificacion_promedio', 'total_resenas', 'id')),
+    'precio_asc': (False, ('precio_estimado', 'id')),
+    'precio_desc': (True, ('precio_estimado', 'id')),
+    'destacados': (True, ('destacado', 'total_agendamientos', 'id')),
+    'popularidad': (True, ('total_agendamientos', 'id')),
+}
+
+def claves_busqueda(orden):
+    """Claves ORDER BY de `orden`; los NULL quedan al final en ambos sentidos."""
+    descendente, campos = ORDENES_BUSQUEDA[orden]
+    claves = []
+    for campo in campos:
+        columna = getattr(Negocio, campo)
+        if descendente:
+            claves.append(columna.desc())  # En SQLite NULL es el menor: DESC lo deja al final
+        else:
+            if columna.nullable:
+                claves.append(columna.is_(None))
+            claves.append(columna.asc())
+    return claves
+
+def _clave_python(orden, negocio):
+    """La misma clave que claves_busqueda(), para mezclar particiones en Python."""
+    descendente, campos = ORDENES_BUSQUEDA[orden]
+    clave = []
+    for campo in campos:
+        valor = getattr(negocio, campo)
+        clave += [valor is not None, valor] if descendente else [valor is None, valor]
+    return tuple(clave)
+
+def condiciones_busqueda(query, especialidad_id):
+    """Filtros WHERE de /api/buscar (compartidos con api_async.py)."""
+    condiciones = [Negocio.activo == True]
     
     # Filtrar por especialidad si se proporciona
     if especialidad_id:
-        consulta = consulta.filter_by(subcategoria_id=especialidad_id)
+        condiciones.append(Negocio.subcategoria_id == especialidad_id)
     
     # Filtrar por palabra clave si se proporciona
     if query:
         search_pattern = f'%{query}%'
-        consulta = consulta.filter(
-            db.or_(
-                Negocio.nombre.ilike(search_pattern),
-                Negocio.descripcion_corta.ilike(search_pattern),
-                Negocio.descripcion_larga.ilike(search_pattern),
-                Negocio.palabras_clave.ilike(search_pattern)
-            )
-        )
+        condiciones.append(db.or_(
+            Negocio.nombre.ilike(search_pattern),
+            Negocio.descripcion_corta.ilike(search_pattern),
+            Negocio.descripcion_larga.ilike(search_pattern),
+            Negocio.palabras_clave.ilike(search_pattern)
+        ))
+    return condiciones
+
+# Cortes de Negocio.precio_estimado para la faceta de precio
+BANDAS_PRECIO = (10, 25, 50, 100)
+
+def _banda_precio():
+    cortes = list(zip((0,) + BANDAS_PRECIO, BANDAS_PRECIO))
+    return db.case(
+        (Negocio.precio_estimado.is_(None), 'sin_precio'),
+        *((Negocio.precio_estimado < alto, f'{bajo}-{alto}') for bajo, alto in cortes),
+        else_=f'{BANDAS_PRECIO[-1]}+'
+    )
+
+def consulta_facetas(condiciones):
+    """
+    Un solo GROUP BY sobre el conjunto filtrado: una fila por combinación
+    (subcategoría, ubicación, banda de precio) con su conteo, leída del
+    índice cubriente ix_negocio_facetas. Los nombres de categoría y
+    subcategoría se unen después, sobre los pocos grupos.
+    resumir_facetas() suma las combinaciones por dimensión.
+    """
+    banda = _banda_precio().label('banda')
+    grupos = (
+        db.select(Negocio.subcategoria_id, Negocio.ubicacion, banda, db.func.count().label('total'))
+        .where(*condiciones)
+        .group_by(Negocio.subcategoria_id, Negocio.ubicacion, banda)
+        .subquery()
+    )
+    # Las columnas de Negocio van primero: la sesión enruta por la primera entidad (particiones)
+    return (
+        db.select(grupos.c.ubicacion, grupos.c.banda, Categoria.id, Categoria.nombre,
+                  Subcategoria.id, Subcategoria.nombre, grupos.c.total)
+        .select_from(grupos)
+        .outerjoin(Subcategoria, Subcategoria.id == grupos.c.subcategoria_id)
+        .outerjoin(Categoria, Categoria.id == Subcategoria.categoria_id)
+    )
+
+def resumir_facetas(grupos):
+    """Filas de consulta_facetas() (de una o varias particiones) -> conteos por dimensión."""
+    categorias, subcategorias, ciudades, bandas = {}, {}, {}, {}
+    for ubicacion, banda, categoria_id, categoria, subcategoria_id, subcategoria, total in grupos:
+        if categoria_id is not None:
+            categorias[(categoria_id, categoria)] = categorias.get((categoria_id, categoria), 0) + total
+        if subcategoria_id is not None:
+            subcategorias[(subcategoria_id, subcategoria)] = subcategorias.get((subcategoria_id, subcategoria), 0) + total
+        if ubicacion:
+            ciudad = ubicacion.strip()  # Texto libre ('Quito, Ecuador'): se agrupa tal cual
+            ciudades[ciudad] = ciudades.get(ciudad, 0) + total
+        bandas[banda] = bandas.get(banda, 0) + total
+    
+    def por_total(conteos, a_dict):
+        return [a_dict(clave, total) for clave, total in sorted(conteos.items(), key=lambda c: (-c[1], str(c[0])))]
     
-    # Obtener resultados paginados
-    negocios = consulta.limit(limit).offset(offset).all()
+    orden_bandas = [f'{bajo}-{alto}' for bajo, alto in zip((0,) + BANDAS_PRECIO, BANDAS_PRECIO)]
+    orden_bandas += [f'{BANDAS_PRECIO[-1]}+', 'sin_precio']
+    return {
+        'categoria': por_total(categorias, lambda c, t: {'id': c[0], 'nombre': c[1], 'total': t}),
+        'subcategoria': por_total(subcategorias, lambda c, t: {'id': c[0], 'nombre': c[1], 'total': t}),
+        'ciudad': por_total(ciudades, lambda c, t: {'nombre': c, 'total': t}),
+        'precio': [{'rango': b, 'total': bandas[b]} for b in orden_bandas if b in bandas],
+    }
+
+def consulta_busqueda(condiciones, orden, limit):
+    """Página de /api/buscar: (Negocio, subcategoría, categoría) filtrados y ordenados por `orden`."""
+    # Categoría y subcategoría en la misma consulta, sin una consulta por resultado
+    return db.session.query(Negocio, Subcategoria.nombre, Categoria.nombre).outerjoin(
+        Subcategoria, Subcategoria.id == Negocio.subcategoria_id
+    ).outerjoin(
+        Categoria, Categoria.id == Subcategoria.categoria_id
+    ).filter(*condiciones).order_by(*claves_busqueda(orden)).limit(limit)
+
+def _buscar_en_particion(query, especialidad_id, orden, limit):
+    """Página [(clave de orden, negocio)], total y grupos de facetas de /api/buscar en la partición actual."""
+    condiciones = condiciones_busqueda(query, especialidad_id)
+    filas = consulta_busqueda(condiciones, orden, limit).all()
     
     # Formatear resultados
     resultado = []
-    for negocio in negocios:
-        # Obtener información de la categoría
-        subcat = Subcategoria.query.get(negocio.subcategoria_id)
-        categoria = Categoria.query.get(subcat.categoria_id) if subcat else None
-        
-        resultado.append({
+    for negocio, subcategoria, categoria in filas:
+        resultado.append((_clave_python(orden, negocio), {
             'id': negocio.id,
             'nombre': negocio.nombre,
             'descripcion_corta': negocio.descripcion_corta,
-            'categoria': categoria.nombre if categoria else '',
-            'subcategoria': subcat.nombre if subcat else '',
+            'categoria': categoria or '',
+            'subcategoria': subcategoria or '',
             'precio_estimado': float(negocio.precio_estimado) if negocio.precio_estimado else None,
             'calificacion': float(negocio.calificacion_promedio) if negocio.calificacion_promedio else None,
-            'ubicacion': negocio.ubicacion
-        })
+            'ubicacion': negocio.ubicacion,
+            'destacado': bool(negocio.destacado)
+        }))
     
+    # El total sale de las facetas: cada negocio cae en exactamente un grupo
+    grupos = [tuple(f) for f in db.session.execute(consulta_facetas(condiciones))]
+    return resultado, sum(grupo[-1] for grupo in grupos), grupos
+
+@api_bp.route('/catalogo/buscar', methods=['GET'])
+@solo_lectura
+def buscar_en_catalogo():
+    """
+    Buscar productos y servicios por texto, precio y categoría.
+    Endpoint: GET /api/catalogo/buscar?q=laptop&precio_max=500&tipo=producto
+              &categoria_id=X&subcategoria_id=Y&sort=precio_asc&limit=10&offset=0
+    sort: relevancia (por defecto), precio_asc, precio_desc, vendidos, recientes.
+    total=0 omite el conteo; el total se cuenta hasta TOTAL_MAXIMO (total_exacto=false).
+    """
+    query = request.args.get('q', '').strip()
+    tipo = request.args.get('tipo') or None
+    orden = request.args.get('sort', 'relevancia')
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_LIMIT))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    contar = request.args.get('total', '1') != '0'
+    if tipo not in (None, 'producto', 'servicio') or orden not in ORDENES:
+        return jsonify({'error': f"tipo debe ser producto o servicio y sort uno de: {', '.join(ORDENES)}"}), 400
+    
+    filtros = {
+        'precio_min': request.args.get('precio_min', type=float),
+        'precio_max': request.args.get('precio_max', type=float),
+    }
+    categoria_id = request.args.get('categoria_id', type=int)
+    subcategoria_id = request.args.get('subcategoria_id', type=int)
+    if categoria_id:
+        filtros['ruta_categoria'] = Categoria.query.get_or_404(categoria_id).ruta
+    if subcategoria_id:
+        filtros['ruta_subcategoria'] = Subcategoria.query.get_or_404(subcategoria_id).ruta
+    
+    resultados, total = buscar_catalogo(query, tipo, filtros, orden, limit, offset, contar)
     return jsonify({
         'query': query,
-        'especialidad_id': especialidad_id,
-        'resultados': resultado,
-        'total': consulta.count(),
+        'sort': orden,
+        'resultados': resultados,
+        'total': total,
+        'total_exacto': total is not None and total < TOTAL_MAXIMO,
         'limit': limit,
         'offset': offset
     })
@@ -231,45 +417,104 @@ def obtener_perfil_negocio(negocio_id):
     
     return jsonify(perfil)
 
+def consulta_catalogo_resumen(usuario_id, limite=5):
+    """
+    Los `limite` ítems más vendidos (y luego más recientes) del vendedor, entre
+    productos y servicios, en una sola consulta: cada rama recorre su índice
+    ix_*_ranking y se detiene en `limite` filas; el UNION ALL mezcla a lo sumo
+    2 * `limite`. Filas (nombre, precio, tipo).
+    """
+    ramas = [
+        db.select(modelo.nombre, modelo.precio, db.literal(tipo).label('tipo'),
+                  modelo.vendidos, modelo.created_at, modelo.id)
+        .where(modelo.created_by == usuario_id)
+        .order_by(modelo.vendidos.desc(), modelo.created_at.desc(), modelo.id.desc())
+        .limit(limite)
+        .subquery()
+        for modelo, tipo in ((Producto, 'producto'), (Servicio, 'servicio'))
+    ]
+    catalogo = db.union_all(*(db.select(rama) for rama in ramas)).subquery()
+    return (
+        db.select(catalogo.c.nombre, catalogo.c.precio, catalogo.c.tipo)
+        .order_by(catalogo.c.vendidos.desc(), catalogo.c.created_at.desc())
+        .limit(limite)
+    )
+
+
 @api_bp.route('/negocios/<int:negocio_id>', methods=['GET'])
+@solo_lectura
 def get_detalle_negocio(negocio_id):
     """Retorna el perfil completo de un negocio para el Agente IA."""
     negocio = Negocio.query.get_or_404(negocio_id)
     
-    # Obtener productos y servicios para mostrar en el perfil
-    productos = Producto.query.filter_by(created_by=negocio.usuario_id).all()
-    servicios = Servicio.query.filter_by(created_by=negocio.usuario_id).all()
-    
+    # Solo los 5 ítems más vendidos para no saturar al agente
     items = []
-    for p in productos:
-        items.append({'nombre': p.nombre, 'precio': p.precio, 'tipo': 'producto'})
-    for s in servicios:
-        items.append({'nombre': s.nombre, 'precio': s.precio, 'tipo': 'servicio'})
+    if negocio.usuario_id is not None:
+        filas = db.session.execute(consulta_catalogo_resumen(negocio.usuario_id)).all()
+        items = [{'nombre': f.nombre, 'precio': f.precio, 'tipo': f.tipo} for f in filas]
 
     return jsonify({
         'id': negocio.id,
         'nombre': negocio.nombre,
         'descripcion': negocio.descripcion_corta,
         'contacto': negocio.telefono_contacto,
-        'catalogo_resumen': items[:5] # Enviamos los primeros 5 para no saturar al agente
+        'catalogo_resumen': items
+    })
+
+@api_bp.route('/disponibilidad/<int:negocio_id>', methods=['GET'])
+@solo_lectura
+def get_disponibilidad(negocio_id):
+    """
+    Turnos libres de un negocio según sus horarios y agendamientos.
+    Endpoint: GET /api/disponibilidad/<id>?desde=2025-01-06&hasta=2025-01-12
+    Sin fechas devuelve los próximos 7 días (máximo 31).
+    """
+    try:
+        desde, hasta = rango_fechas(request.args.get('desde'), request.args.get('hasta'))
+    except ValueError:
+        return jsonify({'error': 'Fechas inválidas, use el formato YYYY-MM-DD'}), 400
+    
+    dias = disponibilidad_negocios([negocio_id], desde, hasta).get(negocio_id)
+    if dias is None:
+        return jsonify({'error': 'Negocio no encontrado'}), 404
+    
+    return jsonify({
+        'negocio_id': negocio_id,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'dias': dias
     })
 
 @api_bp.route('/agendar', methods=['POST'])
 def registrar_agendamiento():
-    """Registra una solicitud de contacto/agenda desde el chatbot."""
+    """
+    Registra una solicitud de contacto/agenda desde el chatbot.
+    Si se envía 'fecha' (ISO, p. ej. 2025-01-06T10:00) se reserva ese turno
+    y se responde 409 si ya no está disponible.
+    """
     data = request.json
+    datos = {
+        'cliente_nombre': data.get('nombre'),
+        'cliente_telefono': data.get('telefono'),
+        'nota': data.get('nota'),
+    }
     try:
-        nuevo_age = Agendamiento(
-            cliente_nombre=data.get('nombre'),
-            cliente_telefono=data.get('telefono'),
-            negocio_id=data.get('negocio_id'),
-            requerimiento=data.get('nota'),
-            fecha_registro=datetime.now(),
-            estado='pendiente'
-        )
-        db.session.add(nuevo_age)
-        db.session.commit()
-        return jsonify({'status': 'success', 'message': 'Agendamiento registrado'}), 201
+        if data.get('fecha'):
+            nuevo_age = reservar_turno(data.get('negocio_id'), datetime.fromisoformat(data['fecha']), **datos)
+        else:
+            nuevo_age = Agendamiento(id_negocio=data.get('negocio_id'), estado='pendiente', **datos)
+            db.session.add(nuevo_age)
+            db.session.commit()
+        return jsonify({
+            'status': 'success',
+            'message': 'Agendamiento registrado',
+            'id': nuevo_age.id,
+            'fecha_agendada': nuevo_age.fecha_agendada.isoformat() if nuevo_age.fecha_agendada else None
+        }), 201
+    except FechaInvalida as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except TurnoNoDisponible as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'status': 'error', 'message': str(e)}), 400
@@ -285,11 +530,10 @@ def obtener_estadisticas_chatbot():
     # Contar agendamientos por periodo
     ultimos_30_dias = datetime.now().date() - timedelta(days=30)
 
-    agendamientos_recientes = Agendamiento.query.filter(
-        Agendamiento.created_at >= ultimos_30_dias
-    ).count()
+    # El archivo solo se lee si el rango llega a filas archivadas; el total siempre lo suma
+    agendamientos_recientes = contar_historial(Agendamiento, desde=ultimos_30_dias)
     
-    total_agendamientos = Agendamiento.query.count()
+    total_agendamientos = contar_historial(Agendamiento)
     
     # Negocios más consultados
     negocios_populares = db.session.query(
@@ -325,28 +569,59 @@ def obtener_estadisticas_chatbot():
         'fecha_consulta': datetime.now().isoformat()
     })
 
-# ============================================
-# 3. FUNCIONES AUXILIARES
-# ============================================
-
-def obtener_subcategorias_por_categoria(nombre_categoria):
+@api_bp.route('/campanas', methods=['POST'])
+@login_required
+def crear_campana_difusion():
     """
-    Devuelve las subcategorías predeterminadas para cada categoría.
+    Crea una campaña de difusión y empieza a enviarla en segundo plano.
+    Body: {"nombre": "...", "plantilla": "Hola {nombre}...",
+           "destinatarios": "duenos_negocios_activos", "filtros": {"categoria_id": 3}}
+    Solo para administradores.
     """
-    subcategorias_map = {
-        'Servicios Profesionales': ['Médicos', 'Abogados', 'Contadores', 'Ingenieros', 'Arquitectos', 'Consultores'],
-        'Alimentos y Bebidas': ['Restaurantes', 'Cafeterías', 'Panaderías', 'Supermercados', 'Verdulerías', 'Carnicerías'],
-        'Salud y Bienestar': ['Clínicas', 'Farmacias', 'Gimnasios', 'Spa', 'Terapias Alternativas', 'Laboratorios'],
-        'Educación': ['Colegios', 'Universidades', 'Academias', 'Tutorías', 'Cursos Online', 'Talleres'],
-        'Tecnología': ['Tiendas de Electrónica', 'Reparación de Celulares', 'Desarrollo de Software', 'Soporte Técnico'],
-        'Hogar y Construcción': ['Ferreterías', 'Mueblerías', 'Constructoras', 'Decoración', 'Jardinería'],
-        'Automotriz': ['Talleres Mecánicos', 'Lavaderos', 'Venta de Autos', 'Accesorios', 'Grúas'],
-        'Entretenimiento': ['Cines', 'Teatros', 'Eventos', 'Parques', 'Juegos', 'Streaming'],
-        'Moda y Belleza': ['Boutiques', 'Peluquerías', 'Estéticas', 'Joyerías', 'Calzado'],
-        'Otros': ['Variedades', 'Servicios Generales', 'Importaciones', 'Regalos']
-    }
+    if not current_user.is_admin():
+        return jsonify({'error': 'Se requieren permisos de administrador'}), 403
+    data = request.json or {}
+    if not data.get('nombre') or not data.get('plantilla'):
+        return jsonify({'error': 'nombre y plantilla son obligatorios'}), 400
+    try:
+        campana = crear_campana(data['nombre'], data['plantilla'], data.get('destinatarios', 'duenos_negocios_activos'),
+                                data.get('filtros'), current_user.id)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     
-    return subcategorias_map.get(nombre_categoria, ['General'])
+    lanzar_campana(current_app._get_current_object(), campana.id)
+    return jsonify({'id': campana.id, 'destinatarios': resumen_campana(campana.id)}), 202
+
+@api_bp.route('/campanas/<int:campana_id>', methods=['GET'])
+@login_required
+def get_campana(campana_id):
+    """Estado de una campaña y resultados por estado de destinatario."""
+    if not current_user.is_admin():
+        return jsonify({'error': 'Se requieren permisos de administrador'}), 403
+    campana = Campana.query.get_or_404(campana_id)
+    return jsonify({
+        'id': campana.id,
+        'nombre': campana.nombre,
+        'estado': campana.estado,
+        'destinatarios': resumen_campana(campana.id),
+        'latido': campana.latido.isoformat() if campana.latido else None
+    })
+
+@api_bp.route('/campanas/<int:campana_id>/reanudar', methods=['POST'])
+@login_required
+def reanudar_campana(campana_id):
+    """Reanuda una campaña interrumpida; ?reintentar_errores=1 reenvía también los fallidos."""
+    if not current_user.is_admin():
+        return jsonify({'error': 'Se requieren permisos de administrador'}), 403
+    campana = Campana.query.get_or_404(campana_id)
+    lanzar_campana(current_app._get_current_object(), campana.id,
+                   reintentar_errores=request.args.get('reintentar_errores') == '1')
+    return jsonify({'id': campana.id, 'destinatarios': resumen_campana(campana.id)}), 202
+
+# ============================================
+# 3. FUNCIONES AUXILIARES
+# ============================================
 
 def buscar_negocios_inteligente(query, contexto_usuario=None):
     """
@@ -387,78 +662,52 @@ def buscar_negocios_inteligente(query, contexto_usuario=None):
     return negocios_unicos[:10]  # Limitar a 10 resultados
 
 # ============================================
-# 4. FUNCIONES PARA N8N
+# 4. MENSAJES PRE-RENDERIZADOS PARA N8N
 # ============================================
 
-def preparar_respuesta_whatsapp(negocio, tipo_mensaje='informacion'):
+@api_bp.route('/menus/raiz', defaults={'tipo': 'raiz', 'nodo_id': 0})
+@api_bp.route('/menus/<any(categoria, subcategoria, negocio):tipo>/<int:nodo_id>')
+@solo_lectura
+def get_menu_whatsapp(tipo, nodo_id):
     """
-    Prepara la respuesta estructurada para enviar por WhatsApp.
+    Mensaje de WhatsApp listo para reenviar (lista interactiva o tarjeta).
+    El id de fila 'mas_<tipo>_<id>_<pagina>' se resuelve con ?pagina=.
     """
-    if tipo_mensaje == 'informacion':
-        return {
-            'type': 'template',
-            'template': {
-                'name': 'negocio_info',
-                'language': {'code': 'es'},
-                'components': [
-                    {
-                        'type': 'body',
-                        'parameters': [
-                            {'type': 'text', 'text': negocio.nombre},
-                            {'type': 'text', 'text': negocio.descripcion_corta[:100]},
-                            {'type': 'text', 'text': f"⭐ {negocio.calificacion_promedio or 'N/A'}"},
-                            {'type': 'text', 'text': negocio.telefono_contacto or 'No disponible'}
-                        ]
-                    },
-                    {
-                        'type': 'button',
-                        'sub_type': 'quick_reply',
-                        'index': 0,
-                        'parameters': [{'type': 'payload', 'payload': f'agendar_{negocio.id}'}]
-                    }
-                ]
-            }
-        }
-    elif tipo_mensaje == 'confirmacion_agendamiento':
-        return {
-            'type': 'interactive',
-            'interactive': {
-                'type': 'button',
-                'body': {'text': f"¿Confirmas el agendamiento con {negocio.nombre}?"},
-                'action': {
-                    'buttons': [
-                        {'type': 'reply', 'reply': {'id': f'confirmar_{negocio.id}', 'title': '✅ Sí, confirmar'}},
-                        {'type': 'reply', 'reply': {'id': 'cancelar', 'title': '❌ Cancelar'}}
-                    ]
-                }
-            }
-        }
-    
-    return {'type': 'text', 'text': 'Información no disponible'}
-
+    pagina = request.args.get('pagina', 1, type=int)
+    resultado = obtener_mensaje(tipo, nodo_id, pagina)
+    if resultado is None:
+        return jsonify({'error': 'Menú no encontrado'}), 404
+    contenido, etag = resultado
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+    return current_app.response_class(contenido, mimetype='application/json', headers={'ETag': f'"{etag}"'})
 
-# ============================================
-# 5. UTILIDADES DE FORMATO PARA WHATSAPP
-# ============================================
-
-def preparar_respuesta_whatsapp(tipo_mensaje, negocio=None, datos=None):
+@api_bp.route('/menus/raiz/enviar', methods=['POST'], defaults={'tipo': 'raiz', 'nodo_id': 0})
+@api_bp.route('/menus/<any(categoria, subcategoria, negocio):tipo>/<int:nodo_id>/enviar', methods=['POST'])
+def enviar_menu_whatsapp(tipo, nodo_id):
     """
-    Genera el JSON estructurado que espera el nodo de WhatsApp en n8n
-    basado en los campos actuales de la tabla Negocio.
+    Envía el mensaje pre-renderizado por la Graph API.
+    Body: {"telefono": "593...", "pagina": 1}
+    Requiere 'Authorization: Bearer <N8N_API_TOKEN>' o una sesión iniciada,
+    y respeta el límite de envíos por cliente y por teléfono (limitador.py).
     """
-    if tipo_mensaje == 'perfil_negocio' and negocio:
-        # Formato optimizado para mostrar el perfil tras la selección
-        texto = (
-            f"🏪 *{negocio.nombre}*\n"
-            f"📝 {negocio.descripcion_corta}\n\n"
-            f"📞 Contacto: {negocio.telefono_contacto}\n"
-            f"--------------------------\n"
-            f"¿Deseas que te contactemos con este negocio?"
-        )
-        return {'type': 'text', 'text': texto}
-    
-    elif tipo_mensaje == 'lista_simple':
-        # Para menús numerados devueltos por la IA
-        return {'type': 'text', 'text': datos}
-
-    return {'type': 'text', 'text': 'Información no disponible'}
\ No newline at end of file
+    if token_n8n_valido(request.headers.get('Authorization')):
+        cliente = 'n8n'
+    elif current_user.is_authenticated:
+        cliente = f'usuario:{current_user.id}'
+    else:
+        return jsonify({'status': 'error', 'message': 'No autorizado'}), 401
+    data = request.get_json(silent=True) or {}
+    if not data.get('telefono'):
+        return jsonify({'status': 'error', 'message': 'Falta el teléfono'}), 400
+    espera = verificar_envio(cliente, str(data['telefono']))
+    if espera is not None:
+        return jsonify({'status': 'error', 'message': f'Demasiados envíos. Intenta de nuevo en {espera} segundos.'}), \
+            429, {'Retry-After': str(espera)}
+    resultado = obtener_mensaje(tipo, nodo_id, int(data.get('pagina', 1)))
+    if resultado is None:
+        return jsonify({'status': 'error', 'message': 'Menú no encontrado'}), 404
+    status, detalle = enviar_mensaje_detallado(data['telefono'], '', contenido=json.loads(resultado[0]))
+    if status is None or status >= 400:
+        return jsonify({'status': 'error', 'message': detalle}), 502
+    return jsonify({'status': 'success', 'wamid': detalle})
@@ -0,0 +1,17 @@
+"""
+Configuración de gunicorn (se lee sola con `gunicorn app:app`).
+post_worker_init arranca en cada worker los hilos del webhook, que retoman
+los mensajes pendientes (webhook.py). child_exit corre en el master al
+terminar cada worker: su archivo de métricas se suma al acumulado
+(metricas.py).
+"""
+from metricas import proceso_terminado
+from webhook import iniciar_trabajadores
+
+
+def post_worker_init(worker):
+    iniciar_trabajadores()
+
+
+def child_exit(server, worker):
+    proceso_terminado(worker.pid)
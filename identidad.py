@@ -0,0 +1,160 @@
+"""
+Caché de identidades para el user_loader de Flask-Login.
+Guarda las columnas de cada User por un tiempo limitado (LRU acotado con TTL)
+y reconstruye la instancia sin consultar la base en cada petición.
+Cualquier cambio de rol, estado activo o credenciales, o una eliminación,
+incrementa una generación compartida en un archivo; los demás workers la
+comparan con un stat() y vacían su caché, así nunca sirven un rol o estado
+obsoleto.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.session import make_transient_to_detached
+
+from basedatos import SesionEnrutada
+from models import db, User
+
+# Cambios en estos campos invalidan la identidad en todos los workers
+CAMPOS_SENSIBLES = ('username', 'password_hash', 'role', 'is_active')
+
+
+class CacheIdentidades:
+    """LRU acotado con expiración por entrada y generación compartida."""
+
+    def __init__(self, ttl=60, maximo=1000, archivo_generacion=None):
+        self.ttl = ttl
+        self.maximo = maximo
+        self.archivo_generacion = archivo_generacion
+        self._datos = OrderedDict()
+        self._candado = threading.Lock()
+        self._generacion = self._leer_generacion()
+
+    def _leer_generacion(self):
+        if not self.archivo_generacion:
+            return None
+        try:
+            info = os.stat(self.archivo_generacion)
+        except FileNotFoundError:
+            return None
+        return info.st_ino, info.st_mtime_ns
+
+    def _verificar_generacion(self):
+        generacion = self._leer_generacion()
+        if generacion != self._generacion:
+            self._datos.clear()
+            self._generacion = generacion
+
+    def obtener(self, user_id):
+        with self._candado:
+            self._verificar_generacion()
+            entrada = self._datos.get(user_id)
+            if entrada is None:
+                return None
+            datos, expira = entrada
+            if expira < time.monotonic():
+                del self._datos[user_id]
+                return None
+            self._datos.move_to_end(user_id)
+            return datos
+
+    def guardar(self, user_id, datos):
+        with self._candado:
+            self._datos[user_id] = (datos, time.monotonic() + self.ttl)
+            self._datos.move_to_end(user_id)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def descartar(self, user_id):
+        with self._candado:
+            self._datos.pop(user_id, None)
+
+    def invalidar_todo(self):
+        """Vacía la caché local y avisa al resto de workers."""
+        with self._candado:
+            self._datos.clear()
+            if self.archivo_generacion:
+                os.makedirs(os.path.dirname(self.archivo_generacion) or '.', exist_ok=True)
+                temporal = f'{self.archivo_generacion}.{os.getpid()}.tmp'
+                with open(temporal, 'w') as f:
+                    f.write(uuid.uuid4().hex)
+                os.replace(temporal, self.archivo_generacion)
+            self._generacion = self._leer_generacion()
+
+
+cache_identidades = CacheIdentidades()
+
+
+def cargar_usuario(user_id):
+    """
+    Devuelve el User de `user_id` adjunto a la sesión actual.
+    En un acierto de caché no se ejecuta ninguna consulta.
+    """
+    datos = cache_identidades.obtener(user_id)
+    if datos is None:
+        usuario = db.session.get(User, user_id)
+        if usuario is not None:
+            cache_identidades.guardar(user_id, {c.key: getattr(usuario, c.key) for c in User.__table__.columns})
+        return usuario
+
+    usuario = User(**datos)
+    make_transient_to_detached(usuario)
+    return db.session.merge(usuario, load=False)
+
+
+# ============================================
+# INVALIDACIÓN AUTOMÁTICA
+# ============================================
+
+def _marcar(target, global_):
+    sesion = object_session(target)
+    if sesion is None:
+        return
+    pendientes = sesion.info.setdefault('_identidades_modificadas', {})
+    pendientes[target.id] = pendientes.get(target.id, False) or global_
+
+
+@event.listens_for(User, 'after_update')
+def _usuario_actualizado(mapper, connection, target):
+    estado = db.inspect(target)
+    _marcar(target, any(estado.attrs[campo].history.has_changes() for campo in CAMPOS_SENSIBLES))
+
+
+@event.listens_for(User, 'after_delete')
+def _usuario_eliminado(mapper, connection, target):
+    _marcar(target, True)
+
+
+@event.listens_for(SesionEnrutada, 'after_commit')
+def _aplicar_invalidaciones(sesion):
+    pendientes = sesion.info.pop('_identidades_modificadas', None)
+    if not pendientes:
+        return
+    if any(pendientes.values()):
+        cache_identidades.invalidar_todo()
+    else:
+        for user_id in pendientes:
+            cache_identidades.descartar(user_id)
+
+
+@event.listens_for(SesionEnrutada, 'after_rollback')
+def _descartar_invalidaciones(sesion):
+    sesion.info.pop('_identidades_modificadas', None)
+
+
+def configurar_identidades(app):
+    """
+    Ajusta la caché desde IDENTIDAD_CACHE_TTL (segundos, 60; 0 la desactiva),
+    IDENTIDAD_CACHE_MAX (1000) y el archivo de generación en instance/.
+    """
+    cache_identidades.ttl = float(os.environ.get('IDENTIDAD_CACHE_TTL', 60))
+    cache_identidades.maximo = int(os.environ.get('IDENTIDAD_CACHE_MAX', 1000)) if cache_identidades.ttl else 0
+    cache_identidades.archivo_generacion = os.environ.get('IDENTIDAD_GENERACION') or os.path.join(
+        app.instance_path, 'identidades.gen'
+    )
+    cache_identidades._generacion = cache_identidades._leer_generacion()
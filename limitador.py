@@ -0,0 +1,180 @@
+"""
+Limitador de intentos de inicio de sesión y de envíos de WhatsApp por la API.
+Cubetas de tokens por dirección del cliente y por nombre de usuario que se
+consultan antes de calcular el hash de la contraseña, de modo que una ráfaga
+de credential stuffing no ocupe la CPU de los workers con scrypt/pbkdf2.
+Los envíos que n8n pide a /api/menus/.../enviar se autentican con el token
+compartido N8N_API_TOKEN y se limitan por cliente y por teléfono destino.
+El estado vive en un archivo SQLite local (instance/limitador.db) para que
+todos los workers de gunicorn compartan las mismas cubetas.
+"""
+import hmac
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import request
+
+from metricas import incrementar
+
+# Filas sin actividad durante este tiempo se consideran cubetas llenas y se purgan
+SEGUNDOS_PURGA = 3600
+PURGAR_CADA = 500
+
+
+class LimitadorIntentos:
+    """
+    Cubetas de tokens en SQLite. Cada intento consume un token de cada clave;
+    los tokens se recargan a `por_minuto` hasta `capacidad`.
+    """
+
+    def __init__(self, archivo, limites, reloj=time.time):
+        self.archivo = archivo
+        self.limites = limites  # {'ip': (capacidad, por_minuto), 'usuario': (...)}
+        self.reloj = reloj
+        self._local = threading.local()
+        self._operaciones = 0
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            os.makedirs(os.path.dirname(self.archivo) or '.', exist_ok=True)
+            conexion = sqlite3.connect(self.archivo, timeout=5, isolation_level=None)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            conexion.execute(
+                'CREATE TABLE IF NOT EXISTS cubetas ('
+                'clave TEXT PRIMARY KEY, tokens REAL NOT NULL, actualizado REAL NOT NULL)'
+            )
+            self._local.conexion = conexion
+        return conexion
+
+    def consumir(self, claves):
+        """
+        Intenta consumir un token de cada cubeta en `claves` ({tipo: valor}).
+        Devuelve (tipo bloqueado, segundos de espera) o (None, 0) si se permite.
+        Si alguna cubeta está vacía no se consume ninguna.
+        """
+        ahora = self.reloj()
+        conexion = self._conexion()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            estados = {}
+            for tipo, valor in claves.items():
+                capacidad, por_minuto = self.limites[tipo]
+                fila = conexion.execute(
+                    'SELECT tokens, actualizado FROM cubetas WHERE clave = ?', (f'{tipo}:{valor}',)
+                ).fetchone()
+                tokens = capacidad
+                if fila is not None:
+                    tokens = min(capacidad, fila[0] + (ahora - fila[1]) * por_minuto / 60)
+                if tokens < 1:
+                    conexion.execute('ROLLBACK')
+                    return tipo, math.ceil((1 - tokens) * 60 / por_minuto)
+                estados[f'{tipo}:{valor}'] = tokens - 1
+
+            conexion.executemany(
+                'INSERT INTO cubetas (clave, tokens, actualizado) VALUES (?, ?, ?) '
+                'ON CONFLICT(clave) DO UPDATE SET tokens = excluded.tokens, actualizado = excluded.actualizado',
+                [(clave, tokens, ahora) for clave, tokens in estados.items()],
+            )
+            self._operaciones += 1
+            if self._operaciones % PURGAR_CADA == 0:
+                conexion.execute('DELETE FROM cubetas WHERE actualizado < ?', (ahora - SEGUNDOS_PURGA,))
+            conexion.execute('COMMIT')
+        except BaseException:
+            if conexion.in_transaction:
+                conexion.execute('ROLLBACK')
+            raise
+        return None, 0
+
+    def restablecer(self, tipo, valor):
+        """Llena de nuevo una cubeta (p. ej. la del usuario tras un login correcto)."""
+        self._conexion().execute('DELETE FROM cubetas WHERE clave = ?', (f'{tipo}:{valor}',))
+
+
+_limitador = {'instancia': None, 'envios': None}
+
+
+def verificar_intento_login(username):
+    """
+    Consume un intento para la IP del cliente y para `username`.
+    Devuelve None si el intento se permite o los segundos de espera
+    (para Retry-After) si se debe rechazar sin comprobar la contraseña.
+    """
+    limitador = _limitador['instancia']
+    if limitador is None:
+        return None
+    tipo, espera = limitador.consumir({
+        'ip': request.remote_addr or 'desconocida',
+        'usuario': (username or '').strip().lower(),
+    })
+    if tipo is None:
+        return None
+    incrementar('login_bloqueos_total', {'motivo': tipo})
+    return espera
+
+
+def login_exitoso(username):
+    """Un inicio de sesión correcto devuelve los intentos al usuario."""
+    if _limitador['instancia'] is not None:
+        _limitador['instancia'].restablecer('usuario', (username or '').strip().lower())
+
+
+def token_n8n_valido(autorizacion):
+    """Compara en tiempo constante 'Bearer <N8N_API_TOKEN>'; sin token configurado ninguno es válido."""
+    token = os.environ.get('N8N_API_TOKEN')
+    return bool(token) and hmac.compare_digest(autorizacion or '', f'Bearer {token}')
+
+
+def verificar_envio(cliente, telefono):
+    """
+    Consume un envío para `cliente` (n8n o el usuario con sesión) y para el
+    teléfono destino. Devuelve None si se permite o los segundos de espera.
+    """
+    limitador = _limitador['envios']
+    if limitador is None:
+        return None
+    tipo, espera = limitador.consumir({'cliente': cliente, 'telefono': ''.join(filter(str.isdigit, telefono))})
+    if tipo is None:
+        return None
+    incrementar('envios_api_bloqueos_total', {'motivo': tipo})
+    return espera
+
+
+def _limites(variables):
+    return {
+        tipo: (float(os.environ.get(f'{prefijo}_CAPACIDAD', capacidad)),
+               float(os.environ.get(f'{prefijo}_POR_MINUTO', por_minuto)))
+        for tipo, (prefijo, capacidad, por_minuto) in variables.items()
+    }
+
+
+def configurar_limitador(app):
+    """
+    Activa el limitador de login salvo LOGIN_LIMITADOR_ACTIVO=0. Variables:
+    LOGIN_IP_CAPACIDAD (20) y LOGIN_IP_POR_MINUTO (10) por dirección,
+    LOGIN_USUARIO_CAPACIDAD (5) y LOGIN_USUARIO_POR_MINUTO (1) por usuario,
+    y LOGIN_LIMITADOR_DB (archivo compartido, en instance/ por defecto).
+    Detrás de un proxy inverso hay que fijar PROXY_SALTOS (app.py): si no,
+    todos los clientes comparten la cubeta de la IP del proxy.
+    El de envíos siempre está activo: ENVIO_CLIENTE_CAPACIDAD (60) y
+    ENVIO_CLIENTE_POR_MINUTO (60) por cliente, ENVIO_TELEFONO_CAPACIDAD (5)
+    y ENVIO_TELEFONO_POR_MINUTO (2) por teléfono destino.
+    """
+    archivo = os.environ.get('LOGIN_LIMITADOR_DB') or os.path.join(app.instance_path, 'limitador.db')
+    _limitador['envios'] = LimitadorIntentos(archivo, _limites({
+        'cliente': ('ENVIO_CLIENTE', 60, 60),
+        'telefono': ('ENVIO_TELEFONO', 5, 2),
+    }))
+
+    app.config.setdefault('LOGIN_LIMITADOR_ACTIVO', os.environ.get('LOGIN_LIMITADOR_ACTIVO', '1') == '1')
+    if not app.config['LOGIN_LIMITADOR_ACTIVO']:
+        _limitador['instancia'] = None
+        return
+    _limitador['instancia'] = LimitadorIntentos(archivo, _limites({
+        'ip': ('LOGIN_IP', 20, 10),
+        'usuario': ('LOGIN_USUARIO', 5, 1),
+    }))
@@ -0,0 +1,302 @@
+"""
+Fotos subidas por los vendedores, guardadas por contenido.
+La subida se copia a disco en bloques mientras se calcula su SHA-256, así
+que la memoria no crece con el tamaño del archivo; una foto ya subida (mismo
+hash) no se guarda dos veces. Las variantes WebP reducidas se generan en un
+pool de procesos fuera de la petición y el original se sirve de inmediato.
+Como el nombre es el hash, /medios/<archivo> se sirve con caché inmutable.
+Pillow es opcional: sin él solo se guardan y sirven los originales.
+Uso: flask --app app medios variantes
+"""
+import hashlib
+import importlib.util
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import click
+from flask import Blueprint, abort, current_app, jsonify, request, send_file, url_for
+from flask.cli import AppGroup
+from flask_login import current_user, login_required
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from models import Medio, db
+
+medios_bp = Blueprint('medios', __name__, url_prefix='/medios')
+
+BLOQUE = 64 * 1024
+ANCHOS = (160, 480, 1080)  # Miniatura, tarjeta y vista completa
+CALIDAD_WEBP = 80
+UN_ANIO = 365 * 24 * 3600
+
+# Firma de los primeros bytes -> extensión; no se confía en el nombre ni en el Content-Type
+FIRMAS = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+NOMBRE_VALIDO = re.compile(r'^([0-9a-f]{64})(?:_(\d+))?\.(jpg|png|gif|webp)$')
+
+_pool = {'pid': None, 'ejecutor': None}
+_candado = threading.Lock()
+
+
+class MedioInvalido(ValueError):
+    def __init__(self, mensaje, status=415):
+        super().__init__(mensaje)
+        self.status = status
+
+
+def _extension(cabecera):
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'webp'
+    for firma, extension in FIRMAS:
+        if cabecera.startswith(firma):
+            return extension
+    return None
+
+
+def _directorio():
+    return current_app.config['MEDIOS_DIR']
+
+
+def ruta_archivo(nombre):
+    """Ruta en disco de '<sha256>.<ext>' o '<sha256>_<ancho>.webp' (subcarpeta por los 2 primeros caracteres)."""
+    return os.path.join(_directorio(), nombre[:2], nombre)
+
+
+def url_medio(medio, ancho=None):
+    """URL pública del original o de la variante WebP de `ancho`."""
+    nombre = f'{medio.sha256}_{ancho}.webp' if ancho else f'{medio.sha256}.{medio.extension}'
+    return url_for('medios.servir', nombre=nombre)
+
+
+def a_dict(medio):
+    return {
+        'sha256': medio.sha256,
+        'url': url_medio(medio),
+        'tamano': medio.tamano,
+        'estado': medio.estado,
+        'variantes': {str(ancho): url_medio(medio, ancho) for ancho in medio.variantes or []},
+    }
+
+
+# ============================================
+# SUBIDA EN BLOQUES
+# ============================================
+
+def guardar_stream(stream, usuario_id=None):
+    """
+    Copia `stream` a un temporal en bloques de 64 KiB calculando su SHA-256 y
+    lo mueve a su ruta definitiva. Devuelve (Medio, nuevo). Lanza
+    MedioInvalido si no es una imagen admitida o supera MEDIOS_MAX_BYTES.
+    """
+    limite = current_app.config['MEDIOS_MAX_BYTES']
+    temporales = os.path.join(_directorio(), 'tmp')
+    os.makedirs(temporales, exist_ok=True)
+    resumen, tamano, extension = hashlib.sha256(), 0, None
+
+    with tempfile.NamedTemporaryFile(dir=temporales, delete=False) as destino:
+        try:
+            while True:
+                bloque = stream.read(BLOQUE)
+                if not bloque:
+                    break
+                if extension is None:
+                    extension = _extension(bloque[:16])
+                    if extension is None:
+                        raise MedioInvalido('Formato no admitido: se aceptan JPEG, PNG, WebP y GIF')
+                tamano += len(bloque)
+                if tamano > limite:
+                    raise MedioInvalido(f'El archivo supera el máximo de {limite // (1024 * 1024)} MB', 413)
+                resumen.update(bloque)
+                destino.write(bloque)
+        except BaseException:
+            destino.close()
+            os.unlink(destino.name)
+            raise
+    if extension is None:
+        os.unlink(destino.name)
+        raise MedioInvalido('El archivo está vacío')
+
+    sha = resumen.hexdigest()
+    existente = db.session.get(Medio, sha)
+    if existente is not None:
+        os.unlink(destino.name)
+        return existente, False
+
+    nombre = f'{sha}.{extension}'
+    os.makedirs(os.path.dirname(ruta_archivo(nombre)), exist_ok=True)
+    os.replace(destino.name, ruta_archivo(nombre))  # Atómico: nunca se sirve un archivo a medias
+    medio = Medio(sha256=sha, extension=extension, tamano=tamano, variantes=[],
+                  estado='pendiente' if pillow_disponible() else 'sin_variantes', created_by=usuario_id)
+    db.session.add(medio)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # La misma foto llegó en otra petición a la vez; el archivo es idéntico
+        db.session.rollback()
+        return db.session.get(Medio, sha), False
+    encolar_variantes(medio)
+    return medio, True
+
+
+def imagen_subida(campo='imagen'):
+    """URL del archivo subido en el campo `campo` de un formulario, o None si no hay archivo."""
+    archivo = request.files.get(campo)
+    if archivo is None or not archivo.filename:
+        return None
+    medio, _ = guardar_stream(archivo.stream, current_user.id)
+    return url_medio(medio)
+
+
+@medios_bp.route('', methods=['POST'])
+@login_required
+def subir():
+    """
+    Sube una imagen: multipart con el campo 'archivo' o el cuerpo crudo
+    (Content-Type: image/*). 201 si es nueva, 200 si ya existía.
+    """
+    archivo = request.files.get('archivo') if request.mimetype == 'multipart/form-data' else None
+    stream = archivo.stream if archivo is not None else request.stream
+    try:
+        medio, nuevo = guardar_stream(stream, current_user.id)
+    except MedioInvalido as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(a_dict(medio)), 201 if nuevo else 200
+
+
+@medios_bp.route('/<nombre>')
+def servir(nombre):
+    """Original o variante; el contenido de una URL nunca cambia."""
+    if not NOMBRE_VALIDO.match(nombre):
+        abort(404)
+    ruta = ruta_archivo(nombre)
+    if not os.path.exists(ruta):
+        abort(404)  # Variante aún no generada: no se cachea otro contenido bajo esta URL
+    respuesta = send_file(ruta, max_age=UN_ANIO, conditional=True, etag=nombre.partition('.')[0])
+    respuesta.cache_control.immutable = True
+    return respuesta
+
+
+# ============================================
+# VARIANTES EN UN POOL DE PROCESOS
+# ============================================
+
+def pillow_disponible():
+    return importlib.util.find_spec('PIL') is not None
+
+
+def generar_variantes(origen, base, anchos=ANCHOS):
+    """
+    Se ejecuta en un proceso del pool (sin app ni base de datos). Escribe
+    '<base>_<ancho>.webp' para cada ancho menor que el original (y al menos la
+    miniatura) y devuelve (ancho, alto, anchos generados).
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(origen) as imagen:
+        ancho, alto = imagen.size
+        # JPEG: decodifica directo a una escala reducida (menos memoria y CPU)
+        imagen.draft('RGB', (max(anchos), max(anchos)))
+        imagen = ImageOps.exif_transpose(imagen)  # Fotos de celular giradas por EXIF
+        if (imagen.width > imagen.height) != (ancho > alto):
+            ancho, alto = alto, ancho
+        if imagen.mode not in ('RGB', 'RGBA'):
+            imagen = imagen.convert('RGBA' if 'transparency' in imagen.info else 'RGB')
+        generados = []
+        for objetivo in anchos:
+            if objetivo >= ancho and objetivo != min(anchos):
+                continue  # No se amplía
+            copia = imagen.copy()
+            copia.thumbnail((objetivo, objetivo * 10))
+            final = f'{base}_{objetivo}.webp'
+            copia.save(final + '.tmp', 'WEBP', quality=CALIDAD_WEBP, method=4)
+            os.replace(final + '.tmp', final)
+            generados.append(objetivo)
+    return ancho, alto, sorted(generados)
+
+
+def _ejecutor():
+    # Se crea en el proceso que lo usa (después del fork de gunicorn)
+    with _candado:
+        if _pool['pid'] != os.getpid():
+            procesos = int(os.environ.get('MEDIOS_PROCESOS', 2))
+            _pool['ejecutor'] = ProcessPoolExecutor(max_workers=procesos)
+            _pool['pid'] = os.getpid()
+        return _pool['ejecutor']
+
+
+def _guardar_variantes(sha, futuro):
+    medio = db.session.get(Medio, sha)
+    if medio is None:
+        return
+    try:
+        medio.ancho, medio.alto, medio.variantes = futuro.result()
+        medio.estado = 'listo'
+    except Exception as e:
+        current_app.logger.warning('No se pudieron generar las variantes de %s: %s', sha, e)
+        medio.estado = 'error'
+    db.session.commit()
+
+
+def _variantes_listas(app, sha, futuro):
+    # Callback del pool: corre en un hilo del proceso web, fuera de la petición
+    with app.app_context():
+        _guardar_variantes(sha, futuro)
+
+
+def _enviar_al_pool(medio):
+    origen = ruta_archivo(f'{medio.sha256}.{medio.extension}')
+    return _ejecutor().submit(generar_variantes, origen, ruta_archivo(medio.sha256))
+
+
+def encolar_variantes(medio):
+    """Envía el original al pool; el resultado se guarda al terminar, fuera de la petición."""
+    if not pillow_disponible():
+        return
+    futuro = _enviar_al_pool(medio)
+    futuro.add_done_callback(partial(_variantes_listas, current_app._get_current_object(), medio.sha256))
+
+
+def configurar_medios(app):
+    """
+    Registra /medios. Variables: MEDIOS_DIR (instance/medios), MEDIOS_MAX_MB
+    (20) y MEDIOS_PROCESOS (2). También limita MAX_CONTENT_LENGTH para que
+    Werkzeug rechace cuerpos mayores antes de leerlos.
+    """
+    app.config.setdefault('MEDIOS_DIR', os.environ.get('MEDIOS_DIR') or os.path.join(app.instance_path, 'medios'))
+    app.config.setdefault('MEDIOS_MAX_BYTES', int(float(os.environ.get('MEDIOS_MAX_MB', 20)) * 1024 * 1024))
+    if app.config.get('MAX_CONTENT_LENGTH') is None:
+        app.config['MAX_CONTENT_LENGTH'] = app.config['MEDIOS_MAX_BYTES'] + BLOQUE  # Margen del multipart
+    app.register_blueprint(medios_bp)
+    app.cli.add_command(medios_cli)
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+medios_cli = AppGroup('medios', help='Fotos subidas y sus variantes.')
+
+
+@medios_cli.command('variantes')
+@click.option('--todas', is_flag=True, help='Regenera también las que ya están listas.')
+def variantes_command(todas):
+    """Genera las variantes pendientes o con error (p. ej. tras instalar Pillow o una caída)."""
+    if not pillow_disponible():
+        raise click.ClickException('Pillow no está instalado')
+    consulta = select(Medio)
+    if not todas:
+        consulta = consulta.where(Medio.estado.in_(('pendiente', 'sin_variantes', 'error')))
+    medios = db.session.scalars(consulta).all()
+    futuros = [(medio.sha256, _enviar_al_pool(medio)) for medio in medios]
+    for sha, futuro in futuros:
+        _guardar_variantes(sha, futuro)
+    listos = sum(1 for medio in medios if medio.estado == 'listo')
+    click.echo(f'{listos}/{len(medios)} medios con variantes')
@@ -0,0 +1,362 @@
+"""
+Mensajes de WhatsApp pre-renderizados.
+Los menús de categorías y subcategorías (listas interactivas de hasta 10
+filas, paginadas con 'Ver más') y las tarjetas de cada Negocio activo se
+construyen una vez y se guardan como JSON en mensajes_prerenderizados.
+Un cambio en las filas de origen borra, en la misma transacción, solo las
+claves afectadas; la siguiente lectura las reconstruye y las guarda con un
+upsert en su propia transacción sobre el motor de escritura, aunque la
+petición sea @solo_lectura. n8n reenvía el contenido tal cual desde
+/api/menus.
+"""
+import hashlib
+import json
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, select
+
+from basedatos import SesionEnrutada, insert_con_conflicto
+from models import Categoria, MensajePrerenderizado, Negocio, Subcategoria, db
+from particiones import ciudad_de_negocio, en_ciudad, en_todas_las_ciudades
+
+# Límites de la Graph API para mensajes de lista
+MAX_FILAS = 10
+MAX_TITULO_FILA = 24
+MAX_DESCRIPCION_FILA = 72
+
+# Columnas de Negocio que aparecen en menús o tarjetas (visitas, etc. no invalidan)
+CAMPOS_NEGOCIO = ('nombre', 'descripcion_corta', 'calificacion_promedio', 'telefono_contacto',
+                  'ubicacion', 'activo', 'destacado', 'subcategoria_id')
+
+
+def _recortar(texto, largo):
+    texto = (texto or '').strip()
+    return texto if len(texto) <= largo else texto[:largo - 1] + '…'
+
+
+# ============================================
+# CONSTRUCCIÓN DE MENSAJES
+# ============================================
+
+def preparar_respuesta_whatsapp(tipo_mensaje, negocio=None, datos=None):
+    """
+    Genera el contenido de un mensaje de WhatsApp (sin destinatario) para
+    reenviar desde n8n o con messenger.enviar_mensaje_detallado(contenido=...).
+    Tipos: 'informacion' (plantilla negocio_info), 'tarjeta_negocio',
+    'confirmacion_agendamiento', 'perfil_negocio', 'lista' y 'lista_simple'.
+    """
+    if tipo_mensaje == 'informacion' and negocio:
+        return {
+            'type': 'template',
+            'template': {
+                'name': 'negocio_info',
+                'language': {'code': 'es'},
+                'components': [
+                    {
+                        'type': 'body',
+                        'parameters': [
+                            {'type': 'text', 'text': negocio.nombre},
+                            {'type': 'text', 'text': negocio.descripcion_corta[:100]},
+                            {'type': 'text', 'text': f"⭐ {negocio.calificacion_promedio or 'N/A'}"},
+                            {'type': 'text', 'text': negocio.telefono_contacto or 'No disponible'}
+                        ]
+                    },
+                    {
+                        'type': 'button',
+                        'sub_type': 'quick_reply',
+                        'index': 0,
+                        'parameters': [{'type': 'payload', 'payload': f'agendar_{negocio.id}'}]
+                    }
+                ]
+            }
+        }
+
+    elif tipo_mensaje == 'tarjeta_negocio' and negocio:
+        texto = (
+            f"🏪 *{negocio.nombre}*\n"
+            f"📝 {negocio.descripcion_corta}\n"
+            + (f"📍 {negocio.ubicacion}\n" if negocio.ubicacion else '')
+            + f"⭐ {negocio.calificacion_promedio or 'N/A'}\n"
+            f"📞 Contacto: {negocio.telefono_contacto or 'No disponible'}"
+        )
+        return {
+            'type': 'interactive',
+            'interactive': {
+                'type': 'button',
+                'body': {'text': _recortar(texto, 1024)},
+                'action': {
+                    'buttons': [
+                        {'type': 'reply', 'reply': {'id': f'agendar_{negocio.id}', 'title': '📅 Agendar'}},
+                        {'type': 'reply', 'reply': {'id': 'menu', 'title': '🔙 Menú principal'}}
+                    ]
+                }
+            }
+        }
+
+    elif tipo_mensaje == 'confirmacion_agendamiento' and negocio:
+        return {
+            'type': 'interactive',
+            'interactive': {
+                'type': 'button',
+                'body': {'text': f"¿Confirmas el agendamiento con {negocio.nombre}?"},
+                'action': {
+                    'buttons': [
+                        {'type': 'reply', 'reply': {'id': f'confirmar_{negocio.id}', 'title': '✅ Sí, confirmar'}},
+                        {'type': 'reply', 'reply': {'id': 'cancelar', 'title': '❌ Cancelar'}}
+                    ]
+                }
+            }
+        }
+
+    elif tipo_mensaje == 'perfil_negocio' and negocio:
+        # Formato optimizado para mostrar el perfil tras la selección
+        texto = (
+            f"🏪 *{negocio.nombre}*\n"
+            f"📝 {negocio.descripcion_corta}\n\n"
+            f"📞 Contacto: {negocio.telefono_contacto}\n"
+            f"--------------------------\n"
+            f"¿Deseas que te contactemos con este negocio?"
+        )
+        return {'type': 'text', 'text': texto}
+
+    elif tipo_mensaje == 'lista' and datos:
+        # datos: {'titulo', 'cuerpo', 'filas': [(id, titulo, descripcion)], 'boton'}
+        return {
+            'type': 'interactive',
+            'interactive': {
+                'type': 'list',
+                'header': {'type': 'text', 'text': _recortar(datos['titulo'], 60)},
+                'body': {'text': _recortar(datos.get('cuerpo') or 'Elige una opción', 1024)},
+                'action': {
+                    'button': _recortar(datos.get('boton') or 'Ver opciones', 20),
+                    'sections': [{
+                        'title': _recortar(datos['titulo'], 24),
+                        'rows': [
+                            {'id': fila_id, 'title': _recortar(titulo, MAX_TITULO_FILA),
+                             **({'description': _recortar(descripcion, MAX_DESCRIPCION_FILA)} if descripcion else {})}
+                            for fila_id, titulo, descripcion in datos['filas']
+                        ]
+                    }]
+                }
+            }
+        }
+
+    elif tipo_mensaje == 'lista_simple':
+        # Para menús numerados devueltos por la IA
+        return {'type': 'text', 'text': datos}
+
+    return {'type': 'text', 'text': 'Información no disponible'}
+
+
+def _paginar(tipo, nodo_id, titulo, cuerpo, filas):
+    """Divide las filas en listas de MAX_FILAS; la última fila de cada página lleva a la siguiente."""
+    if not filas:
+        return {1: {'type': 'text', 'text': f'No hay opciones disponibles en {titulo}.'}}
+    por_pagina = MAX_FILAS - 1 if len(filas) > MAX_FILAS else MAX_FILAS
+    paginas = {}
+    for numero, inicio in enumerate(range(0, len(filas), por_pagina), start=1):
+        bloque = list(filas[inicio:inicio + por_pagina])
+        if inicio + por_pagina < len(filas):
+            bloque.append((f'mas_{tipo}_{nodo_id}_{numero + 1}', 'Ver más…', None))
+        paginas[numero] = preparar_respuesta_whatsapp('lista', datos={
+            'titulo': titulo, 'cuerpo': cuerpo, 'filas': bloque,
+        })
+    return paginas
+
+
+def _filas_negocios(subcategoria_id):
+    def en_particion():
+        return db.session.execute(
+            select(Negocio.id, Negocio.nombre, Negocio.descripcion_corta, Negocio.destacado,
+                   Negocio.calificacion_promedio)
+            .where(Negocio.activo.is_(True), Negocio.subcategoria_id == subcategoria_id)
+        ).all()
+    # Los negocios de la subcategoría pueden estar en varias particiones por ciudad
+    negocios = [n for parte in en_todas_las_ciudades(en_particion) for n in parte]
+    negocios.sort(key=lambda n: (not n.destacado, -(n.calificacion_promedio or 0), n.nombre))
+    return [(f'neg_{n.id}', n.nombre, n.descripcion_corta) for n in negocios]
+
+
+def construir(tipo, nodo_id):
+    """Todas las páginas de un nodo: {pagina: contenido}, o None si no existe."""
+    if tipo == 'raiz':
+        categorias = db.session.execute(
+            select(Categoria.id, Categoria.nombre, Categoria.descripcion)
+            .where(Categoria.nivel == 1).order_by(Categoria.orden, Categoria.id)
+        ).all()
+        return _paginar('raiz', 0, 'Menú principal', '¿Qué estás buscando hoy?',
+                        [(f'cat_{c.id}', c.nombre, c.descripcion) for c in categorias])
+
+    if tipo == 'categoria':
+        categoria = db.session.get(Categoria, nodo_id)
+        if categoria is None:
+            return None
+        hijas = db.session.execute(
+            select(Categoria.id, Categoria.nombre, Categoria.descripcion)
+            .where(Categoria.parent_id == nodo_id).order_by(Categoria.orden, Categoria.id)
+        ).all()
+        subcategorias = db.session.execute(
+            select(Subcategoria.id, Subcategoria.nombre, Subcategoria.descripcion)
+            .where(Subcategoria.categoria_id == nodo_id, Subcategoria.parent_id.is_(None))
+            .order_by(Subcategoria.nombre)
+        ).all()
+        filas = [(f'cat_{c.id}', c.nombre, c.descripcion) for c in hijas]
+        filas += [(f'sub_{s.id}', s.nombre, s.descripcion) for s in subcategorias]
+        return _paginar('categoria', nodo_id, categoria.nombre, categoria.descripcion, filas)
+
+    if tipo == 'subcategoria':
+        subcategoria = db.session.get(Subcategoria, nodo_id)
+        if subcategoria is None:
+            return None
+        hijas = db.session.execute(
+            select(Subcategoria.id, Subcategoria.nombre, Subcategoria.descripcion)
+            .where(Subcategoria.parent_id == nodo_id).order_by(Subcategoria.nombre)
+        ).all()
+        filas = [(f'sub_{s.id}', s.nombre, s.descripcion) for s in hijas]
+        filas += _filas_negocios(nodo_id)
+        return _paginar('subcategoria', nodo_id, subcategoria.nombre, subcategoria.descripcion, filas)
+
+    if tipo == 'negocio':
+        with en_ciudad(ciudad_de_negocio(nodo_id)):
+            negocio = db.session.get(Negocio, nodo_id)
+            if negocio is None or not negocio.activo:
+                return None
+            return {1: preparar_respuesta_whatsapp('tarjeta_negocio', negocio)}
+
+    return None
+
+
+# ============================================
+# ALMACENAMIENTO E INVALIDACIÓN
+# ============================================
+
+def _rango_clave(tipo, nodo_id):
+    """Todas las páginas de un nodo: claves en ['tipo:id:', 'tipo:id;')."""
+    prefijo = f'{tipo}:{nodo_id}:'
+    tabla = MensajePrerenderizado.__table__
+    return db.and_(tabla.c.clave >= prefijo, tabla.c.clave < prefijo[:-1] + ';')
+
+
+def _filas(tipo, nodo_id, paginas):
+    for pagina, contenido in paginas.items():
+        texto = json.dumps(contenido, ensure_ascii=False, separators=(',', ':'))
+        yield {'clave': f'{tipo}:{nodo_id}:{pagina}', 'contenido': texto,
+               'etag': hashlib.md5(texto.encode()).hexdigest()}
+
+
+def _guardar(tipo, nodo_id, filas):
+    """
+    Upsert de las páginas de un nodo y borrado de las que sobran, en una
+    transacción propia del motor principal: no pasa por el bind de lectura
+    y dos reconstrucciones simultáneas del mismo nodo no chocan en la clave.
+    """
+    tabla = MensajePrerenderizado.__table__
+    sentencia = insert_con_conflicto(tabla, db.engine)
+    sentencia = sentencia.on_conflict_do_update(index_elements=['clave'], set_={
+        'contenido': sentencia.excluded.contenido,
+        'etag': sentencia.excluded.etag,
+        'actualizado': sentencia.excluded.actualizado,
+    })
+    ahora = datetime.now()
+    with db.engine.begin() as conn:
+        conn.execute(sentencia, [{**fila, 'actualizado': ahora} for fila in filas])
+        conn.execute(tabla.delete().where(_rango_clave(tipo, nodo_id), tabla.c.clave.not_in([f['clave'] for f in filas])))
+
+
+def obtener_mensaje(tipo, nodo_id, pagina=1):
+    """(contenido JSON, etag) del nodo, reconstruyéndolo si fue invalidado; None si no existe."""
+    fila = db.session.execute(
+        select(MensajePrerenderizado.contenido, MensajePrerenderizado.etag)
+        .where(MensajePrerenderizado.clave == f'{tipo}:{nodo_id}:{pagina}')
+    ).first()
+    if fila is not None:
+        return fila.contenido, fila.etag
+
+    paginas = construir(tipo, nodo_id)
+    if not paginas:
+        return None
+    filas = list(_filas(tipo, nodo_id, paginas))
+    _guardar(tipo, nodo_id, filas)
+    for fila in filas:
+        if fila['clave'] == f'{tipo}:{nodo_id}:{pagina}':
+            return fila['contenido'], fila['etag']
+    return None
+
+
+def regenerar_menus():
+    """Borra y vuelve a construir todos los mensajes. Devuelve cuántos guardó."""
+    nodos = [('raiz', 0)]
+    nodos += [('categoria', i) for i in db.session.scalars(select(Categoria.id))]
+    nodos += [('subcategoria', i) for i in db.session.scalars(select(Subcategoria.id))]
+    activos = en_todas_las_ciudades(lambda: db.session.scalars(select(Negocio.id).where(Negocio.activo.is_(True))).all())
+    nodos += [('negocio', i) for parte in activos for i in parte]
+    filas = []
+    for tipo, nodo_id in nodos:
+        filas.extend(_filas(tipo, nodo_id, construir(tipo, nodo_id) or {}))
+    tabla = MensajePrerenderizado.__table__
+    db.session.execute(tabla.delete())
+    if filas:
+        db.session.execute(tabla.insert(), filas)
+    db.session.commit()
+    return len(filas)
+
+
+def _valores(objeto, atributo):
+    """Valores actual y anterior de un atributo (para invalidar el padre viejo y el nuevo)."""
+    historia = inspect(objeto).attrs[atributo].history
+    return set(historia.sum()) or {getattr(objeto, atributo)}
+
+
+def _nodos_afectados(objeto, nuevo_o_borrado):
+    if isinstance(objeto, Categoria):
+        yield 'categoria', objeto.id
+        for padre in _valores(objeto, 'parent_id'):
+            yield ('categoria', padre) if padre else ('raiz', 0)
+    elif isinstance(objeto, Subcategoria):
+        yield 'subcategoria', objeto.id
+        for padre in _valores(objeto, 'parent_id') - {None}:
+            yield 'subcategoria', padre
+        for categoria_id in _valores(objeto, 'categoria_id') - {None}:
+            yield 'categoria', categoria_id
+    elif isinstance(objeto, Negocio):
+        estado = inspect(objeto)
+        if nuevo_o_borrado or any(estado.attrs[c].history.has_changes() for c in CAMPOS_NEGOCIO):
+            yield 'negocio', objeto.id
+            for subcategoria_id in _valores(objeto, 'subcategoria_id') - {None}:
+                yield 'subcategoria', subcategoria_id
+
+
+@event.listens_for(SesionEnrutada, 'before_flush')
+def _recordar_cambios(sesion, contexto, instancias):
+    # Antes del flush la historia de atributos conserva los valores anteriores
+    afectados = sesion.info.setdefault('_menus_afectados', set())
+    for objeto in sesion.dirty:
+        afectados.update(_nodos_afectados(objeto, False))
+    for objeto in sesion.deleted:
+        afectados.update(_nodos_afectados(objeto, True))
+    sesion.info['_menus_nuevos'] = [o for o in sesion.new if isinstance(o, (Categoria, Subcategoria, Negocio))]
+
+
+@event.listens_for(SesionEnrutada, 'after_flush')
+def _invalidar_cambios(sesion, contexto):
+    afectados = sesion.info.pop('_menus_afectados', set())
+    for objeto in sesion.info.pop('_menus_nuevos', []):
+        afectados.update(_nodos_afectados(objeto, True))  # Los nuevos ya tienen id
+    if afectados:
+        tabla = MensajePrerenderizado.__table__
+        sesion.connection().execute(tabla.delete().where(db.or_(*(_rango_clave(t, i) for t, i in afectados))))
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+menus_cli = AppGroup('menus', help='Mensajes de WhatsApp pre-renderizados.')
+
+
+@menus_cli.command('generar')
+def generar_command():
+    """Reconstruye todos los menús y tarjetas (tras cargas masivas)."""
+    click.echo(f'Mensajes generados: {regenerar_menus()}')
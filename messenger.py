@@ -1,19 +1,27 @@
-import requests, os, dotenv, json
+import requests, os, dotenv, json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from metricas import observar, incrementar
 
 dotenv.load_dotenv()
 
 ws_key = os.environ.get('ws_key')
 ws_app = os.environ.get('ws_app')
 
+# Base de la Graph API; se puede apuntar a un servidor falso en pruebas
+API_URL = os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v22.0')
 
+# (conexión, lectura) en segundos; sin timeout un Graph lento bloquea el hilo indefinidamente
+TIMEOUT = (float(os.environ.get('WHATSAPP_TIMEOUT_CONEXION', 3)), float(os.environ.get('WHATSAPP_TIMEOUT', 10)))
 
-def enviar_mensaje_whatsapp(numero_telefono:str, mensaje:str, id_aplicacion=ws_app, token_acceso=ws_key):
-    
-    url = f"https://graph.facebook.com/v22.0/{id_aplicacion}/messages"
-    headers = {
-        "Authorization": f"Bearer {token_acceso}",
-        "Content-Type": "application/json"
-    }
+# Sesión compartida: reutiliza conexiones keep-alive en lugar de abrir una por mensaje
+_sesion = requests.Session()
+_sesion.mount('https://', HTTPAdapter(pool_maxsize=int(os.environ.get('WHATSAPP_POOL', 20))))
+_sesion.mount('http://', HTTPAdapter(pool_maxsize=int(os.environ.get('WHATSAPP_POOL', 20))))
+
+
+def payload_mensaje(numero_telefono:str, mensaje:str, contenido=None):
+    """Cuerpo de /messages: texto, o `contenido` ({'type': 'interactive', ...}) en su lugar."""
     payload = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -24,18 +32,90 @@ def enviar_mensaje_whatsapp(numero_telefono:str, mensaje:str, id_aplicacion=ws_a
             "body": mensaje
         }
     }
+    if contenido:
+        del payload["text"]
+        payload.update(contenido)
+    return payload
+
+
+def enviar_mensaje_detallado(numero_telefono:str, mensaje:str, id_aplicacion=ws_app, token_acceso=ws_key, url_base=None, verbose=False, contenido=None):
+    """
+    Envía un mensaje de texto y devuelve (status HTTP o None, detalle), donde
+    detalle es el id del mensaje (wamid) o la descripción del error.
+    `contenido` ({'type': 'interactive', 'interactive': {...}}) reemplaza al texto.
+    """
+    url = f"{url_base or API_URL}/{id_aplicacion}/messages"
+    headers = {
+        "Authorization": f"Bearer {token_acceso}",
+        "Content-Type": "application/json"
+    }
+    payload = payload_mensaje(numero_telefono, mensaje, contenido)
 
+    inicio = time.perf_counter()
+    resultado = 'error'
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = _sesion.post(url, headers=headers, json=payload, timeout=TIMEOUT)
         response.raise_for_status()  # Lanza un error para códigos de estado HTTP 4xx/5xx
-        print(f"Mensaje enviado exitosamente.\n{response.json()}")
-        
-        return response.status_code
+        datos = response.json()
+        if verbose:
+            print(f"Mensaje enviado exitosamente.\n{datos}")
+
+        resultado = 'ok'
+        return response.status_code, (datos.get('messages') or [{}])[0].get('id')
 
     except requests.exceptions.HTTPError as http_err:
+        incrementar('whatsapp_errors_total', {'tipo': 'http', 'status': response.status_code})
         print(f"Error HTTP: {http_err}")
         print(f"Respuesta del servidor: {response.text}")
+        return response.status_code, response.text[:500]
     except requests.exceptions.RequestException as err:
+        incrementar('whatsapp_errors_total', {'tipo': 'red', 'status': ''})
         print(f"Ocurrió un error al realizar la petición: {err}")
-    
-    return None
+        return None, str(err)[:500]
+    finally:
+        observar('whatsapp_request_duration_seconds', time.perf_counter() - inicio, {'resultado': resultado})
+
+
+def enviar_mensaje_whatsapp(numero_telefono:str, mensaje:str, id_aplicacion=ws_app, token_acceso=ws_key, url_base=None):
+    status, _ = enviar_mensaje_detallado(numero_telefono, mensaje, id_aplicacion, token_acceso, url_base, verbose=True)
+    return status if status is not None and status < 400 else None
+
+
+# ============================================
+# GRAPH API FALSA (PRUEBAS Y BENCHMARKS)
+# ============================================
+
+class _ManejadorGraphFalso(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como la Graph API real
+
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.server.latencia:
+            time.sleep(self.server.latencia)
+        with self.server.candado:
+            self.server.recibidos.append(cuerpo)
+            respuesta = json.dumps({'messages': [{'id': f'wamid.{len(self.server.recibidos)}'}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(respuesta)))
+        self.end_headers()
+        self.wfile.write(respuesta)
+
+    def log_message(self, *args):
+        pass
+
+
+def servidor_graph_falso(latencia=0.0):
+    """
+    Levanta en un hilo un servidor local que responde como la Graph API.
+    Devuelve el servidor; `servidor.url` se pasa como url_base y
+    `servidor.recibidos` guarda los mensajes. Detener con shutdown().
+    """
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), _ManejadorGraphFalso)
+    servidor.daemon_threads = True
+    servidor.latencia = latencia
+    servidor.recibidos = []
+    servidor.candado = threading.Lock()
+    servidor.url = f'http://127.0.0.1:{servidor.server_port}'
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
@@ -0,0 +1,306 @@
+"""
+Métricas en formato de texto de Prometheus, sin servicios externos.
+Cada proceso acumula sus valores en memoria y los vuelca a un archivo propio
+(metricas_<pid>.json) en METRICAS_DIR; /metrics suma los archivos de todos
+los workers de gunicorn, así que cualquier worker puede responder el scrape.
+Cuando un worker termina, el hook child_exit (gunicorn.conf.py) suma su
+archivo a acumulado.json y lo borra, como el modo multiproceso de
+prometheus_client: el directorio no crece con cada reinicio y los
+contadores no retroceden. Sin token, /metrics solo responde a la propia
+máquina.
+"""
+import atexit
+import fcntl
+import glob
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from sqlalchemy import event
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFINICIONES = {
+    'http_request_duration_seconds': ('histogram', 'Duración de las peticiones HTTP por endpoint.'),
+    'db_query_duration_seconds': ('histogram', 'Duración de las sentencias SQL por motor.'),
+    'db_pool_checkout_wait_seconds': ('histogram', 'Espera para obtener una conexión del pool.'),
+    'whatsapp_request_duration_seconds': ('histogram', 'Duración de las llamadas a la Graph API de WhatsApp.'),
+    'whatsapp_errors_total': ('counter', 'Errores al enviar mensajes de WhatsApp.'),
+    'login_bloqueos_total': ('counter', 'Intentos de inicio de sesión rechazados por el limitador.'),
+    'webhook_mensajes_total': ('counter', 'Mensajes recibidos en el webhook de WhatsApp por resultado.'),
+}
+
+# Segundos mínimos entre volcados a disco del proceso
+INTERVALO_VOLCADO = float(os.environ.get('METRICAS_INTERVALO', 1.0))
+
+_valores = {}
+_candado = threading.Lock()
+_estado = {'directorio': None, 'ultimo_volcado': 0.0, 'pid': None, 'absorbiendo': False}
+
+# Suma de los workers terminados
+ARCHIVO_ACUMULADO = 'acumulado.json'
+
+
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted((etiquetas or {}).items()))
+
+
+def observar(nombre, valor, etiquetas=None):
+    """Registra una observación en un histograma."""
+    clave = _clave(nombre, etiquetas)
+    with _candado:
+        h = _valores.get(clave)
+        if h is None:
+            h = _valores[clave] = {'buckets': [0] * len(BUCKETS), 'suma': 0.0, 'cuenta': 0}
+        for i, limite in enumerate(BUCKETS):
+            if valor <= limite:
+                h['buckets'][i] += 1
+                break
+        h['suma'] += valor
+        h['cuenta'] += 1
+
+
+def incrementar(nombre, etiquetas=None, cantidad=1):
+    """Incrementa un contador."""
+    clave = _clave(nombre, etiquetas)
+    with _candado:
+        _valores[clave] = _valores.get(clave, 0) + cantidad
+
+
+# ============================================
+# ALMACENAMIENTO COMPARTIDO ENTRE WORKERS
+# ============================================
+
+def directorio_por_defecto():
+    return os.environ.get('METRICAS_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metricas')
+
+
+@contextmanager
+def _bloqueo(directorio, modo):
+    """flock sobre el directorio: compartido para leer, exclusivo para absorber un archivo."""
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, '.bloqueo'), 'a') as f:
+        fcntl.flock(f, modo)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _escribir(directorio, nombre, datos):
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as f:
+        json.dump(datos, f)
+    os.replace(temporal, os.path.join(directorio, nombre))
+
+
+def _leer(ruta):
+    try:
+        with open(ruta) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _sumar(total, datos):
+    for nombre, etiquetas, valor in datos:
+        clave = (nombre, tuple(tuple(e) for e in etiquetas))
+        if isinstance(valor, dict):
+            acumulado = total.setdefault(clave, {'buckets': [0] * len(BUCKETS), 'suma': 0.0, 'cuenta': 0})
+            acumulado['buckets'] = [a + b for a, b in zip(acumulado['buckets'], valor['buckets'])]
+            acumulado['suma'] += valor['suma']
+            acumulado['cuenta'] += valor['cuenta']
+        else:
+            total[clave] = total.get(clave, 0) + valor
+    return total
+
+
+def _absorber(directorio, pid):
+    """Suma metricas_<pid>.json al acumulado y lo borra. Requiere el bloqueo exclusivo."""
+    ruta = os.path.join(directorio, f'metricas_{pid}.json')
+    datos = _leer(ruta)
+    if datos is None:
+        return
+    total = _sumar(_sumar({}, _leer(os.path.join(directorio, ARCHIVO_ACUMULADO)) or []), datos)
+    _escribir(directorio, ARCHIVO_ACUMULADO,
+              [[nombre, [list(e) for e in etiquetas], valor] for (nombre, etiquetas), valor in total.items()])
+    os.unlink(ruta)
+
+
+def volcar(forzar=False):
+    """Escribe los valores de este proceso en su archivo (escritura atómica)."""
+    directorio = _estado['directorio']
+    ahora = time.monotonic()
+    if directorio is None or (not forzar and ahora - _estado['ultimo_volcado'] < INTERVALO_VOLCADO):
+        return
+    _estado['ultimo_volcado'] = ahora
+    os.makedirs(directorio, exist_ok=True)
+    if _estado['pid'] != os.getpid():
+        # Un archivo con este pid es de un proceso terminado que tuvo el mismo pid
+        # y cuyo child_exit no llegó a correr: se absorbe antes de pisarlo
+        with _bloqueo(directorio, fcntl.LOCK_EX):
+            _absorber(directorio, os.getpid())
+        _estado['pid'] = os.getpid()
+    with _candado:
+        datos = [[nombre, list(etiquetas), valor] for (nombre, etiquetas), valor in _valores.items()]
+    _escribir(directorio, f'metricas_{os.getpid()}.json', datos)
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def proceso_terminado(pid=None, directorio=None):
+    """
+    Hook child_exit de gunicorn (se ejecuta en el master): suma a
+    acumulado.json y borra los archivos de los workers que ya no existen.
+    gunicorn lo llama desde el manejador de SIGCHLD, que puede volver a
+    entrar mientras se absorbe otro worker; esa llamada anidada no espera
+    el bloqueo (lo tiene este mismo proceso) y su archivo lo recoge la
+    llamada en curso o la siguiente.
+    """
+    if _estado['absorbiendo']:
+        return
+    _estado['absorbiendo'] = True
+    try:
+        directorio = directorio or _estado['directorio'] or directorio_por_defecto()
+        with _bloqueo(directorio, fcntl.LOCK_EX):
+            for ruta in glob.glob(os.path.join(directorio, 'metricas_*.json')):
+                otro = int(os.path.basename(ruta)[len('metricas_'):-len('.json')])
+                if otro == pid or not _vivo(otro):
+                    _absorber(directorio, otro)
+    finally:
+        _estado['absorbiendo'] = False
+
+
+def _agregar_archivos():
+    directorio = _estado['directorio']
+    with _bloqueo(directorio, fcntl.LOCK_SH):
+        rutas = [os.path.join(directorio, ARCHIVO_ACUMULADO), *glob.glob(os.path.join(directorio, 'metricas_*.json'))]
+        total = {}
+        for ruta in rutas:
+            _sumar(total, _leer(ruta) or [])
+    return total
+
+
+def _formatear_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ''
+    escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in pares) + '}'
+
+
+def exponer():
+    """Texto de exposición de Prometheus con los valores de todos los workers."""
+    volcar(forzar=True)
+    valores = _agregar_archivos()
+    lineas = []
+    for nombre, (tipo, ayuda) in DEFINICIONES.items():
+        series = sorted((clave, valor) for clave, valor in valores.items() if clave[0] == nombre)
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        for (_, etiquetas), valor in series:
+            if tipo == 'histogram':
+                acumulado = 0
+                for limite, cantidad in zip(BUCKETS, valor['buckets']):
+                    acumulado += cantidad
+                    lineas.append(f'{nombre}_bucket{_formatear_etiquetas(etiquetas, [("le", limite)])} {acumulado}')
+                lineas.append(f'{nombre}_bucket{_formatear_etiquetas(etiquetas, [("le", "+Inf")])} {valor["cuenta"]}')
+                lineas.append(f'{nombre}_sum{_formatear_etiquetas(etiquetas)} {valor["suma"]}')
+                lineas.append(f'{nombre}_count{_formatear_etiquetas(etiquetas)} {valor["cuenta"]}')
+            else:
+                lineas.append(f'{nombre}{_formatear_etiquetas(etiquetas)} {valor}')
+    return '\n'.join(lineas) + '\n'
+
+
+# ============================================
+# INSTRUMENTACIÓN DE FLASK Y SQLALCHEMY
+# ============================================
+
+def _instrumentar_motor(bind, engine):
+    etiquetas = {'bind': bind or 'principal'}
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_inicios_metricas', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        inicios = conn.info.get('_inicios_metricas')
+        if inicios:
+            observar('db_query_duration_seconds', time.perf_counter() - inicios.pop(), etiquetas)
+
+    # El pool no tiene evento previo al checkout: se mide envolviendo connect()
+    pool = engine.pool
+    conectar = pool.connect
+
+    def connect_medido():
+        inicio = time.perf_counter()
+        conexion = conectar()
+        observar('db_pool_checkout_wait_seconds', time.perf_counter() - inicio, etiquetas)
+        return conexion
+
+    pool.connect = connect_medido
+
+
+def _iniciar_peticion():
+    g._inicio_metricas = time.perf_counter()
+
+
+def _cerrar_peticion(response):
+    inicio = g.pop('_inicio_metricas', None)
+    if inicio is not None and request.endpoint != 'metricas':
+        observar('http_request_duration_seconds', time.perf_counter() - inicio, {
+            'endpoint': request.endpoint or 'sin_ruta',
+            'method': request.method,
+            'status': response.status_code,
+        })
+        volcar()
+    return response
+
+
+def vista_metricas():
+    token = os.environ.get('METRICAS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response('No autorizado\n', status=401, mimetype='text/plain')
+    elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        # Sin token solo se atiende a la propia máquina y nunca a través de un proxy
+        return Response('Configure METRICAS_TOKEN para leer /metrics desde otra máquina\n',
+                        status=403, mimetype='text/plain')
+    return Response(exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def configurar_metricas(app):
+    """
+    Registra la instrumentación y el endpoint /metrics.
+    Se desactiva con METRICAS_ACTIVAS=0. Con METRICAS_TOKEN exige ese Bearer
+    token; sin él solo responde a peticiones directas desde localhost.
+    """
+    app.config.setdefault('METRICAS_ACTIVAS', os.environ.get('METRICAS_ACTIVAS', '1') == '1')
+    if not app.config['METRICAS_ACTIVAS']:
+        return
+
+    from models import db
+
+    _estado['directorio'] = os.environ.get('METRICAS_DIR') or os.path.join(app.instance_path, 'metricas')
+    atexit.register(volcar, forzar=True)
+
+    with app.app_context():
+        for bind, engine in db.engines.items():
+            _instrumentar_motor(bind, engine)
+    app.before_request(_iniciar_peticion)
+    app.after_request(_cerrar_peticion)
+    app.add_url_rule('/metrics', 'metricas', vista_metricas)
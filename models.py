@@ -1,9 +1,13 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, select, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.schema import CreateIndex
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from basedatos import SesionEnrutada
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': SesionEnrutada})
 
 # Tablas existentes (User, Producto, Servicio, Venta) permanecen igual
 # ...
@@ -23,6 +27,8 @@ class Categoria(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    ruta = db.Column(db.String(255), nullable=True, index=True)  # Ruta materializada: '/1/5/'
+    clave = db.Column(db.String(100), nullable=True, index=True)  # Identificador estable en taxonomia.json
     
     # Relaciones
     subcategorias = db.relationship('Subcategoria', backref='categoria', lazy=True, cascade='all, delete-orphan')
@@ -30,6 +36,21 @@ class Categoria(db.Model):
     
     def __repr__(self):
         return f'<Categoria {self.nombre} (Nivel {self.nivel})>'
+    
+    def ancestros(self):
+        """Categorías ancestro, de la raíz hacia abajo, en una sola consulta por PK."""
+        ids = _ids_en_ruta(self.ruta)[0][:-1]
+        return Categoria.query.filter(Categoria.id.in_(ids)).order_by(db.func.length(Categoria.ruta))
+    
+    def breadcrumb(self):
+        """Lista [{'id', 'nombre'}] desde la raíz hasta esta categoría."""
+        ids = _ids_en_ruta(self.ruta)[0] or [self.id]
+        filas = db.session.execute(
+            select(Categoria.id, Categoria.nombre)
+            .where(Categoria.id.in_(ids))
+            .order_by(db.func.length(Categoria.ruta))
+        ).all()
+        return [{'id': f.id, 'nombre': f.nombre} for f in filas]
 
 class Subcategoria(db.Model):
     __tablename__ = 'subcategorias'
@@ -45,19 +66,53 @@ class Subcategoria(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    ruta = db.Column(db.String(255), nullable=True, index=True)  # Ruta de la categoría + 's7/s9/'
+    clave = db.Column(db.String(150), nullable=True, index=True)  # Identificador estable en taxonomia.json
     
     # Relaciones
     children = db.relationship('Subcategoria', backref=db.backref('parent', remote_side=[id]), lazy=True)
     
     def __repr__(self):
         return f'<Subcategoria {self.nombre}>'
+    
+    def breadcrumb(self):
+        """
+        Lista [{'tipo', 'id', 'nombre'}] desde la categoría raíz hasta esta subcategoría.
+        Categorías y subcategorías se resuelven en una sola consulta (UNION ALL).
+        """
+        ids_categorias, ids_subcategorias = _ids_en_ruta(self.ruta)
+        if not ids_subcategorias:
+            ids_subcategorias = [self.id]
+        consulta = db.union_all(
+            select(db.literal('categoria').label('tipo'), Categoria.id, Categoria.nombre, Categoria.ruta)
+            .where(Categoria.id.in_(ids_categorias)),
+            select(db.literal('subcategoria').label('tipo'), Subcategoria.id, Subcategoria.nombre, Subcategoria.ruta)
+            .where(Subcategoria.id.in_(ids_subcategorias)),
+        ).subquery()
+        filas = db.session.execute(
+            select(consulta.c.tipo, consulta.c.id, consulta.c.nombre)
+            .order_by(db.func.length(consulta.c.ruta))
+        ).all()
+        return [{'tipo': f.tipo, 'id': f.id, 'nombre': f.nombre} for f in filas]
 
 # NUEVO MODELO: NEGOCIO/PROFILE
 class Negocio(db.Model):
     __tablename__ = 'negocios'
+    __table_args__ = (
+        # Un índice por cada sort= de /api/buscar (funciones.ORDENES_BUSQUEDA)
+        db.Index('ix_negocio_relevancia', 'activo', 'destacado', 'calificacion_promedio'),
+        db.Index('ix_negocio_calificacion', 'activo', 'calificacion_promedio', 'total_resenas'),
+        db.Index('ix_negocio_precio', 'activo', 'precio_estimado'),
+        db.Index('ix_negocio_destacados', 'activo', 'destacado', 'total_agendamientos'),
+        db.Index('ix_negocio_popularidad', 'activo', 'total_agendamientos'),
+        # Facetas de /api/buscar: el GROUP BY se resuelve sin leer las filas
+        db.Index('ix_negocio_facetas', 'activo', 'subcategoria_id', 'ubicacion', 'precio_estimado'),
+        {'info': {'por_ciudad': True}},  # Vive en la partición de su ciudad
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer)
+    subcategoria_id = db.Column(db.Integer, db.ForeignKey('subcategorias.id'), nullable=True, index=True)
     nombre = db.Column(db.String(200), nullable=False)
     descripcion_corta = db.Column(db.String(300), nullable=False)
     descripcion_larga = db.Column(db.Text, nullable=True)
@@ -114,9 +169,27 @@ class Negocio(db.Model):
             'calificacion': float(self.calificacion_promedio) if self.calificacion_promedio else None,
         }
 
+# precio_asc deja los negocios sin precio al final: ORDER BY (precio IS NULL), precio
+db.Index('ix_negocio_precio_asc', Negocio.activo, Negocio.precio_estimado.is_(None), Negocio.precio_estimado)
+
 # NUEVO MODELO: AGENDAMIENTO/LEAD
 class Agendamiento(db.Model):
     __tablename__ = 'agendamientos'
+    __table_args__ = (
+        # Un turno activo por negocio y hora: la base rechaza las reservas dobles
+        db.Index(
+            'uq_agendamiento_turno', 'id_negocio', 'fecha_agendada', unique=True,
+            sqlite_where=db.text("estado IN ('pendiente', 'confirmado')"),
+            postgresql_where=db.text("estado IN ('pendiente', 'confirmado')"),
+        ),
+        # Ventana de próximos agendamientos que carga recordatorios.py
+        db.Index('ix_agendamiento_estado_fecha', 'estado', 'fecha_agendada'),
+        # Agendamientos recientes (estadísticas y contar_historial de archivo.py)
+        db.Index('ix_agendamiento_created_at', 'created_at'),
+        # Cambios que recordatorios.py recoge desde cualquier proceso
+        db.Index('ix_agendamiento_updated_at', 'updated_at'),
+        {'info': {'por_ciudad': True}},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -133,6 +206,7 @@ class Agendamiento(db.Model):
     fecha_agendada = db.Column(db.DateTime, nullable=True)
     estado = db.Column(db.String(20), default='pendiente')  # 'pendiente', 'confirmado', 'cancelado', 'completado'
     nota = db.Column(db.Text, nullable=True)
+    recordatorio_enviado = db.Column(db.DateTime, nullable=True)
     
     # Metadata
     origen = db.Column(db.String(50), default='whatsapp')  # 'whatsapp', 'web', 'telefono'
@@ -146,6 +220,7 @@ class Agendamiento(db.Model):
 # MODELO OPCIONAL: RESEÑAS
 class Resena(db.Model):
     __tablename__ = 'resenas'
+    __table_args__ = {'info': {'por_ciudad': True}}
     
     id = db.Column(db.Integer, primary_key=True)
     negocio_id = db.Column(db.Integer, db.ForeignKey('negocios.id'), nullable=False)
@@ -166,7 +241,7 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(120), unique=True, nullable=True)
     role = db.Column(db.String(20), default='usuario')  # 'admin' o 'usuario'
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.now)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
     last_login = db.Column(db.DateTime, nullable=True)
     
     def set_password(self, password):
@@ -183,14 +258,24 @@ class User(db.Model, UserMixin):
         return self.is_active
 
 class Producto(db.Model):
+    __table_args__ = (
+        # Resumen de catálogo por vendedor: más vendidos y luego más recientes
+        db.Index('ix_producto_ranking', 'created_by', 'vendidos', 'created_at'),
+        # Búsqueda de catálogo (catalogo.py): rango de precio dentro de una categoría y orden global
+        db.Index('ix_producto_categoria_precio', 'categoria_id', 'precio'),
+        db.Index('ix_producto_subcategoria_precio', 'subcategoria_id', 'precio'),
+        db.Index('ix_producto_precio', 'precio'),
+        db.Index('ix_producto_vendidos', 'vendidos'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     descripcion = db.Column(db.Text)
     precio = db.Column(db.Float, nullable=False)
     stock = db.Column(db.Integer, default=0)
     vendidos = db.Column(db.Integer, default=0)
-    categoria_id = db.Column(db.Integer, db.ForeignKey('categorias.id'))
-    subcategoria_id = db.Column(db.Integer, db.ForeignKey('subcategorias.id'))
+    categoria_id = db.Column(db.Integer, db.ForeignKey('categorias.id'), index=True)
+    subcategoria_id = db.Column(db.Integer, db.ForeignKey('subcategorias.id'), index=True)
     categoria = db.relationship('Categoria', backref=db.backref('productos', lazy=True))
     subcategoria = db.relationship('Subcategoria', backref=db.backref('productos', lazy=True))
     imagen_url = db.Column(db.String(255))
@@ -199,14 +284,24 @@ class Producto(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
 class Servicio(db.Model):
+    __table_args__ = (
+        # Resumen de catálogo por vendedor: más vendidos y luego más recientes
+        db.Index('ix_servicio_ranking', 'created_by', 'vendidos', 'created_at'),
+        # Búsqueda de catálogo (catalogo.py): rango de precio dentro de una categoría y orden global
+        db.Index('ix_servicio_categoria_precio', 'categoria_id', 'precio'),
+        db.Index('ix_servicio_subcategoria_precio', 'subcategoria_id', 'precio'),
+        db.Index('ix_servicio_precio', 'precio'),
+        db.Index('ix_servicio_vendidos', 'vendidos'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     descripcion = db.Column(db.Text)
     precio = db.Column(db.Float, nullable=False)
     vendidos = db.Column(db.Integer, default=0)
     duracion = db.Column(db.String(50))
-    categoria_id = db.Column(db.Integer, db.ForeignKey('categorias.id'))
-    subcategoria_id = db.Column(db.Integer, db.ForeignKey('subcategorias.id'))
+    categoria_id = db.Column(db.Integer, db.ForeignKey('categorias.id'), index=True)
+    subcategoria_id = db.Column(db.Integer, db.ForeignKey('subcategorias.id'), index=True)
     categoria = db.relationship('Categoria', backref=db.backref('servicios', lazy=True))
     subcategoria = db.relationship('Subcategoria', backref=db.backref('servicios', lazy=True))
     imagen_url = db.Column(db.String(255))
@@ -215,10 +310,288 @@ class Servicio(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
 class Venta(db.Model):
+    __table_args__ = (
+        # Ventas por vendedor (perfil) y selección de lotes a archivar
+        db.Index('ix_venta_vendedor_fecha', 'vendedor_id', 'fecha'),
+        db.Index('ix_venta_fecha', 'fecha'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     fecha = db.Column(db.DateTime, default=datetime.now)
     tipo = db.Column(db.String(10))  # 'producto' o 'servicio'
     item_id = db.Column(db.Integer, nullable=False)
     cantidad = db.Column(db.Integer, default=1)
     total = db.Column(db.Float, nullable=False)
-    vendedor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
\ No newline at end of file
+    vendedor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+# CAMPAÑAS DE DIFUSIÓN POR WHATSAPP
+class Campana(db.Model):
+    __tablename__ = 'campanas'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(150), nullable=False)
+    plantilla = db.Column(db.Text, nullable=False)  # Texto con campos {nombre}, {ubicacion}
+    destinatarios = db.Column(db.String(50), nullable=False)  # Consulta nombrada de difusion.py
+    filtros = db.Column(db.Text, nullable=True)  # JSON con los filtros de la consulta
+    estado = db.Column(db.String(20), default='pendiente')  # 'pendiente', 'en_curso', 'completada', 'fallida'
+    latido = db.Column(db.DateTime, nullable=True)  # Última actividad del proceso que envía
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f'<Campana {self.id} - {self.nombre}>'
+
+class CampanaDestinatario(db.Model):
+    __tablename__ = 'campana_destinatarios'
+    __table_args__ = (
+        db.UniqueConstraint('campana_id', 'telefono', name='uq_campana_telefono'),
+        # Pendientes de una campaña en orden de id (reanudación por lotes)
+        db.Index('ix_campana_destinatario_estado', 'campana_id', 'estado', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campana_id = db.Column(db.Integer, db.ForeignKey('campanas.id'), nullable=False)
+    negocio_id = db.Column(db.Integer, nullable=True)
+    nombre = db.Column(db.String(200), nullable=True)
+    ubicacion = db.Column(db.String(100), nullable=True)
+    telefono = db.Column(db.String(20), nullable=False)
+    estado = db.Column(db.String(20), default='pendiente')  # 'pendiente', 'enviado', 'error'
+    status_http = db.Column(db.Integer, nullable=True)
+    respuesta = db.Column(db.String(500), nullable=True)  # wamid o descripción del error
+    enviado_at = db.Column(db.DateTime, nullable=True)
+
+# MENSAJES ENTRANTES DEL WEBHOOK DE WHATSAPP
+class MensajeEntrante(db.Model):
+    __tablename__ = 'mensajes_entrantes'
+    __table_args__ = (
+        # Pendientes más antiguos primero (recuperación tras una caída)
+        db.Index('ix_mensaje_entrante_estado', 'estado', 'recibido_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    wamid = db.Column(db.String(200), unique=True, nullable=False)  # Id de WhatsApp: deduplica reintentos
+    telefono = db.Column(db.String(20), nullable=False)
+    nombre = db.Column(db.String(100), nullable=True)  # Nombre del perfil de WhatsApp
+    tipo = db.Column(db.String(20), nullable=False)  # 'text', 'button', 'interactive', ...
+    payload = db.Column(db.String(200), nullable=True)  # Id del botón pulsado
+    cuerpo = db.Column(db.Text, nullable=False)  # JSON original del mensaje
+    estado = db.Column(db.String(20), default='pendiente')  # 'pendiente', 'procesando', 'procesado', 'error', 'ignorado'
+    error = db.Column(db.String(500), nullable=True)
+    recibido_at = db.Column(db.DateTime, default=datetime.now)
+    reclamado_at = db.Column(db.DateTime, nullable=True)  # Pasó a 'procesando' (plazo para recuperarlo)
+    procesado_at = db.Column(db.DateTime, nullable=True)
+
+# MENSAJES DE WHATSAPP PRE-RENDERIZADOS (menus.py)
+class MensajePrerenderizado(db.Model):
+    __tablename__ = 'mensajes_prerenderizados'
+    
+    clave = db.Column(db.String(100), primary_key=True)  # 'categoria:5:1', 'negocio:12:1'
+    contenido = db.Column(db.Text, nullable=False)  # JSON listo para la Graph API
+    etag = db.Column(db.String(32), nullable=False)
+    actualizado = db.Column(db.DateTime, default=datetime.now)
+
+# DIRECTORIO GLOBAL DE NEGOCIOS PARTICIONADOS (particiones.py)
+class DirectorioNegocio(db.Model):
+    __tablename__ = 'directorio_negocios'
+    __table_args__ = {'sqlite_autoincrement': True}  # Un id borrado no se reutiliza en otra partición
+    
+    id = db.Column(db.Integer, primary_key=True)  # Mismo id que el Negocio en su partición
+    ciudad = db.Column(db.String(50), nullable=True, index=True)  # None: base principal
+
+# ARCHIVOS SUBIDOS, DIRECCIONADOS POR CONTENIDO (medios.py)
+class Medio(db.Model):
+    __tablename__ = 'medios'
+
+    sha256 = db.Column(db.String(64), primary_key=True)  # Hash del contenido: misma foto, mismo archivo
+    extension = db.Column(db.String(10), nullable=False)  # 'jpg', 'png', 'webp', 'gif'
+    tamano = db.Column(db.Integer, nullable=False)  # Bytes del original
+    ancho = db.Column(db.Integer, nullable=True)
+    alto = db.Column(db.Integer, nullable=True)
+    variantes = db.Column(db.JSON, default=list)  # Anchos generados en WebP: [160, 480, 1080]
+    estado = db.Column(db.String(20), default='pendiente')  # 'pendiente', 'listo', 'sin_variantes', 'error'
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+# ============================================
+# RUTAS MATERIALIZADAS DE LA JERARQUÍA
+# ============================================
+# Cada Categoria guarda en `ruta` los ids desde la raíz ('/1/5/') y cada
+# Subcategoria continúa la ruta de su categoría con prefijo 's' ('/1/5/s7/s9/').
+# Todo el subárbol de un nodo es un rango contiguo del índice de `ruta`.
+
+def rango_ruta(ruta):
+    """Límites [desde, hasta) que cubren una ruta y todo su subárbol."""
+    return ruta, ruta[:-1] + '0'  # '0' es el carácter siguiente a '/'
+
+def filtro_subarbol(columna, ruta):
+    """Condición indexable para `columna` dentro del subárbol de `ruta`."""
+    desde, hasta = rango_ruta(ruta)
+    return db.and_(columna >= desde, columna < hasta)
+
+def _ids_en_ruta(ruta):
+    """Separa una ruta en (ids de categorías, ids de subcategorías)."""
+    categorias, subcategorias = [], []
+    for segmento in (ruta or '').strip('/').split('/'):
+        if segmento.startswith('s'):
+            subcategorias.append(int(segmento[1:]))
+        elif segmento:
+            categorias.append(int(segmento))
+    return categorias, subcategorias
+
+def _ruta_categoria(connection, parent_id, categoria_id):
+    base = None
+    if parent_id:
+        base = connection.scalar(select(Categoria.ruta).where(Categoria.id == parent_id))
+    return f'{base or "/"}{categoria_id}/'
+
+def _ruta_subcategoria(connection, categoria_id, parent_id, subcategoria_id):
+    if parent_id:
+        base = connection.scalar(select(Subcategoria.ruta).where(Subcategoria.id == parent_id))
+    else:
+        base = connection.scalar(select(Categoria.ruta).where(Categoria.id == categoria_id))
+    return f'{base or "/"}s{subcategoria_id}/'
+
+def _rebasar_subarbol(connection, vieja, nueva):
+    """Reescribe el prefijo `vieja` por `nueva` en todas las rutas del subárbol."""
+    for tabla in (Categoria.__table__, Subcategoria.__table__):
+        connection.execute(
+            tabla.update()
+            .where(filtro_subarbol(tabla.c.ruta, vieja))
+            .values(ruta=db.literal(nueva, db.String) + db.func.substr(tabla.c.ruta, len(vieja) + 1))
+        )
+
+def _guardar_ruta(connection, target, ruta):
+    tabla = type(target).__table__
+    connection.execute(tabla.update().where(tabla.c.id == target.id).values(ruta=ruta))
+    set_committed_value(target, 'ruta', ruta)
+
+def _mover_nodo(connection, target, nueva):
+    vieja = target.ruta
+    if vieja == nueva:
+        return
+    if vieja and nueva.startswith(vieja):
+        raise ValueError(f'No se puede mover {target!r} dentro de su propio subárbol')
+    if vieja:
+        _rebasar_subarbol(connection, vieja, nueva)
+    set_committed_value(target, 'ruta', nueva)
+
+@event.listens_for(Categoria, 'after_insert')
+def _categoria_insertada(mapper, connection, target):
+    _guardar_ruta(connection, target, _ruta_categoria(connection, target.parent_id, target.id))
+
+@event.listens_for(Categoria, 'after_update')
+def _categoria_actualizada(mapper, connection, target):
+    if not db.inspect(target).attrs.parent_id.history.has_changes():
+        return
+    _mover_nodo(connection, target, _ruta_categoria(connection, target.parent_id, target.id))
+
+@event.listens_for(Categoria, 'after_delete')
+def _categoria_eliminada(mapper, connection, target):
+    # Los hijos suben un nivel: pasan a colgar del padre del nodo eliminado
+    tabla = Categoria.__table__
+    connection.execute(tabla.update().where(tabla.c.parent_id == target.id).values(parent_id=target.parent_id))
+    if target.ruta:
+        _rebasar_subarbol(connection, target.ruta, target.ruta[:-len(f'{target.id}/')])
+
+@event.listens_for(Subcategoria, 'after_insert')
+def _subcategoria_insertada(mapper, connection, target):
+    ruta = _ruta_subcategoria(connection, target.categoria_id, target.parent_id, target.id)
+    _guardar_ruta(connection, target, ruta)
+
+@event.listens_for(Subcategoria, 'after_update')
+def _subcategoria_actualizada(mapper, connection, target):
+    estado = db.inspect(target)
+    if not (estado.attrs.parent_id.history.has_changes() or estado.attrs.categoria_id.history.has_changes()):
+        return
+    vieja = target.ruta
+    _mover_nodo(connection, target, _ruta_subcategoria(connection, target.categoria_id, target.parent_id, target.id))
+    if vieja:
+        # Las especialidades hijas acompañan a su subcategoría a la nueva categoría
+        tabla = Subcategoria.__table__
+        connection.execute(
+            tabla.update()
+            .where(filtro_subarbol(tabla.c.ruta, target.ruta))
+            .values(categoria_id=target.categoria_id)
+        )
+
+@event.listens_for(Subcategoria, 'after_delete')
+def _subcategoria_eliminada(mapper, connection, target):
+    tabla = Subcategoria.__table__
+    connection.execute(tabla.update().where(tabla.c.parent_id == target.id).values(parent_id=target.parent_id))
+    if target.ruta:
+        _rebasar_subarbol(connection, target.ruta, target.ruta[:-len(f's{target.id}/')])
+
+def reconstruir_rutas():
+    """
+    Recalcula en memoria las rutas de toda la jerarquía y guarda solo las que
+    cambiaron, en un UPDATE masivo por tabla. Útil para bases existentes.
+    Devuelve el número de filas corregidas.
+    """
+    categorias = {c.id: c for c in db.session.execute(select(Categoria.id, Categoria.parent_id, Categoria.ruta))}
+    rutas = {}
+    
+    def ruta_de(categoria_id, visitados=()):
+        if categoria_id not in rutas:
+            fila = categorias[categoria_id]
+            padre = fila.parent_id if fila.parent_id in categorias and fila.parent_id not in visitados else None
+            base = ruta_de(padre, visitados + (categoria_id,)) if padre else '/'
+            rutas[categoria_id] = f'{base}{categoria_id}/'
+        return rutas[categoria_id]
+    
+    cambios_cat = [
+        {'id': c.id, 'ruta': ruta_de(c.id)}
+        for c in categorias.values() if ruta_de(c.id) != c.ruta
+    ]
+    
+    subcategorias = {
+        s.id: s for s in db.session.execute(
+            select(Subcategoria.id, Subcategoria.categoria_id, Subcategoria.parent_id, Subcategoria.ruta)
+        )
+    }
+    rutas_sub = {}
+    
+    def ruta_sub(subcategoria_id, visitados=()):
+        if subcategoria_id not in rutas_sub:
+            fila = subcategorias[subcategoria_id]
+            padre = fila.parent_id if fila.parent_id in subcategorias and fila.parent_id not in visitados else None
+            if padre:
+                base = ruta_sub(padre, visitados + (subcategoria_id,))
+            else:
+                base = rutas.get(fila.categoria_id, '/')
+            rutas_sub[subcategoria_id] = f'{base}s{subcategoria_id}/'
+        return rutas_sub[subcategoria_id]
+    
+    cambios_sub = [
+        {'id': s.id, 'ruta': ruta_sub(s.id)}
+        for s in subcategorias.values() if ruta_sub(s.id) != s.ruta
+    ]
+    
+    if cambios_cat:
+        db.session.execute(update(Categoria), cambios_cat)
+    if cambios_sub:
+        db.session.execute(update(Subcategoria), cambios_sub)
+    db.session.commit()
+    return len(cambios_cat) + len(cambios_sub)
+
+def actualizar_esquema(motor=None, tablas=None):
+    """
+    Agrega a las tablas existentes las columnas e índices nuevos del modelo.
+    `db.create_all()` solo crea tablas que no existen; en SQLite basta con
+    ALTER TABLE ADD COLUMN para columnas opcionales. `motor` y `tablas`
+    permiten aplicarlo a una partición por ciudad.
+    """
+    motor = motor or db.engine
+    inspector = db.inspect(motor)
+    with motor.begin() as conn:
+        for tabla in tablas or db.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {c['name'] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=conn.dialect)
+                    conn.execute(db.text(f'ALTER TABLE "{tabla.name}" ADD COLUMN "{columna.name}" {tipo}'))
+            for indice in tabla.indexes:
+                # IF NOT EXISTS en lugar de checkfirst: la reflexión omite los índices de expresión
+                conn.execute(CreateIndex(indice, if_not_exists=True))
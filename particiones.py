@@ -0,0 +1,217 @@
+"""
+Particiones por ciudad.
+Cada ciudad de PARTICIONES_CIUDADES guarda sus negocios, agendamientos y
+reseñas (tablas con info={'por_ciudad': True}) en su propio archivo SQLite,
+registrado como bind 'ciudad:<nombre>' en basedatos.py. La base principal
+conserva lo global (usuarios, taxonomía, catálogo, campañas), los negocios
+de ciudades sin partición y el directorio negocio -> ciudad, que además
+reparte ids de negocio únicos entre todas las particiones. Cada partición
+adjunta la base principal como 'global', así que los JOIN con
+subcategorías, usuarios o productos no cambian.
+SesionEnrutada envía esas tablas a la partición de g._ciudad; las búsquedas
+sin ciudad consultan todas las particiones en paralelo.
+Uso: flask --app app particiones migrar
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import click
+from flask import current_app, g, request
+from flask.cli import AppGroup
+from sqlalchemy import event, select
+
+from basedatos import BIND_CIUDAD, SesionEnrutada, ciudad_actual, normalizar_ciudad
+from models import DirectorioNegocio, Negocio, actualizar_esquema, db
+
+TABLAS_POR_CIUDAD = [t for t in db.metadata.sorted_tables if t.info.get('por_ciudad')]
+
+_pool = {'pid': None, 'ejecutor': None}
+_candado = threading.Lock()
+
+
+def ciudades():
+    """Ciudades con partición propia en la aplicación actual."""
+    return list(current_app.config.get('PARTICIONES_CIUDADES') or ())
+
+
+def ciudad_de_ubicacion(ubicacion):
+    """Ciudad particionada mencionada en Negocio.ubicacion ('Centro, Quito'), o None."""
+    texto = f'-{normalizar_ciudad(ubicacion)}-'
+    for ciudad in ciudades():
+        if f'-{ciudad}-' in texto:
+            return ciudad
+    return None
+
+
+def ciudad_de_negocio(negocio_id):
+    """Partición donde vive el negocio según el directorio global."""
+    if not ciudades():
+        return None
+    return db.session.scalar(select(DirectorioNegocio.ciudad).where(DirectorioNegocio.id == negocio_id))
+
+
+@contextmanager
+def en_ciudad(ciudad):
+    """Enruta las tablas por ciudad a `ciudad` (None = base principal) dentro del bloque."""
+    anterior = g.pop('_ciudad', en_ciudad)
+    g._ciudad = ciudad
+    try:
+        yield
+    finally:
+        if anterior is en_ciudad:
+            g.pop('_ciudad', None)
+        else:
+            g._ciudad = anterior
+
+
+def _ejecutor():
+    # Se crea en el proceso que lo usa (después del fork de gunicorn)
+    with _candado:
+        if _pool['pid'] != os.getpid():
+            hilos = int(os.environ.get('PARTICIONES_HILOS', 8))
+            _pool['ejecutor'] = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='particion')
+            _pool['pid'] = os.getpid()
+        return _pool['ejecutor']
+
+
+def en_todas_las_ciudades(funcion, *args, **kwargs):
+    """
+    Ejecuta `funcion` en la base principal y en cada partición en paralelo y
+    devuelve la lista de resultados. Cada hilo tiene su propio contexto y
+    sesión, así que `funcion` debe devolver datos planos y no leer `request`.
+    Sin particiones, o con una ciudad ya elegida, se ejecuta una sola vez.
+    """
+    if not ciudades() or '_ciudad' in g:
+        return [funcion(*args, **kwargs)]
+    app = current_app._get_current_object()
+    lectura = g.get('_solo_lectura', False)
+
+    def en_particion(ciudad):
+        with app.app_context():
+            g._ciudad, g._solo_lectura = ciudad, lectura
+            return funcion(*args, **kwargs)
+
+    return list(_ejecutor().map(en_particion, [None, *ciudades()]))
+
+
+def seleccionar_ciudad():
+    """
+    before_request de api_bp: la ciudad sale del negocio de la URL o del
+    cuerpo JSON (vía directorio) o de ?ciudad= / X-Ciudad.
+    """
+    if not ciudades():
+        return
+    negocio_id = (request.view_args or {}).get('negocio_id')
+    if negocio_id is None and request.is_json:
+        negocio_id = (request.get_json(silent=True) or {}).get('negocio_id')
+    if negocio_id is not None:
+        g._ciudad = ciudad_de_negocio(negocio_id)
+        return
+    ciudad = request.args.get('ciudad') or request.headers.get('X-Ciudad')
+    if ciudad:
+        ciudad = normalizar_ciudad(ciudad)
+        g._ciudad = ciudad if ciudad in ciudades() else None
+
+
+@event.listens_for(SesionEnrutada, 'before_flush')
+def _asignar_ids(sesion, contexto, instancias):
+    """Los negocios nuevos toman su id del directorio global."""
+    nuevos = [o for o in sesion.new if isinstance(o, Negocio) and o.id is None]
+    if not nuevos or not ciudades():
+        return
+    ciudad = ciudad_actual()
+    tabla = DirectorioNegocio.__table__
+    for negocio in nuevos:
+        if ciudad_de_ubicacion(negocio.ubicacion) != ciudad:
+            raise ValueError(f'El negocio "{negocio.nombre}" pertenece a otra partición: créelo dentro de en_ciudad()')
+        negocio.id = sesion.connection().execute(tabla.insert().values(ciudad=ciudad)).inserted_primary_key[0]
+
+
+# ============================================
+# ESQUEMA Y MIGRACIÓN
+# ============================================
+
+def preparar_particiones():
+    """
+    Crea las tablas por ciudad en cada partición y registra en el
+    directorio los negocios de la base principal que aún no estén.
+    """
+    for ciudad in ciudades():
+        motor = db.engines[BIND_CIUDAD + ciudad]
+        db.metadata.create_all(motor, tables=TABLAS_POR_CIUDAD)
+        actualizar_esquema(motor, TABLAS_POR_CIUDAD)
+    directorio, negocios = DirectorioNegocio.__table__, Negocio.__table__
+    with db.engine.begin() as conn:
+        conn.execute(directorio.insert().from_select(
+            ['id', 'ciudad'],
+            select(negocios.c.id, db.null()).where(~negocios.c.id.in_(select(directorio.c.id)))
+        ))
+
+
+def migrar_a_particiones():
+    """
+    Mueve de la base principal a su partición los negocios cuya ubicación
+    nombra una ciudad particionada, con sus agendamientos y reseñas.
+    Conserva los ids. Devuelve {ciudad: negocios movidos}.
+    """
+    preparar_particiones()
+    negocios = Negocio.__table__
+    with db.engine.connect() as conn:
+        filas = conn.execute(select(negocios.c.id, negocios.c.ubicacion)).all()
+    por_ciudad = {}
+    for negocio_id, ubicacion in filas:
+        ciudad = ciudad_de_ubicacion(ubicacion)
+        if ciudad:
+            por_ciudad.setdefault(ciudad, []).append(negocio_id)
+
+    movidos = {}
+    for ciudad, ids in por_ciudad.items():
+        with db.engine.begin() as origen, db.engines[BIND_CIUDAD + ciudad].begin() as destino:
+            for tabla in TABLAS_POR_CIUDAD:
+                filtro = _filtro_negocio(tabla, ids)
+                datos = [dict(f) for f in origen.execute(select(tabla).where(filtro)).mappings()]
+                if datos:
+                    destino.execute(tabla.insert().prefix_with('OR REPLACE'), datos)
+            # Primero los hijos: las FK apuntan a negocios
+            for tabla in reversed(TABLAS_POR_CIUDAD):
+                origen.execute(tabla.delete().where(_filtro_negocio(tabla, ids)))
+            origen.execute(DirectorioNegocio.__table__.update()
+                           .where(DirectorioNegocio.id.in_(ids)).values(ciudad=ciudad))
+        movidos[ciudad] = len(ids)
+    return movidos
+
+
+def _filtro_negocio(tabla, ids):
+    columna = tabla.c.id if tabla is Negocio.__table__ else next(
+        c for c in tabla.c if any(fk.column.table is Negocio.__table__ for fk in c.foreign_keys)
+    )
+    return columna.in_(ids)
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+particiones_cli = AppGroup('particiones', help='Particiones de negocios por ciudad.')
+
+
+@particiones_cli.command('migrar')
+def migrar_command():
+    """Mueve los negocios de cada ciudad particionada a su propia base."""
+    if not ciudades():
+        raise click.ClickException('PARTICIONES_CIUDADES no está configurado')
+    movidos = migrar_a_particiones()
+    for ciudad in ciudades():
+        click.echo(f'{ciudad}: {movidos.get(ciudad, 0)} negocios movidos')
+
+
+@particiones_cli.command('estado')
+def estado_command():
+    """Negocios por partición según el directorio."""
+    filas = db.session.execute(
+        select(DirectorioNegocio.ciudad, db.func.count()).group_by(DirectorioNegocio.ciudad)
+    ).all()
+    for ciudad, total in filas:
+        click.echo(f'{ciudad or "(principal)"}: {total}')
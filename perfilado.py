@@ -0,0 +1,120 @@
+"""
+Perfilado de SQL por petición (opcional).
+Con PERFILAR_SQL=1 se cuentan las consultas de cada petición, su tiempo total
+y las sentencias repetidas (patrones N+1). Los datos se devuelven en la
+cabecera Server-Timing y se acumulan por endpoint para /admin/perfilado.
+Desactivado no registra ningún evento, así que no tiene costo.
+"""
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+# Una sentencia repetida al menos este número de veces se reporta como N+1
+UMBRAL_N_MAS_1 = int(os.environ.get('PERFILAR_SQL_UMBRAL_N1', 5))
+
+_estadisticas = {}
+_candado = threading.Lock()
+
+
+def huella_sql(sentencia):
+    """Normaliza una sentencia para agrupar ejecuciones repetidas."""
+    sentencia = re.sub(r'\s+', ' ', sentencia).strip()
+    sentencia = re.sub(r'\((\?, )+\?\)', '(?)', sentencia)  # listas IN (?, ?, ?)
+    return re.sub(r"'[^']*'|\b\d+\b", '?', sentencia)
+
+
+def _perfil_actual():
+    return g.get('_perfil_sql') if has_request_context() else None
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    if _perfil_actual() is not None:
+        conn.info.setdefault('_inicios_perfilado', []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    perfil = _perfil_actual()
+    inicios = conn.info.get('_inicios_perfilado')
+    if perfil is None or not inicios:
+        return
+    perfil['consultas'] += 1
+    perfil['tiempo_db'] += time.perf_counter() - inicios.pop()
+    perfil['huellas'][huella_sql(statement)] += 1
+
+
+def _iniciar_peticion():
+    g._perfil_sql = {'inicio': time.perf_counter(), 'consultas': 0, 'tiempo_db': 0.0, 'huellas': Counter()}
+
+
+def _cerrar_peticion(response):
+    perfil = g.pop('_perfil_sql', None)
+    if perfil is None:
+        return response
+
+    total = time.perf_counter() - perfil['inicio']
+    repetidas = [(h, n) for h, n in perfil['huellas'].most_common() if n >= UMBRAL_N_MAS_1]
+    metricas = [
+        f'db;dur={perfil["tiempo_db"] * 1000:.2f};desc="{perfil["consultas"]} consultas"',
+        f'total;dur={total * 1000:.2f}',
+    ]
+    if repetidas:
+        metricas.append(f'n1;desc="{len(repetidas)} sentencias repetidas, max {repetidas[0][1]}x"')
+    response.headers.add('Server-Timing', ', '.join(metricas))
+
+    _acumular(request.endpoint or request.path, perfil, total, repetidas)
+    return response
+
+
+def _acumular(endpoint, perfil, total, repetidas):
+    with _candado:
+        e = _estadisticas.setdefault(endpoint, {
+            'endpoint': endpoint, 'peticiones': 0, 'consultas': 0, 'max_consultas': 0,
+            'tiempo_db': 0.0, 'tiempo_total': 0.0, 'peticiones_n1': 0, 'peor_repetida': None,
+        })
+        e['peticiones'] += 1
+        e['consultas'] += perfil['consultas']
+        e['max_consultas'] = max(e['max_consultas'], perfil['consultas'])
+        e['tiempo_db'] += perfil['tiempo_db']
+        e['tiempo_total'] += total
+        if repetidas:
+            e['peticiones_n1'] += 1
+            huella, veces = repetidas[0]
+            if e['peor_repetida'] is None or veces > e['peor_repetida'][1]:
+                e['peor_repetida'] = (huella, veces)
+
+
+def resumen_endpoints(orden='tiempo_db', limite=20):
+    """Endpoints de este worker ordenados de peor a mejor, con promedios."""
+    with _candado:
+        filas = [dict(e) for e in _estadisticas.values()]
+    for fila in filas:
+        fila['consultas_promedio'] = fila['consultas'] / fila['peticiones']
+        fila['db_promedio_ms'] = fila['tiempo_db'] / fila['peticiones'] * 1000
+        fila['total_promedio_ms'] = fila['tiempo_total'] / fila['peticiones'] * 1000
+    return sorted(filas, key=lambda f: f[orden], reverse=True)[:limite]
+
+
+def reiniciar_estadisticas():
+    with _candado:
+        _estadisticas.clear()
+
+
+def configurar_perfilado(app):
+    """Activa el perfilado si PERFILAR_SQL está habilitado en la configuración."""
+    app.config.setdefault('PERFILAR_SQL', os.environ.get('PERFILAR_SQL', '0') == '1')
+    if not app.config['PERFILAR_SQL']:
+        return
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _antes_de_ejecutar)
+            event.listen(engine, 'after_cursor_execute', _despues_de_ejecutar)
+    app.before_request(_iniciar_peticion)
+    app.after_request(_cerrar_peticion)
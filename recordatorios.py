@@ -0,0 +1,275 @@
+"""
+Recordatorios de citas por WhatsApp.
+Un programador en proceso carga solo la ventana de próximos agendamientos
+confirmados (consulta sobre el índice estado + fecha_agendada) y mantiene los
+envíos pendientes en un heap ordenado por hora de envío. Antes de enviar
+vuelve a leer la fila, así que una cita editada o cancelada nunca recibe un
+recordatorio obsoleto. Los cambios hechos por cualquier proceso (la web, el
+webhook) se recogen en cada vuelta por Agendamiento.updated_at, con índice.
+Uso: flask --app app recordatorios ejecutar
+"""
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+
+from basedatos import normalizar_ciudad
+from messenger import enviar_mensaje_whatsapp, servidor_graph_falso
+from models import Agendamiento, Negocio, db
+
+# Reintentos de un envío fallido y espera entre ellos
+MAX_INTENTOS = 3
+ESPERA_REINTENTO = timedelta(minutes=5)
+# updated_at se toma al hacer flush y la transacción puede confirmarse después:
+# se vuelve a mirar este margen hacia atrás para no perder esos cambios
+MARGEN_CAMBIOS = timedelta(minutes=1)
+
+
+class RelojReal:
+    def ahora(self):
+        return datetime.now()
+
+    def dormir(self, segundos):
+        time.sleep(max(segundos, 0))
+
+
+class RelojFalso:
+    """Reloj manual para pruebas: dormir() solo avanza el tiempo."""
+
+    def __init__(self, inicio):
+        self.actual = inicio
+
+    def ahora(self):
+        return self.actual
+
+    def dormir(self, segundos):
+        self.actual += timedelta(seconds=max(segundos, 0))
+
+
+class ProgramadorRecordatorios:
+    """
+    Heap de (momento de envío, id de agendamiento, fecha agendada).
+    Las entradas obsoletas no se borran del heap: se descartan al salir si la
+    fila ya no coincide (borrado perezoso).
+    """
+
+    def __init__(self, enviar=enviar_mensaje_whatsapp, reloj=None, anticipacion=timedelta(hours=2),
+                 ventana=timedelta(hours=6), recarga=timedelta(minutes=5), por_minuto=30):
+        self.enviar = enviar
+        self.reloj = reloj or RelojReal()
+        self.anticipacion = anticipacion
+        self.ventana = ventana
+        self.recarga = recarga
+        self.intervalo_envio = 60 / por_minuto
+        self._heap = []
+        self._programados = {}  # id -> fecha_agendada en el heap
+        self._intentos = {}
+        self._descartados = {}  # id -> fecha_agendada que agotó los reintentos
+        self._proxima_recarga = None
+        self._cambios_desde = None  # mayor updated_at visto (hora de la base, no del reloj)
+        self._ultimo_envio = None
+        self.enviados = 0
+
+    def _programar(self, agendamiento, momento=None):
+        fecha = agendamiento.fecha_agendada
+        if momento is None and fecha in (self._programados.get(agendamiento.id), self._descartados.get(agendamiento.id)):
+            return
+        momento = momento or max(fecha - self.anticipacion, self.reloj.ahora())
+        self._programados[agendamiento.id] = fecha
+        heapq.heappush(self._heap, (momento, agendamiento.id, fecha))
+
+    def _vigente(self, agendamiento, fecha=None):
+        return (agendamiento is not None and agendamiento.estado == 'confirmado'
+                and agendamiento.recordatorio_enviado is None
+                and agendamiento.fecha_agendada is not None
+                and agendamiento.fecha_agendada > self.reloj.ahora()
+                and (fecha is None or agendamiento.fecha_agendada == fecha))
+
+    def cargar_ventana(self):
+        """Agrega al heap las citas confirmadas cuyo recordatorio cae en la ventana."""
+        ahora = self.reloj.ahora()
+        if self._cambios_desde is None:
+            self._cambios_desde = db.session.scalar(select(func.max(Agendamiento.updated_at))) or datetime.now()
+        proximos = Agendamiento.query.filter(
+            Agendamiento.estado == 'confirmado',
+            Agendamiento.fecha_agendada > ahora,
+            Agendamiento.fecha_agendada <= ahora + self.anticipacion + self.ventana,
+            Agendamiento.recordatorio_enviado.is_(None),
+        ).all()
+        for agendamiento in proximos:
+            self._programar(agendamiento)
+        self._proxima_recarga = ahora + self.recarga
+        return len(proximos)
+
+    def aplicar_cambios(self):
+        """Reprograma los agendamientos modificados desde la última vuelta, en cualquier proceso."""
+        if self._cambios_desde is None:
+            return
+        modificados = Agendamiento.query.filter(
+            Agendamiento.updated_at >= self._cambios_desde - MARGEN_CAMBIOS,
+        ).execution_options(populate_existing=True).all()
+        limite = self.reloj.ahora() + self.anticipacion + self.ventana
+        for agendamiento in modificados:
+            self._cambios_desde = max(self._cambios_desde, agendamiento.updated_at)
+            if self._vigente(agendamiento) and agendamiento.fecha_agendada <= limite:
+                self._programar(agendamiento)
+            elif agendamiento.id in self._programados and not self._vigente(agendamiento):
+                del self._programados[agendamiento.id]
+
+    def _mensaje(self, agendamiento):
+        negocio = db.session.get(Negocio, agendamiento.id_negocio)
+        return (
+            f'Hola {agendamiento.cliente_nombre}, te recordamos tu cita en '
+            f'{negocio.nombre if negocio else "el negocio"} el '
+            f'{agendamiento.fecha_agendada.strftime("%d/%m/%Y a las %H:%M")}.'
+        )
+
+    def ejecutar_pendientes(self):
+        """Envía los recordatorios vencidos respetando el límite por minuto."""
+        enviados = 0
+        while self._heap and self._heap[0][0] <= self.reloj.ahora():
+            _, agendamiento_id, fecha = heapq.heappop(self._heap)
+            if self._programados.get(agendamiento_id) != fecha:
+                continue  # entrada reemplazada por una reprogramación
+            agendamiento = db.session.get(Agendamiento, agendamiento_id, populate_existing=True)
+            if not self._vigente(agendamiento, fecha):
+                self._programados.pop(agendamiento_id, None)
+                continue
+
+            if self._ultimo_envio is not None:
+                espera = self.intervalo_envio - (self.reloj.ahora() - self._ultimo_envio).total_seconds()
+                if espera > 0:
+                    self.reloj.dormir(espera)
+            self._ultimo_envio = self.reloj.ahora()
+
+            if self.enviar(agendamiento.cliente_telefono, self._mensaje(agendamiento)):
+                agendamiento.recordatorio_enviado = self.reloj.ahora()
+                db.session.commit()
+                self._programados.pop(agendamiento_id, None)
+                self._intentos.pop(agendamiento_id, None)
+                enviados += 1
+            else:
+                intentos = self._intentos.get(agendamiento_id, 0) + 1
+                self._intentos[agendamiento_id] = intentos
+                if intentos < MAX_INTENTOS:
+                    self._programar(agendamiento, self.reloj.ahora() + ESPERA_REINTENTO)
+                else:
+                    # No se reintenta más salvo que la cita cambie de fecha
+                    self._programados.pop(agendamiento_id, None)
+                    self._intentos.pop(agendamiento_id, None)
+                    self._descartados[agendamiento_id] = fecha
+        self.enviados += enviados
+        return enviados
+
+    def ciclo(self):
+        """Una vuelta del bucle; devuelve los segundos hasta la siguiente tarea."""
+        if self._proxima_recarga is None or self.reloj.ahora() >= self._proxima_recarga:
+            self.cargar_ventana()
+        self.aplicar_cambios()
+        self.ejecutar_pendientes()
+        siguiente = self._proxima_recarga
+        if self._heap:
+            siguiente = min(siguiente, self._heap[0][0])
+        return max((siguiente - self.reloj.ahora()).total_seconds(), 0)
+
+    def ejecutar(self, app, hasta=None, espera_maxima=5.0):
+        """
+        Bucle principal. `hasta` detiene el bucle en ese momento del reloj
+        (útil con RelojFalso); la espera se corta cada `espera_maxima` segundos
+        para recoger los cambios hechos desde la web.
+        """
+        while hasta is None or self.reloj.ahora() < hasta:
+            with app.app_context():
+                espera = self.ciclo()
+            if hasta is not None:
+                espera = min(espera, (hasta - self.reloj.ahora()).total_seconds())
+            self.reloj.dormir(min(espera, espera_maxima))
+
+
+def programador_desde_entorno(**opciones):
+    """
+    Variables: RECORDATORIOS_ANTICIPACION_MIN (120), RECORDATORIOS_VENTANA_MIN
+    (360), RECORDATORIOS_RECARGA_MIN (5) y RECORDATORIOS_POR_MINUTO (30).
+    """
+    minutos = lambda nombre, defecto: timedelta(minutes=float(os.environ.get(nombre, defecto)))
+    return ProgramadorRecordatorios(
+        anticipacion=minutos('RECORDATORIOS_ANTICIPACION_MIN', 120),
+        ventana=minutos('RECORDATORIOS_VENTANA_MIN', 360),
+        recarga=minutos('RECORDATORIOS_RECARGA_MIN', 5),
+        por_minuto=float(os.environ.get('RECORDATORIOS_POR_MINUTO', 30)),
+        **opciones,
+    )
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+recordatorios_cli = AppGroup('recordatorios', help='Recordatorios de citas por WhatsApp.')
+
+
+@recordatorios_cli.command('ejecutar')
+@click.option('--ciudad', default=None, help='Partición por ciudad a atender (un proceso por ciudad).')
+def ejecutar_command(ciudad):
+    """Ejecuta el programador (un solo proceso, fuera de gunicorn)."""
+    from flask import current_app
+    app = current_app._get_current_object()
+    if ciudad:
+        app.config['CIUDAD'] = normalizar_ciudad(ciudad)
+    click.echo('Programador de recordatorios en ejecución (Ctrl+C para salir)')
+    programador_desde_entorno().ejecutar(app)
+
+
+@recordatorios_cli.command('simular')
+@click.option('--citas', default=50, show_default=True, help='Citas confirmadas a simular.')
+def simular_command(citas):
+    """
+    Ejecuta el programador sobre una base temporal con reloj falso y una
+    Graph API falsa local; edita y cancela citas a mitad de la simulación.
+    """
+    import tempfile
+    from app import create_app
+
+    servidor = servidor_graph_falso()
+    enviar = partial(enviar_mensaje_whatsapp, url_base=servidor.url)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directorio, "recordatorios.db")}',
+            'SEPARAR_LECTURAS': False,
+        })
+        inicio = datetime(2030, 1, 7, 8, 0)
+        reloj = RelojFalso(inicio)
+        programador = ProgramadorRecordatorios(enviar=enviar, reloj=reloj, por_minuto=60)
+        with app.app_context():
+            db.create_all(bind_key=None)
+            negocio = Negocio(nombre='Negocio de prueba', descripcion_corta='Simulación')
+            db.session.add(negocio)
+            db.session.flush()
+            for i in range(citas):
+                db.session.add(Agendamiento(
+                    cliente_nombre=f'Cliente {i}', cliente_telefono=f'57300{i:07d}', id_negocio=negocio.id,
+                    fecha_agendada=inicio + timedelta(minutes=30 * (i + 1)), estado='confirmado',
+                ))
+            db.session.commit()
+
+        programador.ejecutar(app, hasta=inicio + timedelta(hours=3))
+        with app.app_context():
+            # Una cita se cancela y otra se mueve una semana después de enviado el lote inicial
+            pendientes = Agendamiento.query.filter(Agendamiento.recordatorio_enviado.is_(None)).order_by(Agendamiento.fecha_agendada).all()
+            pendientes[0].estado = 'cancelado'
+            pendientes[1].fecha_agendada += timedelta(days=7)
+            db.session.commit()
+        programador.ejecutar(app, hasta=inicio + timedelta(hours=citas // 2 + 2))
+        with app.app_context():
+            sin_recordatorio = Agendamiento.query.filter(Agendamiento.recordatorio_enviado.is_(None)).count()
+    servidor.shutdown()
+
+    click.echo(f'Recordatorios enviados: {programador.enviados} (Graph falsa recibió {len(servidor.recibidos)})')
+    click.echo(f'Citas sin recordatorio: {sin_recordatorio} (1 cancelada, 1 movida fuera de la ventana)')
+    click.echo(f'Tiempo simulado: {reloj.ahora() - inicio}')
@@ -0,0 +1,238 @@
+"""
+Sincronización declarativa de la taxonomía de categorías.
+La jerarquía se define en taxonomia.json y se aplica a la base de datos con
+un diff en memoria: una sola lectura del árbol actual y escrituras masivas
+(INSERT/UPDATE por lotes) dentro de una única transacción.
+"""
+import json
+import os
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, select, update
+
+from menus import regenerar_menus
+from models import db, Categoria, Subcategoria, User, reconstruir_rutas
+
+ARCHIVO_TAXONOMIA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'taxonomia.json')
+
+# Campos opcionales que solo se sincronizan si aparecen en el archivo
+OPCIONALES_CATEGORIA = ('icono', 'descripcion')
+OPCIONALES_SUBCATEGORIA = ('icono', 'descripcion', 'keywords')
+
+
+def cargar_taxonomia(archivo=ARCHIVO_TAXONOMIA):
+    with open(archivo, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class PlanSincronizacion:
+    """Cambios calculados entre la definición y el estado actual de la base."""
+
+    def __init__(self):
+        self.categorias_nuevas = []
+        self.subcategorias_nuevas = []
+        self.cambios_categorias = []
+        self.cambios_subcategorias = []
+        self.ids_categorias = {}     # clave -> id de las categorías existentes
+        self.ids_subcategorias = {}  # clave -> id de las subcategorías existentes
+        self.sin_definir = []
+        self.detalle = []
+
+    @property
+    def vacio(self):
+        return not (self.categorias_nuevas or self.subcategorias_nuevas
+                    or self.cambios_categorias or self.cambios_subcategorias)
+
+    def resumen(self):
+        """Reporte legible del plan (lo que imprime --dry-run)."""
+        lineas = list(self.detalle)
+        lineas += [f'? {tipo} sin definir en el archivo: {nombre} (#{id_})' for tipo, id_, nombre in self.sin_definir]
+        lineas.append(
+            f'Total: {len(self.categorias_nuevas)} categorías nuevas, '
+            f'{len(self.subcategorias_nuevas)} subcategorías nuevas, '
+            f'{len(self.cambios_categorias) + len(self.cambios_subcategorias)} actualizaciones'
+        )
+        return lineas
+
+
+def _diferencias(fila, deseado):
+    return {campo: valor for campo, valor in deseado.items() if getattr(fila, campo) != valor}
+
+
+def _describir_cambios(etiqueta, fila, cambios):
+    partes = []
+    for campo, valor in cambios.items():
+        if campo == 'clave':
+            partes.append(f'adopta clave {valor!r}')
+        elif campo == 'nombre':
+            partes.append(f'renombrar {fila.nombre!r} -> {valor!r}')
+        elif campo == 'orden':
+            partes.append(f'orden {fila.orden} -> {valor}')
+        else:
+            partes.append(f'{campo} -> {valor!r}')
+    return f'~ {etiqueta} #{fila.id}: ' + ', '.join(partes)
+
+
+def planificar_sincronizacion(definicion):
+    """
+    Compara la definición con el árbol actual cargado en dos consultas.
+    Las filas existentes se identifican por `clave`; las que aún no la tienen
+    se adoptan por nombre (categoría + tipo, o categoría padre + nombre).
+    """
+    plan = PlanSincronizacion()
+    admin = User.query.filter_by(username='admin').first()
+    creador = admin.id if admin else None
+
+    categorias = db.session.execute(select(
+        Categoria.id, Categoria.clave, Categoria.nombre, Categoria.tipo, Categoria.orden,
+        Categoria.nivel, Categoria.icono, Categoria.descripcion
+    )).all()
+    subcategorias = db.session.execute(select(
+        Subcategoria.id, Subcategoria.clave, Subcategoria.nombre, Subcategoria.categoria_id,
+        Subcategoria.parent_id, Subcategoria.nivel, Subcategoria.icono, Subcategoria.descripcion,
+        Subcategoria.keywords
+    )).all()
+
+    cat_por_clave = {c.clave: c for c in categorias if c.clave}
+    cat_por_nombre = {}
+    for c in categorias:
+        if not c.clave:
+            cat_por_nombre.setdefault((c.nombre.lower(), c.tipo), c)
+            cat_por_nombre.setdefault((c.nombre.lower(), None), c)
+    sub_por_clave = {s.clave: s for s in subcategorias if s.clave}
+    sub_por_nombre = {(s.categoria_id, s.nombre.lower()): s for s in subcategorias if not s.clave}
+    vistas_cat, vistas_sub = set(), set()
+
+    def planificar_subcategorias(lista, clave_categoria, categoria_id, clave_padre, profundidad):
+        for definicion_sub in lista:
+            clave = definicion_sub['clave']
+            deseado = {'nombre': definicion_sub['nombre'], 'nivel': 2 + profundidad}
+            deseado.update({k: definicion_sub[k] for k in OPCIONALES_SUBCATEGORIA if k in definicion_sub})
+
+            fila = sub_por_clave.get(clave)
+            if fila is None and categoria_id is not None:
+                fila = sub_por_nombre.pop((categoria_id, definicion_sub['nombre'].lower()), None)
+
+            if fila is None:
+                plan.subcategorias_nuevas.append({
+                    **deseado, 'clave': clave, 'created_by': creador,
+                    '_categoria': clave_categoria, '_padre': clave_padre, '_profundidad': profundidad
+                })
+                plan.detalle.append(f'+ subcategoría {deseado["nombre"]!r} en {clave_categoria!r}')
+            else:
+                vistas_sub.add(fila.id)
+                plan.ids_subcategorias[clave] = fila.id
+                cambios = _diferencias(fila, {**deseado, 'clave': clave})
+                if cambios:
+                    plan.cambios_subcategorias.append({'id': fila.id, **cambios})
+                    plan.detalle.append(_describir_cambios('subcategoría', fila, cambios))
+
+            planificar_subcategorias(
+                definicion_sub.get('subcategorias', []), clave_categoria,
+                categoria_id, clave, profundidad + 1
+            )
+
+    for orden, definicion_cat in enumerate(definicion['categorias'], start=1):
+        clave = definicion_cat['clave']
+        deseado = {'nombre': definicion_cat['nombre'], 'tipo': definicion_cat['tipo'], 'orden': orden, 'nivel': 1}
+        deseado.update({k: definicion_cat[k] for k in OPCIONALES_CATEGORIA if k in definicion_cat})
+
+        fila = cat_por_clave.get(clave)
+        if fila is None:
+            nombre = definicion_cat['nombre'].lower()
+            fila = cat_por_nombre.get((nombre, definicion_cat['tipo'])) or cat_por_nombre.get((nombre, None))
+            if fila is not None and fila.id in vistas_cat:
+                fila = None
+
+        if fila is None:
+            plan.categorias_nuevas.append({**deseado, 'clave': clave, 'created_by': creador})
+            plan.detalle.append(f'+ categoría {deseado["nombre"]!r} ({deseado["tipo"]})')
+            categoria_id = None
+        else:
+            vistas_cat.add(fila.id)
+            plan.ids_categorias[clave] = fila.id
+            categoria_id = fila.id
+            cambios = _diferencias(fila, {**deseado, 'clave': clave})
+            if cambios:
+                plan.cambios_categorias.append({'id': fila.id, **cambios})
+                plan.detalle.append(_describir_cambios('categoría', fila, cambios))
+
+        planificar_subcategorias(definicion_cat.get('subcategorias', []), clave, categoria_id, None, 0)
+
+    plan.sin_definir = (
+        [('categoría', c.id, c.nombre) for c in categorias if c.id not in vistas_cat]
+        + [('subcategoría', s.id, s.nombre) for s in subcategorias if s.id not in vistas_sub]
+    )
+    return plan
+
+
+def aplicar_plan(plan):
+    """Aplica el plan con INSERT/UPDATE masivos en una sola transacción."""
+    ids_categorias = dict(plan.ids_categorias)
+    ids_subcategorias = dict(plan.ids_subcategorias)
+    try:
+        if plan.categorias_nuevas:
+            filas = db.session.execute(
+                insert(Categoria).returning(Categoria.id, Categoria.clave),
+                plan.categorias_nuevas
+            )
+            ids_categorias.update({f.clave: f.id for f in filas})
+
+        # Las subcategorías se insertan por niveles para resolver el parent_id
+        profundidades = sorted({s['_profundidad'] for s in plan.subcategorias_nuevas})
+        for profundidad in profundidades:
+            lote = [
+                {
+                    **{k: v for k, v in s.items() if not k.startswith('_')},
+                    'categoria_id': ids_categorias[s['_categoria']],
+                    'parent_id': ids_subcategorias.get(s['_padre']),
+                }
+                for s in plan.subcategorias_nuevas if s['_profundidad'] == profundidad
+            ]
+            filas = db.session.execute(
+                insert(Subcategoria).returning(Subcategoria.id, Subcategoria.clave),
+                lote
+            )
+            ids_subcategorias.update({f.clave: f.id for f in filas})
+
+        if plan.cambios_categorias:
+            db.session.execute(update(Categoria), plan.cambios_categorias)
+        if plan.cambios_subcategorias:
+            db.session.execute(update(Subcategoria), plan.cambios_subcategorias)
+
+        # Las escrituras masivas no disparan los eventos de rutas; se recalculan
+        # aquí y reconstruir_rutas() confirma toda la transacción; los menús de
+        # WhatsApp tampoco se enteran, así que se regeneran completos.
+        reconstruir_rutas()
+        regenerar_menus()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def sincronizar_taxonomia(archivo=ARCHIVO_TAXONOMIA, dry_run=False):
+    """Planifica y (salvo dry_run) aplica la taxonomía del archivo. Devuelve el plan."""
+    plan = planificar_sincronizacion(cargar_taxonomia(archivo))
+    if not dry_run and not plan.vacio:
+        aplicar_plan(plan)
+    return plan
+
+
+# ============================================
+# COMANDOS CLI
+# ============================================
+
+taxonomia_cli = AppGroup('taxonomia', help='Gestión de la taxonomía de categorías.')
+
+
+@taxonomia_cli.command('sync')
+@click.option('--dry-run', is_flag=True, help='Solo muestra los cambios, sin aplicarlos.')
+@click.option('--archivo', default=ARCHIVO_TAXONOMIA, show_default=True, type=click.Path(exists=True))
+def sync_command(dry_run, archivo):
+    """Sincroniza la base de datos con taxonomia.json."""
+    plan = sincronizar_taxonomia(archivo, dry_run=dry_run)
+    for linea in plan.resumen():
+        click.echo(linea)
+    if dry_run:
+        click.echo('(dry-run: no se aplicó ningún cambio)')
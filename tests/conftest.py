@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Archivos auxiliares de la app fuera de instance/ (se leen al importar app.py)
+_temporal = tempfile.mkdtemp(prefix='pruebas_')
+for _variable, _nombre in (('METRICAS_DIR', 'metricas'), ('IDENTIDAD_GENERACION', 'identidades.gen'),
+                           ('LOGIN_LIMITADOR_DB', 'limitador.db'), ('MEDIOS_DIR', 'medios')):
+    os.environ.setdefault(_variable, os.path.join(_temporal, _nombre))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App sobre una base SQLite temporal con el esquema principal creado."""
+    from app import create_app
+    from models import db
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "pruebas.db"}',
+        'SEPARAR_LECTURAS': False,
+        'TESTING': True,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+    return app
@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, time, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import Agendamiento, Negocio, db
+
+# Próximo lunes a las 10:00, dentro del horario de atención
+_hoy = datetime.now().date()
+TURNO = datetime.combine(_hoy + timedelta(days=7 - _hoy.weekday()), time(10, 0))
+
+
+@pytest.fixture
+def negocio(app):
+    with app.app_context():
+        negocio = Negocio(nombre='Peluquería', descripcion_corta='Cortes',
+                          horarios=json.dumps({'lunes_viernes': '8:00-18:00'}))
+        db.session.add(negocio)
+        db.session.commit()
+        return negocio.id
+
+
+def _agendar(app, negocio, fecha):
+    return app.test_client().post('/api/agendar', json={
+        'negocio_id': negocio, 'nombre': 'Ana', 'telefono': '573001112233', 'fecha': fecha.isoformat(),
+    })
+
+
+def test_reserva_un_turno_libre(app, negocio):
+    respuesta = _agendar(app, negocio, TURNO)
+    assert respuesta.status_code == 201
+    assert respuesta.get_json()['fecha_agendada'] == TURNO.isoformat()
+    with app.app_context():
+        cita = db.session.get(Agendamiento, respuesta.get_json()['id'])
+        assert (cita.id_negocio, cita.estado) == (negocio, 'pendiente')
+
+
+def test_turno_ocupado_responde_409(app, negocio):
+    assert _agendar(app, negocio, TURNO).status_code == 201
+    respuesta = _agendar(app, negocio, TURNO)
+    assert respuesta.status_code == 409
+    with app.app_context():
+        assert Agendamiento.query.count() == 1
+
+
+def test_fecha_fuera_de_la_grilla_responde_400(app, negocio):
+    respuesta = _agendar(app, negocio, TURNO + timedelta(minutes=15))
+    assert respuesta.status_code == 400
+    with app.app_context():
+        assert Agendamiento.query.count() == 0
+
+
+def test_indice_unico_rechaza_la_reserva_doble(app, negocio):
+    """La base excluye las reservas simultáneas aunque ambas pasen la verificación previa."""
+    def cita(estado):
+        return Agendamiento(cliente_nombre='Ana', cliente_telefono='573001112233', id_negocio=negocio,
+                            fecha_agendada=TURNO, estado=estado)
+
+    with app.app_context():
+        db.session.add_all([cita('cancelado'), cita('pendiente')])
+        db.session.commit()
+        db.session.add(cita('confirmado'))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+        assert Agendamiento.query.count() == 2
@@ -0,0 +1,18 @@
+from types import SimpleNamespace
+
+import pytest
+
+from basedatos import insert_con_conflicto
+from models import MensajeEntrante, db
+
+
+def test_insert_con_conflicto_del_dialecto(app):
+    with app.app_context():
+        sentencia = insert_con_conflicto(MensajeEntrante, db.engine)
+    assert hasattr(sentencia, 'on_conflict_do_nothing')
+
+
+def test_dialecto_sin_on_conflict_falla_con_un_mensaje_claro():
+    motor = SimpleNamespace(dialect=SimpleNamespace(name='mssql'))
+    with pytest.raises(NotImplementedError, match='mssql'):
+        insert_con_conflicto(MensajeEntrante, motor)
@@ -0,0 +1,53 @@
+import pytest
+
+from catalogo import MAX_LIMIT, TOTAL_MAXIMO, buscar_catalogo, preparar_catalogo
+from models import Producto, Servicio, db
+
+
+@pytest.fixture
+def catalogo(app):
+    """Tres productos y dos servicios con el mismo texto; dentro de cada tipo decide `vendidos`."""
+    with app.app_context():
+        preparar_catalogo()
+        for vendidos in (30, 20, 10):
+            db.session.add(Producto(nombre='Café de origen', descripcion='Tostado medio', precio=20,
+                                    vendidos=vendidos))
+        for vendidos in (5, 1):
+            db.session.add(Servicio(nombre='Café de origen', descripcion='Tostado medio', precio=20,
+                                    vendidos=vendidos))
+        db.session.commit()
+    return app
+
+
+def _buscar(app, **parametros):
+    return app.test_client().get('/api/catalogo/buscar', query_string=parametros).get_json()
+
+
+def test_relevancia_intercala_productos_y_servicios(catalogo):
+    datos = _buscar(catalogo, q='cafe')
+    orden = [(r['tipo'], r['vendidos']) for r in datos['resultados']]
+    assert orden == [('producto', 30), ('servicio', 5), ('producto', 20), ('servicio', 1), ('producto', 10)]
+    assert (datos['total'], datos['total_exacto']) == (5, True)
+
+    datos = _buscar(catalogo, q='cafe', limit=2, offset=1)
+    assert [(r['tipo'], r['vendidos']) for r in datos['resultados']] == [('servicio', 5), ('producto', 20)]
+
+
+def test_limit_se_acota(catalogo):
+    assert _buscar(catalogo, q='cafe', limit=500)['limit'] == MAX_LIMIT
+    with catalogo.app_context():
+        resultados, _ = buscar_catalogo('cafe', limit=0, offset=-3)
+    assert [(r['tipo'], r['vendidos']) for r in resultados] == [('producto', 30)]
+
+
+def test_total_se_corta_en_el_maximo(catalogo):
+    with catalogo.app_context():
+        db.session.execute(db.insert(Producto), [
+            {'nombre': f'Café molido {i}', 'descripcion': 'Bolsa', 'precio': 10} for i in range(TOTAL_MAXIMO)
+        ])
+        db.session.commit()
+
+    datos = _buscar(catalogo, q='cafe', limit=3)
+    assert (datos['total'], datos['total_exacto']) == (TOTAL_MAXIMO, False)
+    assert len(datos['resultados']) == 3
+    assert _buscar(catalogo, q='cafe', tipo='servicio')['total'] == 2
@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine, select
+
+import difusion
+from difusion import crear_campana, ejecutar_campana
+from models import Campana, CampanaDestinatario, Negocio, db
+
+
+class EnvioFalso:
+    def __init__(self):
+        self.enviados = []
+
+    def __call__(self, telefono, mensaje):
+        self.enviados.append((telefono, mensaje))
+        return 200, 'wamid.prueba'
+
+
+@pytest.fixture
+def negocios(app):
+    """Un dueño con dos negocios en ciudades distintas y otro con uno solo."""
+    with app.app_context():
+        db.session.add_all([
+            Negocio(nombre='Zapatería Centro', descripcion_corta='-', ubicacion='Bogotá', whatsapp_contacto='573001'),
+            Negocio(nombre='Almacén Norte', descripcion_corta='-', ubicacion='Tunja', whatsapp_contacto='573001'),
+            Negocio(nombre='Café Sur', descripcion_corta='-', ubicacion='Cali', telefono_contacto='573002'),
+        ])
+        db.session.commit()
+
+
+def test_un_destinatario_por_telefono_con_datos_de_un_mismo_negocio(app, negocios):
+    with app.app_context():
+        campana = crear_campana('Aviso', 'Hola {nombre} de {ubicacion}', 'duenos_negocios_activos')
+        destinatarios = {
+            d.telefono: (d.nombre, d.ubicacion)
+            for d in CampanaDestinatario.query.filter_by(campana_id=campana.id)
+        }
+    assert destinatarios == {'573001': ('Zapatería Centro', 'Bogotá'), '573002': ('Café Sur', 'Cali')}
+
+
+def test_envia_la_plantilla_a_cada_destinatario(app, negocios):
+    envio = EnvioFalso()
+    with app.app_context():
+        campana = crear_campana('Aviso', 'Hola {nombre} de {ubicacion}', 'duenos_negocios_activos')
+        resumen = ejecutar_campana(campana.id, enviar=envio, hilos=2, por_segundo=1000)
+    assert resumen == {'enviado': 2}
+    assert sorted(envio.enviados) == [('573001', 'Hola Zapatería Centro de Bogotá'), ('573002', 'Hola Café Sur de Cali')]
+
+
+def test_un_lote_lento_renueva_el_latido_antes_de_terminar(app, negocios, monkeypatch):
+    monkeypatch.setattr(difusion, 'INTERVALO_LATIDO', timedelta(milliseconds=50))
+    otro = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    latidos = []
+
+    def envio_lento(telefono, mensaje):
+        time.sleep(0.2)
+        # Lo que vería otro proceso que intenta reanudar la campaña
+        with otro.connect() as conn:
+            latidos.append(conn.scalar(select(Campana.latido)))
+        return 200, 'wamid.prueba'
+
+    with app.app_context():
+        campana = crear_campana('Aviso', 'Hola {nombre}', 'duenos_negocios_activos')
+        ejecutar_campana(campana.id, enviar=envio_lento, hilos=1, por_segundo=1000)
+    otro.dispose()
+
+    # Ambos envíos son del mismo lote: el segundo ya ve un latido renovado
+    assert len(latidos) == 2 and latidos[1] > latidos[0]
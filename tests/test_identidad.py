@@ -0,0 +1,50 @@
+import pytest
+
+from identidad import CacheIdentidades, cache_identidades
+from models import User, db
+
+
+@pytest.fixture
+def admins(app):
+    """Dos administradores; la caché empieza vacía (los ids se repiten entre bases de prueba)."""
+    cache_identidades.invalidar_todo()
+    with app.app_context():
+        usuarios = [User(username=nombre, password_hash='x', role='admin') for nombre in ('ana', 'beto')]
+        db.session.add_all(usuarios)
+        db.session.commit()
+        return [u.id for u in usuarios]
+
+
+def _cliente(app, user_id):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['_user_id'] = str(user_id)
+        sesion['_fresh'] = True
+    return cliente
+
+
+def test_la_peticion_siguiente_ve_el_rol_degradado(app, admins):
+    ana, beto = admins
+    cliente = _cliente(app, ana)
+    assert cliente.get('/admin/usuarios').status_code == 200
+    assert cache_identidades.obtener(ana) is not None  # La identidad de Ana quedó en caché
+
+    respuesta = _cliente(app, beto).post(f'/admin/usuario/{ana}/cambiar_rol', data={'role': 'usuario'})
+    assert respuesta.status_code == 302
+
+    respuesta = cliente.get('/admin/usuarios')
+    assert respuesta.status_code == 302
+    assert respuesta.headers['Location'].endswith('/dashboard')
+
+
+def test_otro_worker_descarta_la_identidad_desactivada(app, admins):
+    ana, _ = admins
+    otro_worker = CacheIdentidades(archivo_generacion=cache_identidades.archivo_generacion)
+    with app.app_context():
+        usuario = db.session.get(User, ana)
+        otro_worker.guardar(ana, {'id': ana, 'role': usuario.role, 'is_active': True})
+
+        usuario.is_active = False
+        db.session.commit()
+
+    assert otro_worker.obtener(ana) is None
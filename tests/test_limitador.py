@@ -0,0 +1,48 @@
+import pytest
+
+from app import create_app
+from models import db
+
+
+def _intentar(cliente, usuario, **opciones):
+    return cliente.post('/login', data={'username': usuario, 'password': 'incorrecta'}, **opciones)
+
+
+def test_usuario_bloqueado_responde_429_con_retry_after(app):
+    cliente = app.test_client()
+    # Dirección propia: el archivo del limitador se comparte entre pruebas
+    direccion = {'environ_base': {'REMOTE_ADDR': '198.51.100.7'}}
+    for _ in range(5):
+        assert _intentar(cliente, 'victima', **direccion).status_code == 200
+
+    respuesta = _intentar(cliente, 'victima', **direccion)
+    assert respuesta.status_code == 429
+    assert int(respuesta.headers['Retry-After']) == 60
+
+
+@pytest.fixture
+def app_tras_proxy(tmp_path):
+    """Como el fixture `app`, detrás de un proxy inverso de confianza."""
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "pruebas.db"}',
+        'SEPARAR_LECTURAS': False,
+        'TESTING': True,
+        'PROXY_SALTOS': 1,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+    return app
+
+
+def test_tras_el_proxy_cada_cliente_tiene_su_cubeta(app_tras_proxy):
+    cliente = app_tras_proxy.test_client()
+    proxy = {'REMOTE_ADDR': '10.0.0.1'}
+
+    # Usuarios distintos: solo se agota la cubeta de la IP del atacante
+    for i in range(20):
+        _intentar(cliente, f'usuario{i}', environ_base=proxy, headers={'X-Forwarded-For': '203.0.113.5'})
+    respuesta = _intentar(cliente, 'otro', environ_base=proxy, headers={'X-Forwarded-For': '203.0.113.5'})
+    assert respuesta.status_code == 429
+
+    respuesta = _intentar(cliente, 'otro', environ_base=proxy, headers={'X-Forwarded-For': '203.0.113.9'})
+    assert respuesta.status_code == 200
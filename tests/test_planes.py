@@ -0,0 +1,42 @@
+import pytest
+
+from funciones import ORDENES_BUSQUEDA, condiciones_busqueda, consulta_busqueda
+from models import Categoria, Negocio, Subcategoria, db
+
+
+@pytest.fixture
+def negocios(app):
+    """Negocios con valores variados en cada columna de orden, activos e inactivos."""
+    with app.app_context():
+        categoria = Categoria(nombre='Hogar', tipo='servicio', nivel=1)
+        db.session.add(categoria)
+        db.session.flush()
+        subcategoria = Subcategoria(nombre='Plomería', categoria_id=categoria.id)
+        db.session.add(subcategoria)
+        db.session.flush()
+        for i in range(40):
+            db.session.add(Negocio(
+                nombre=f'Negocio {i}', descripcion_corta='Reparaciones', activo=i % 5 != 0,
+                subcategoria_id=subcategoria.id if i % 2 else None, destacado=i % 7 == 0,
+                calificacion_promedio=i % 5, total_resenas=i, total_agendamientos=i * 3 % 11,
+                precio_estimado=None if i % 4 == 0 else 10 + i,
+            ))
+        db.session.commit()
+        return subcategoria.id
+
+
+def _plan(condiciones, orden):
+    """EXPLAIN QUERY PLAN de la sentencia que ejecuta _buscar_en_particion."""
+    sentencia = consulta_busqueda(condiciones, orden, 10).statement
+    conexion = db.session.connection(bind_arguments={'mapper': db.inspect(Negocio)})
+    sql = sentencia.compile(conexion, compile_kwargs={'literal_binds': True})
+    return [fila[-1] for fila in conexion.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+@pytest.mark.parametrize('orden', ORDENES_BUSQUEDA)
+@pytest.mark.parametrize('query, filtrar_especialidad', [('', False), ('plom', False), ('', True)])
+def test_orden_sin_ordenar_en_memoria(app, negocios, orden, query, filtrar_especialidad):
+    with app.app_context():
+        condiciones = condiciones_busqueda(query, negocios if filtrar_especialidad else None)
+        plan = _plan(condiciones, orden)
+    assert not any('USE TEMP B-TREE' in paso for paso in plan), plan
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+from models import Agendamiento, Negocio, db
+from recordatorios import MAX_INTENTOS, ProgramadorRecordatorios, RelojFalso
+
+INICIO = datetime(2030, 1, 7, 8, 0)
+
+
+class EnvioFalso:
+    """Registra los envíos; responde con `respuesta` (None = fallo)."""
+
+    def __init__(self, respuesta=200):
+        self.respuesta = respuesta
+        self.enviados = []
+
+    def __call__(self, telefono, mensaje):
+        self.enviados.append((telefono, mensaje))
+        return self.respuesta
+
+
+@pytest.fixture
+def citas(app):
+    """Cuatro citas confirmadas: a la 1 h, 3 h, 5 h y 30 h del inicio."""
+    with app.app_context():
+        negocio = Negocio(nombre='Barbería', descripcion_corta='Cortes')
+        db.session.add(negocio)
+        db.session.flush()
+        ids = []
+        for i, horas in enumerate((1, 3, 5, 30)):
+            cita = Agendamiento(
+                cliente_nombre=f'Cliente {i}', cliente_telefono=f'57300000000{i}', id_negocio=negocio.id,
+                fecha_agendada=INICIO + timedelta(hours=horas), estado='confirmado',
+            )
+            db.session.add(cita)
+            db.session.flush()
+            ids.append(cita.id)
+        db.session.commit()
+    return ids
+
+
+def _enviados_a(app):
+    with app.app_context():
+        return {
+            a.id: a.recordatorio_enviado
+            for a in Agendamiento.query.filter(Agendamiento.recordatorio_enviado.isnot(None))
+        }
+
+
+def test_envia_con_anticipacion_segun_el_reloj(app, citas):
+    reloj = RelojFalso(INICIO)
+    envio = EnvioFalso()
+    programador = ProgramadorRecordatorios(enviar=envio, reloj=reloj, por_minuto=60)
+
+    programador.ejecutar(app, hasta=INICIO + timedelta(hours=4))
+
+    enviados = _enviados_a(app)
+    # La cita de la 1 h ya está dentro de las 2 h de anticipación: sale al inicio
+    assert enviados[citas[0]] == INICIO
+    assert enviados[citas[1]] == INICIO + timedelta(hours=1)
+    assert enviados[citas[2]] == INICIO + timedelta(hours=3)
+    assert citas[3] not in enviados
+    assert programador.enviados == len(envio.enviados) == 3
+
+
+def test_recoge_cambios_hechos_en_otro_proceso(app, citas):
+    reloj = RelojFalso(INICIO)
+    envio = EnvioFalso()
+    programador = ProgramadorRecordatorios(enviar=envio, reloj=reloj, por_minuto=60)
+    programador.ejecutar(app, hasta=INICIO + timedelta(minutes=10))
+    assert programador.enviados == 1
+
+    # Otro proceso (un worker web) cancela una cita y mueve otra con su propio motor
+    tabla = Agendamiento.__table__
+    otro = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    with otro.begin() as conn:
+        conn.execute(tabla.update().where(tabla.c.id == citas[1]).values(estado='cancelado'))
+        conn.execute(tabla.update().where(tabla.c.id == citas[2]).values(
+            fecha_agendada=INICIO + timedelta(days=7)))
+        conn.execute(tabla.update().where(tabla.c.id == citas[3]).values(
+            fecha_agendada=INICIO + timedelta(hours=2)))
+    otro.dispose()
+
+    programador.ejecutar(app, hasta=INICIO + timedelta(hours=6))
+
+    enviados = _enviados_a(app)
+    assert set(enviados) == {citas[0], citas[3]}
+    # La cita adelantada se envía en la vuelta siguiente, sin esperar la recarga de la ventana
+    assert enviados[citas[3]] < INICIO + timedelta(minutes=20)
+
+
+def test_reintenta_un_envio_fallido_hasta_el_maximo(app, citas):
+    reloj = RelojFalso(INICIO)
+    envio = EnvioFalso(respuesta=None)
+    programador = ProgramadorRecordatorios(enviar=envio, reloj=reloj, por_minuto=60)
+
+    programador.ejecutar(app, hasta=INICIO + timedelta(minutes=50))
+
+    intentos = [telefono for telefono, _ in envio.enviados if telefono.endswith('0')]
+    assert len(intentos) == MAX_INTENTOS
+    assert _enviados_a(app) == {}
@@ -0,0 +1,18 @@
+def _endpoint(app, ruta, metodo='GET'):
+    return app.url_map.bind('localhost').match(ruta, method=metodo)[0]
+
+
+def test_api_de_subcategorias_es_la_del_chatbot(app):
+    assert _endpoint(app, '/api/subcategorias/1') == 'api.get_subcategorias'
+    assert _endpoint(app, '/admin/subcategorias/1') == 'web.get_subcategorias'
+
+
+def test_subcategorias_del_chatbot_sin_sesion(app):
+    respuesta = app.test_client().get('/api/subcategorias/1')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json() == []
+
+
+def test_subcategorias_del_formulario_piden_sesion(app):
+    respuesta = app.test_client().get('/admin/subcategorias/1')
+    assert respuesta.status_code == 302
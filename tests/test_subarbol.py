@@ -0,0 +1,48 @@
+import pytest
+
+from models import Categoria, Negocio, Producto, User, db
+
+
+@pytest.fixture
+def categoria(app):
+    """Categoría con ruta y tres negocios activos en su subárbol."""
+    with app.app_context():
+        raiz = Categoria(nombre='Belleza', tipo='servicio', nivel=1)
+        db.session.add(raiz)
+        db.session.flush()
+        for i in range(3):
+            dueno = User(username=f'dueno{i}', email=f'dueno{i}@ejemplo.com', password_hash='x')
+            db.session.add(dueno)
+            db.session.flush()
+            db.session.add(Negocio(nombre=f'Negocio {i}', descripcion_corta='-', usuario_id=dueno.id))
+            db.session.add(Producto(nombre=f'Producto {i}', precio=1000, categoria_id=raiz.id, created_by=dueno.id))
+        db.session.commit()
+        return raiz.id
+
+
+def test_limit_y_offset_se_acotan(app, categoria):
+    respuesta = app.test_client().get(f'/api/categorias/{categoria}/negocios?limit=-1&offset=-5')
+    datos = respuesta.get_json()
+    assert respuesta.status_code == 200
+    assert (datos['limit'], datos['offset']) == (1, 0)
+    assert len(datos['resultados']) == 1
+    assert datos['total'] == 3
+
+    datos = app.test_client().get(f'/api/categorias/{categoria}/negocios?limit=500').get_json()
+    assert datos['limit'] == 50
+    assert len(datos['resultados']) == 3
+
+
+def test_categoria_sin_ruta_responde_404(app):
+    with app.app_context():
+        huerfana = Categoria(nombre='Sin ruta', tipo='servicio', nivel=1)
+        db.session.add(huerfana)
+        db.session.commit()
+        categoria_id = huerfana.id
+        # Fila de una base anterior a las rutas: el listener de inserción ya la habría llenado
+        tabla = Categoria.__table__
+        db.session.execute(tabla.update().where(tabla.c.id == categoria_id).values(ruta=None))
+        db.session.commit()
+
+    respuesta = app.test_client().get(f'/api/categorias/{categoria_id}/negocios')
+    assert respuesta.status_code == 404
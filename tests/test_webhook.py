@@ -0,0 +1,88 @@
+import hashlib
+import hmac
+import json
+from datetime import datetime
+
+import pytest
+
+import webhook
+from models import MensajeEntrante, db
+
+SECRETO = 'secreto-de-prueba'
+
+
+@pytest.fixture
+def encolados(monkeypatch):
+    """Ids que el webhook encolaría, sin arrancar los hilos de procesamiento."""
+    monkeypatch.setenv('WHATSAPP_APP_SECRET', SECRETO)
+    ids = []
+    monkeypatch.setattr(webhook, 'encolar', ids.extend)
+    return ids
+
+
+def _evento(wamid, payload='confirmar_1'):
+    return json.dumps({'entry': [{'changes': [{'value': {
+        'contacts': [{'wa_id': '573001112233', 'profile': {'name': 'Ana'}}],
+        'messages': [{'id': wamid, 'from': '573001112233', 'type': 'button', 'button': {'payload': payload}}],
+    }}]}]}).encode()
+
+
+def _firmar(cuerpo, secreto=SECRETO):
+    return 'sha256=' + hmac.new(secreto.encode(), cuerpo, hashlib.sha256).hexdigest()
+
+
+def _publicar(app, cuerpo, firma):
+    cabeceras = {'X-Hub-Signature-256': firma} if firma else {}
+    return app.test_client().post('/webhook/whatsapp', data=cuerpo, headers=cabeceras,
+                                  content_type='application/json')
+
+
+def _mensaje(app, estado='pendiente', payload='confirmar_1', **campos):
+    with app.app_context():
+        mensaje = MensajeEntrante(wamid=f'wamid.{estado}', telefono='573001112233', tipo='button',
+                                  payload=payload, cuerpo='{}', estado=estado, **campos)
+        db.session.add(mensaje)
+        db.session.commit()
+        return mensaje.id
+
+
+@pytest.mark.parametrize('firma', [None, 'sha256=0000', _firmar(_evento('wamid.1'), 'otro-secreto')])
+def test_firma_invalida_o_ausente_responde_403(app, encolados, firma):
+    assert _publicar(app, _evento('wamid.1'), firma).status_code == 403
+    with app.app_context():
+        assert MensajeEntrante.query.count() == 0
+    assert encolados == []
+
+
+def test_reintento_con_el_mismo_wamid_no_se_duplica(app, encolados):
+    cuerpo = _evento('wamid.1')
+    assert _publicar(app, cuerpo, _firmar(cuerpo)).status_code == 200
+    assert _publicar(app, cuerpo, _firmar(cuerpo)).status_code == 200
+    with app.app_context():
+        assert MensajeEntrante.query.filter_by(wamid='wamid.1').count() == 1
+    assert len(encolados) == 1
+
+
+def test_mensaje_ya_reclamado_no_se_procesa(app, monkeypatch):
+    llamadas = []
+    monkeypatch.setitem(webhook.ACCIONES, 'confirmar', lambda mensaje, argumento: llamadas.append(argumento))
+    mensaje_id = _mensaje(app, 'procesando', reclamado_at=datetime.now())
+
+    with app.app_context():
+        webhook.procesar_mensaje(mensaje_id)
+        assert db.session.get(MensajeEntrante, mensaje_id).estado == 'procesando'
+    assert llamadas == []
+
+
+def test_error_del_manejador_marca_el_mensaje(app, monkeypatch):
+    def fallar(mensaje, argumento):
+        raise RuntimeError('sin conexión con WhatsApp')
+
+    monkeypatch.setitem(webhook.ACCIONES, 'confirmar', fallar)
+    mensaje_id = _mensaje(app)
+
+    with app.app_context():
+        webhook.procesar_mensaje(mensaje_id)
+        mensaje = db.session.get(MensajeEntrante, mensaje_id)
+        assert (mensaje.estado, mensaje.error) == ('error', 'sin conexión con WhatsApp')
+        assert mensaje.procesado_at is not None
@@ -0,0 +1,733 @@
+"""
+Vistas web del panel (login, dashboard, catálogo y administración).
+Se registran en create_app() a través de web_bp, así que cualquier
+aplicación creada por la fábrica tiene la interfaz completa.
+"""
+from datetime import datetime
+import re
+
+from flask import Blueprint, current_app, flash, jsonify, redirect, render_template, request, url_for
+from flask_login import current_user, login_required, login_user, logout_user
+
+from archivo import contar_historial
+from limitador import login_exitoso, verificar_intento_login
+from medios import imagen_subida
+from messenger import enviar_mensaje_whatsapp
+from models import Categoria, Negocio, Producto, Servicio, Subcategoria, User, Venta, db
+from particiones import ciudad_de_ubicacion, en_ciudad, en_todas_las_ciudades
+from perfilado import resumen_endpoints
+from utils import generar_contrasena_segura
+
+web_bp = Blueprint('web', __name__)
+
+# Decorador para verificar si es admin
+def admin_required(f):
+    from functools import wraps
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated or not current_user.is_admin():
+            flash('Acceso denegado. Se requieren permisos de administrador.', 'error')
+            return redirect(url_for('web.dashboard'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# Funciones auxiliares
+def validar_email(email):
+    pattern = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
+    return re.match(pattern, email) is not None
+
+def validar_password(password):
+    # Mínimo 8 caracteres, al menos una mayúscula, una minúscula y un número
+    if len(password) < 8:
+        return False, "La contraseña debe tener al menos 8 caracteres"
+    
+    if not any(c.isupper() for c in password):
+        return False, "La contraseña debe tener al menos una letra mayúscula"
+    
+    if not any(c.islower() for c in password):
+        return False, "La contraseña debe tener al menos una letra minúscula"
+    
+    if not any(c.isdigit() for c in password):
+        return False, "La contraseña debe tener al menos un número"
+    
+    return True, "Contraseña válida"
+
+
+# RUTAS PRINCIPALES
+@web_bp.route('/')
+def index():
+    return redirect(url_for('web.login'))
+
+@web_bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('web.dashboard'))
+    
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        
+        # Se limita antes de calcular el hash: es la parte cara del login
+        espera = verificar_intento_login(username)
+        if espera is not None:
+            flash(f'Demasiados intentos de inicio de sesión. Intenta de nuevo en {espera} segundos.', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(espera)}
+        
+        user = User.query.filter_by(username=username).first()
+        
+        if user and user.check_password(password):
+            if not user.is_active:
+                flash('Tu cuenta está desactivada. Contacta al administrador.', 'error')
+                return redirect(url_for('web.login'))
+            
+            login_exitoso(username)
+            login_user(user)
+            user.last_login = datetime.now()
+            db.session.commit()
+            flash('¡Inicio de sesión exitoso!', 'success')
+            return redirect(url_for('web.dashboard'))
+        else:
+            flash('Usuario o contraseña incorrectos', 'error')
+    
+    return render_template('login.html')
+
+@web_bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    flash('Has cerrado sesión', 'info')
+    return redirect(url_for('web.login'))
+
+@web_bp.route('/vender/<tipo>/<int:id>')
+@login_required
+def vender(tipo, id):
+    if tipo == 'producto':
+        item = Producto.query.get(id)
+        if item and item.stock > 0:
+            item.vendidos += 1
+            item.stock -= 1
+            
+            venta = Venta(
+                tipo='producto',
+                item_id=id,
+                cantidad=1,
+                total=item.precio,
+                vendedor_id=current_user.id
+            )
+            db.session.add(venta)
+            db.session.commit()
+            flash(f'Producto {item.nombre} vendido exitosamente', 'success')
+    elif tipo == 'servicio':
+        item = Servicio.query.get(id)
+        if item:
+            item.vendidos += 1
+            
+            venta = Venta(
+                tipo='servicio',
+                item_id=id,
+                cantidad=1,
+                total=item.precio,
+                vendedor_id=current_user.id
+            )
+            db.session.add(venta)
+            db.session.commit()
+            flash(f'Servicio {item.nombre} vendido exitosamente', 'success')
+    
+    return redirect(url_for('web.dashboard'))
+
+@web_bp.route('/admin/usuario/nuevo', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def nuevo_usuario():
+    if request.method == 'POST':
+        try:
+            # Datos del Usuario
+            username = request.form.get('username') # Este es el WhatsApp/Telf
+            password = request.form.get('password')
+            role = request.form.get('role', 'usuario')
+            
+            # Datos del Negocio (Nuevos campos del formulario)
+            nombre_negocio = request.form.get('nombre_negocio')
+            descripcion_negocio = request.form.get('descripcion_negocio')
+
+            # Validaciones
+            if User.query.filter_by(username=username).first():
+                flash('El número de WhatsApp (usuario) ya está registrado', 'error')
+                return redirect(url_for('web.nuevo_usuario'))
+            
+            # Crear objeto usuario
+            user = User(username=username, role=role)
+            user.set_password(password)
+            
+            db.session.add(user)
+            db.session.flush() # Esto asigna un ID a 'user' sin cerrar la transacción
+
+            # Crear el Negocio asociado automáticamente
+            nuevo_negocio = Negocio(
+                nombre=nombre_negocio,
+                descripcion_corta=descripcion_negocio,
+                telefono_contacto=username, # Usamos el mismo whatsapp de login
+                usuario_id=user.id,
+                activo=True
+            )
+            db.session.add(nuevo_negocio)
+
+            # Notificación por WhatsApp
+            msg = f"""*¡Bienvenido a la Red Vecinal!* Tu cuenta ha sido creada con éxito.
+*Negocio:* {nombre_negocio}
+*Usuario:* {username}
+*Clave:* {password}
+Puedes gestionar tus productos aquí: (url)"""
+            
+            # Intentar enviar mensaje antes del commit final
+            status_wa = enviar_mensaje_whatsapp(username, msg)
+            
+            if status_wa in (200, 201, 202):
+                db.session.commit()
+                flash(f'Usuario y Negocio "{nombre_negocio}" creados exitosamente', 'success')
+                return redirect(url_for('web.admin_usuarios'))
+            else:
+                db.session.rollback()
+                flash('Error al enviar WhatsApp de bienvenida. Registro cancelado.', 'error')
+
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al crear el registro: {str(e)}', 'error')
+            
+    return render_template('nuevo_usuario.html', psw=generar_contrasena_segura())
+
+@web_bp.route('/admin/usuario/<int:user_id>/toggle')
+@login_required
+@admin_required
+def toggle_usuario(user_id):
+    if user_id == current_user.id:
+        flash('No puedes modificar tu propio estado', 'error')
+        return redirect(url_for('web.admin_usuarios'))
+    
+    user = User.query.get_or_404(user_id)
+    nuevo_estado = user.toggle_active()
+    db.session.commit()
+    
+    estado = "activada" if nuevo_estado else "desactivada"
+    flash(f'Cuenta {estado} exitosamente', 'success')
+    return redirect(url_for('web.admin_usuarios'))
+
+@web_bp.route('/admin/usuario/<int:user_id>/cambiar_rol', methods=['POST'])
+@login_required
+@admin_required
+def cambiar_rol_usuario(user_id):
+    if user_id == current_user.id:
+        flash('No puedes modificar tu propio rol', 'error')
+        return redirect(url_for('web.admin_usuarios'))
+    
+    user = User.query.get_or_404(user_id)
+    nuevo_rol = request.form.get('role')
+    
+    if nuevo_rol in ['admin', 'usuario']:
+        user.role = nuevo_rol
+        db.session.commit()
+        flash(f'Rol cambiado a {nuevo_rol} exitosamente', 'success')
+    
+    return redirect(url_for('web.admin_usuarios'))
+
+@web_bp.route('/admin/usuario/<int:user_id>/eliminar')
+@login_required
+@admin_required
+def eliminar_usuario(user_id):
+    if user_id == current_user.id:
+        flash('No puedes eliminar tu propia cuenta', 'error')
+        return redirect(url_for('web.admin_usuarios'))
+    
+    user = User.query.get_or_404(user_id)
+    
+    # Verificar si el usuario tiene registros asociados
+    if Producto.query.filter_by(created_by=user_id).first() or \
+       Servicio.query.filter_by(created_by=user_id).first():
+        flash('No se puede eliminar el usuario porque tiene registros asociados', 'error')
+        return redirect(url_for('web.admin_usuarios'))
+    
+    db.session.delete(user)
+    db.session.commit()
+    flash('Usuario eliminado exitosamente', 'success')
+    return redirect(url_for('web.admin_usuarios'))
+
+
+
+@web_bp.route('/categorias/nueva', methods=['POST'])
+@login_required
+@admin_required
+def nueva_categoria():
+    nombre = request.form.get('nombre')
+    tipo = request.form.get('tipo')
+    
+    if nombre and tipo:
+        if Categoria.query.filter_by(nombre=nombre, tipo=tipo).first():
+            flash('Esta categoría ya existe', 'error')
+        else:
+            categoria = Categoria(
+                nombre=nombre, 
+                tipo=tipo,
+                created_by=current_user.id
+            )
+            db.session.add(categoria)
+            db.session.commit()
+            flash('Categoría creada exitosamente', 'success')
+    
+    return redirect(url_for('web.gestion_categorias'))
+
+@web_bp.route('/subcategorias/nueva', methods=['POST'])
+@login_required
+@admin_required
+def nueva_subcategoria():
+    nombre = request.form.get('nombre')
+    categoria_id = request.form.get('categoria_id')
+    
+    if nombre and categoria_id:
+        if Subcategoria.query.filter_by(nombre=nombre, categoria_id=categoria_id).first():
+            flash('Esta subcategoría ya existe', 'error')
+        else:
+            subcategoria = Subcategoria(
+                nombre=nombre, 
+                categoria_id=int(categoria_id),
+                created_by=current_user.id
+            )
+            db.session.add(subcategoria)
+            db.session.commit()
+            flash('Subcategoría creada exitosamente', 'success')
+    
+    return redirect(url_for('web.gestion_categorias'))
+
+# RUTA PARA SUBRECATEGORÍAS (AJAX - disponible para todos los usuarios autenticados)
+@web_bp.route('/admin/subcategorias/<int:categoria_id>')
+@login_required
+def get_subcategorias(categoria_id):
+    subcategorias = Subcategoria.query.filter_by(categoria_id=categoria_id).all()
+    return jsonify([{'id': s.id, 'nombre': s.nombre} for s in subcategorias])
+
+
+# Agregar una función para contexto común
+@web_bp.app_context_processor
+def inject_user_data():
+    if current_user.is_authenticated:
+        return {
+            'es_admin': current_user.is_admin(),
+            'current_user': current_user
+        }
+    return {}
+
+
+###
+@web_bp.route('/dashboard')
+@login_required
+def dashboard():
+    if current_user.is_admin():
+        # Administradores ven TODO
+        total_productos = Producto.query.count()
+        total_servicios = Servicio.query.count()
+        productos_vendidos = sum(p.vendidos for p in Producto.query.all())
+        servicios_vendidos = sum(s.vendidos for s in Servicio.query.all())
+        productos = Producto.query.all()
+        servicios = Servicio.query.all()
+        ventas_realizadas = contar_historial(Venta, vendedor_id=current_user.id)
+    else:
+        # Usuarios normales solo ven lo que ellos crearon
+        total_productos = Producto.query.filter_by(created_by=current_user.id).count()
+        total_servicios = Servicio.query.filter_by(created_by=current_user.id).count()
+        
+        # Productos creados por el usuario
+        mis_productos = Producto.query.filter_by(created_by=current_user.id).all()
+        productos_vendidos = sum(p.vendidos for p in mis_productos)
+        
+        # Servicios creados por el usuario
+        mis_servicios = Servicio.query.filter_by(created_by=current_user.id).all()
+        servicios_vendidos = sum(s.vendidos for s in mis_servicios)
+        
+        productos = mis_productos
+        servicios = mis_servicios
+        ventas_realizadas = contar_historial(Venta, vendedor_id=current_user.id)
+    
+    return render_template('dashboard.html',
+                         page_title='Dashboard',
+                         total_productos=total_productos,
+                         total_servicios=total_servicios,
+                         productos_vendidos=productos_vendidos,
+                         servicios_vendidos=servicios_vendidos,
+                         productos=productos,
+                         servicios=servicios,
+                         ventas_realizadas=ventas_realizadas,
+                         es_admin=current_user.is_admin())
+
+
+# Actualizar rutas de productos y servicios para que todos puedan crear
+@web_bp.route('/productos/nuevo', methods=['GET', 'POST'])
+@login_required
+def nuevo_producto():
+    categorias = Categoria.query.filter_by(tipo='producto').all()
+    
+    if request.method == 'POST':
+        try:
+            # Verificar si es admin o usuario normal
+            if current_user.is_admin():
+                # Admins pueden asignar cualquier creador (o dejarlo como ellos)
+                created_by = int(request.form.get('created_by', current_user.id))
+            else:
+                # Usuarios normales solo pueden crear para sí mismos
+                created_by = current_user.id
+            
+            producto = Producto(
+                nombre=request.form.get('nombre'),
+                descripcion=request.form.get('descripcion'),
+                precio=float(request.form.get('precio')),
+                stock=int(request.form.get('stock', 0)),
+                categoria_id=int(request.form.get('categoria')) if request.form.get('categoria') else None,
+                subcategoria_id=int(request.form.get('subcategoria')) if request.form.get('subcategoria') else None,
+                imagen_url=imagen_subida() or request.form.get('imagen_url', ''),
+                created_by=created_by
+            )
+            
+            db.session.add(producto)
+            db.session.commit()
+            flash('Producto creado exitosamente', 'success')
+            return redirect(url_for('web.dashboard'))
+        
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al crear el producto: {str(e)}', 'error')
+    
+    # Pasar lista de usuarios solo si es admin
+    usuarios = User.query.all() if current_user.is_admin() else None
+    
+    return render_template('nuevo_producto.html', 
+                         categorias=categorias,
+                         usuarios=usuarios,
+                         es_admin=current_user.is_admin())
+
+@web_bp.route('/servicios/nuevo', methods=['GET', 'POST'])
+@login_required
+def nuevo_servicio():
+    categorias = Categoria.query.filter_by(tipo='servicio').all()
+    
+    if request.method == 'POST':
+        try:
+            # Verificar si es admin o usuario normal
+            if current_user.is_admin():
+                # Admins pueden asignar cualquier creador
+                created_by = int(request.form.get('created_by', current_user.id))
+            else:
+                # Usuarios normales solo pueden crear para sí mismos
+                created_by = current_user.id
+            
+            servicio = Servicio(
+                nombre=request.form.get('nombre'),
+                descripcion=request.form.get('descripcion'),
+                precio=float(request.form.get('precio')),
+                duracion=request.form.get('duracion'),
+                categoria_id=int(request.form.get('categoria')) if request.form.get('categoria') else None,
+                subcategoria_id=int(request.form.get('subcategoria')) if request.form.get('subcategoria') else None,
+                imagen_url=imagen_subida() or request.form.get('imagen_url', ''),
+                created_by=created_by
+            )
+            
+            db.session.add(servicio)
+            db.session.commit()
+            flash('Servicio creado exitosamente', 'success')
+            return redirect(url_for('web.dashboard'))
+        
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al crear el servicio: {str(e)}', 'error')
+    
+    # Pasar lista de usuarios solo si es admin
+    usuarios = User.query.all() if current_user.is_admin() else None
+    
+    return render_template('nuevo_servicio.html',
+                         categorias=categorias,
+                         usuarios=usuarios,
+                         es_admin=current_user.is_admin())
+
+# Agregar función para editar/eliminar productos (solo admin o creador)
+@web_bp.route('/productos/<int:id>/eliminar')
+@login_required
+def eliminar_producto(id):
+    producto = Producto.query.get_or_404(id)
+    
+    # Verificar permisos
+    if not current_user.is_admin() and producto.created_by != current_user.id:
+        flash('No tienes permisos para eliminar este producto', 'error')
+        return redirect(url_for('web.dashboard'))
+    
+    try:
+        db.session.delete(producto)
+        db.session.commit()
+        flash('Producto eliminado exitosamente', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al eliminar el producto: {str(e)}', 'error')
+    
+    return redirect(url_for('web.dashboard'))
+
+@web_bp.route('/servicios/<int:id>/eliminar')
+@login_required
+def eliminar_servicio(id):
+    servicio = Servicio.query.get_or_404(id)
+    
+    # Verificar permisos
+    if not current_user.is_admin() and servicio.created_by != current_user.id:
+        flash('No tienes permisos para eliminar este servicio', 'error')
+        return redirect(url_for('web.dashboard'))
+    
+    try:
+        db.session.delete(servicio)
+        db.session.commit()
+        flash('Servicio eliminado exitosamente', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al eliminar el servicio: {str(e)}', 'error')
+    
+    return redirect(url_for('web.dashboard'))
+###
+
+@web_bp.route('/admin/usuarios')
+@login_required
+@admin_required
+def admin_usuarios():
+    q = request.args.get('q', '').strip()
+    rol = request.args.get('rol', '')
+    estado = request.args.get('estado', '')
+    pagina = request.args.get('page', 1, type=int)
+    por_pagina = max(1, min(request.args.get('por_pagina', 25, type=int), 100))
+    
+    consulta = User.query
+    if q:
+        # % y _ del texto se buscan literalmente
+        patron = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        # Los usuarios no tienen teléfono propio: se busca en los contactos de sus negocios
+        por_telefono = db.session.query(Negocio.id).filter(
+            Negocio.usuario_id == User.id,
+            db.or_(Negocio.telefono_contacto.like(patron, escape='\\'),
+                   Negocio.whatsapp_contacto.like(patron, escape='\\'))
+        ).exists()
+        consulta = consulta.filter(db.or_(User.username.ilike(patron, escape='\\'),
+                                          User.email.ilike(patron, escape='\\'), por_telefono))
+    if rol in ('admin', 'usuario'):
+        consulta = consulta.filter(User.role == rol)
+    if estado in ('activo', 'inactivo'):
+        consulta = consulta.filter(User.is_active == (estado == 'activo'))
+    
+    paginacion = consulta.order_by(User.created_at.desc(), User.id.desc()).paginate(
+        page=pagina, per_page=por_pagina, error_out=False
+    )
+    
+    # Totales de la cabecera en una sola consulta agrupada
+    conteos = db.session.query(User.role, User.is_active, db.func.count(User.id)).group_by(User.role, User.is_active).all()
+    resumen = {
+        'total': sum(n for _, _, n in conteos),
+        'activos': sum(n for _, activo, n in conteos if activo),
+        'admins': sum(n for role, _, n in conteos if role == 'admin'),
+    }
+    
+    return render_template('admin_usuarios.html',
+                         page_title='Administrar Usuarios',
+                         usuarios=paginacion.items,
+                         paginacion=paginacion,
+                         resumen=resumen,
+                         filtros={'q': q, 'rol': rol, 'estado': estado})
+
+
+@web_bp.route('/admin/perfilado')
+@login_required
+@admin_required
+def admin_perfilado():
+    orden = request.args.get('orden', 'tiempo_db')
+    if orden not in ('tiempo_db', 'tiempo_total', 'consultas', 'max_consultas', 'peticiones_n1'):
+        orden = 'tiempo_db'
+    return render_template('admin_perfilado.html',
+                         page_title='Perfilado SQL',
+                         activo=current_app.config['PERFILAR_SQL'],
+                         orden=orden,
+                         endpoints=resumen_endpoints(orden))
+
+@web_bp.route('/categorias')
+@login_required
+@admin_required
+def gestion_categorias():
+    categorias = Categoria.query.filter(Categoria.tipo.in_(['producto', 'servicio'])).options(
+        db.selectinload(Categoria.subcategorias)
+    ).order_by(Categoria.orden, Categoria.id).all()
+    
+    # Productos y servicios por categoría en una sola consulta, sin cargar las filas
+    conteos = db.union_all(
+        db.select(Producto.categoria_id, db.literal('producto'), db.func.count()).group_by(Producto.categoria_id),
+        db.select(Servicio.categoria_id, db.literal('servicio'), db.func.count()).group_by(Servicio.categoria_id),
+    )
+    totales = {(categoria_id, tipo): n for categoria_id, tipo, n in db.session.execute(conteos)}
+    
+    return render_template('categorias.html',
+                         page_title='Gestionar Categorías',
+                         categorias_productos=[c for c in categorias if c.tipo == 'producto'],
+                         categorias_servicios=[c for c in categorias if c.tipo == 'servicio'],
+                         totales=totales)
+
+@web_bp.route('/perfil')
+@login_required
+def perfil():
+    # Obtener estadísticas del usuario
+    productos_creados = Producto.query.filter_by(created_by=current_user.id).count()
+    servicios_creados = Servicio.query.filter_by(created_by=current_user.id).count()
+    ventas_realizadas = contar_historial(Venta, vendedor_id=current_user.id)
+    
+    return render_template('perfil.html',
+                         page_title='Mi Perfil',
+                         productos_creados=productos_creados,
+                         servicios_creados=servicios_creados,
+                         ventas_realizadas=ventas_realizadas)
+
+# ... (rutas existentes)
+
+# NUEVAS RUTAS PARA GESTIÓN DE NEGOCIOS (opcional, para administración web)
+@web_bp.route('/admin/negocios')
+@login_required
+@admin_required
+def admin_negocios():
+    """
+    Panel de administración de negocios.
+    """
+    # Los ids vienen del directorio global: crecen en el orden de alta en todas las particiones
+    partes = en_todas_las_ciudades(lambda: Negocio.query.order_by(Negocio.id.desc()).all())
+    negocios = sorted((n for parte in partes for n in parte), key=lambda n: n.id, reverse=True)
+    return render_template('admin_negocios.html',
+                         page_title='Administrar Negocios',
+                         negocios=negocios)
+
+@web_bp.route('/admin/negocios/nuevo', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def nuevo_negocio():
+    """
+    Crear nuevo negocio desde la interfaz web.
+    """
+    categorias = Categoria.query.filter_by(nivel=1).all()
+    
+    if request.method == 'POST':
+        try:
+            negocio = Negocio(
+                nombre=request.form.get('nombre'),
+                descripcion_corta=request.form.get('descripcion_corta'),
+                descripcion_larga=request.form.get('descripcion_larga'),
+                subcategoria_id=int(request.form.get('subcategoria_id')),
+                tipo=request.form.get('tipo'),
+                telefono_contacto=request.form.get('telefono_contacto'),
+                whatsapp_contacto=request.form.get('whatsapp_contacto'),
+                email_contacto=request.form.get('email_contacto'),
+                direccion=request.form.get('direccion'),
+                ubicacion=request.form.get('ubicacion'),
+                url_presentacion=request.form.get('url_presentacion'),
+                url_imagen_perfil=request.form.get('url_imagen_perfil'),
+                precio_estimado=float(request.form.get('precio_estimado', 0)),
+                created_by=current_user.id
+            )
+            
+            with en_ciudad(ciudad_de_ubicacion(negocio.ubicacion)):
+                db.session.add(negocio)
+                db.session.commit()
+            flash('Negocio creado exitosamente', 'success')
+            return redirect(url_for('web.admin_negocios'))
+        
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al crear el negocio: {str(e)}', 'error')
+    
+    return render_template('nuevo_negocio.html',
+                         categorias=categorias,
+                         page_title='Nuevo Negocio')
+
+# RUTAS PARA EDITAR PRODUCTOS
+@web_bp.route('/productos/<int:id>/editar', methods=['GET', 'POST'])
+@login_required
+def editar_producto(id):
+    producto = Producto.query.get_or_404(id)
+    
+    # Verificar permisos (solo admin o el creador)
+    if not current_user.is_admin() and producto.created_by != current_user.id:
+        flash('No tienes permisos para editar este producto', 'error')
+        return redirect(url_for('web.dashboard'))
+    
+    categorias = Categoria.query.filter_by(tipo='producto').all()
+    
+    if request.method == 'POST':
+        try:
+            producto.nombre = request.form.get('nombre')
+            producto.descripcion = request.form.get('descripcion')
+            producto.precio = float(request.form.get('precio'))
+            producto.stock = int(request.form.get('stock', 0))
+            
+            # Manejo de categorías (opcional)
+            cat_id = request.form.get('categoria')
+            subcat_id = request.form.get('subcategoria')
+            
+            if cat_id:
+                producto.categoria_id = int(cat_id)
+            if subcat_id:
+                producto.subcategoria_id = int(subcat_id)
+                
+            producto.imagen_url = imagen_subida() or request.form.get('imagen_url')
+            
+            db.session.commit()
+            flash('Producto actualizado exitosamente', 'success')
+            return redirect(url_for('web.dashboard'))
+        
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al actualizar el producto: {str(e)}', 'error')
+    
+    return render_template('editar_item.html', 
+                         item=producto, 
+                         tipo='producto',
+                         categorias=categorias,
+                         page_title='Editar Producto')
+
+# RUTAS PARA EDITAR SERVICIOS
+@web_bp.route('/servicios/<int:id>/editar', methods=['GET', 'POST'])
+@login_required
+def editar_servicio(id):
+    servicio = Servicio.query.get_or_404(id)
+    
+    # Verificar permisos
+    if not current_user.is_admin() and servicio.created_by != current_user.id:
+        flash('No tienes permisos para editar este servicio', 'error')
+        return redirect(url_for('web.dashboard'))
+    
+    categorias = Categoria.query.filter_by(tipo='servicio').all()
+    
+    if request.method == 'POST':
+        try:
+            servicio.nombre = request.form.get('nombre')
+            servicio.descripcion = request.form.get('descripcion')
+            servicio.precio = float(request.form.get('precio'))
+            servicio.duracion = request.form.get('duracion')
+            
+            # Manejo de categorías
+            cat_id = request.form.get('categoria')
+            subcat_id = request.form.get('subcategoria')
+            
+            if cat_id:
+                servicio.categoria_id = int(cat_id)
+            if subcat_id:
+                servicio.subcategoria_id = int(subcat_id)
+                
+            servicio.imagen_url = imagen_subida() or request.form.get('imagen_url')
+            
+            db.session.commit()
+            flash('Servicio actualizado exitosamente', 'success')
+            return redirect(url_for('web.dashboard'))
+        
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al actualizar el servicio: {str(e)}', 'error')
+    
+    return render_template('editar_item.html', 
+                         item=servicio, 
+                         tipo='servicio',
+                         categorias=categorias,
+                         page_title='Editar Servicio')
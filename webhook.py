@@ -0,0 +1,293 @@
+"""
+Webhook de mensajes entrantes de WhatsApp.
+La petición solo verifica la firma X-Hub-Signature-256, guarda los mensajes
+con un INSERT que ignora los wamid ya vistos (Meta reintenta las entregas) y
+responde 200; el procesamiento (confirmar agendamientos, responder) lo hace
+un pool de hilos en segundo plano que arranca con cada worker. Los mensajes
+pendientes o reclamados por un proceso que cayó se recuperan desde la tabla.
+"""
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import Blueprint, abort, jsonify, request
+from sqlalchemy import and_, or_, select, update
+
+from basedatos import insert_con_conflicto
+from menus import preparar_respuesta_whatsapp
+from messenger import enviar_mensaje_detallado
+from metricas import incrementar
+from models import Agendamiento, MensajeEntrante, Negocio, db
+from particiones import ciudad_de_negocio, en_ciudad, en_todas_las_ciudades
+
+webhook_bp = Blueprint('webhook', __name__, url_prefix='/webhook')
+
+# Un mensaje 'pendiente' más antiguo que esto se considera abandonado y se reencola
+ANTIGUEDAD_RECUPERACION = timedelta(seconds=30)
+# Un mensaje 'procesando' reclamado hace más que esto se da por abandonado (caída a mitad)
+PLAZO_PROCESANDO = timedelta(minutes=5)
+INTERVALO_RECUPERACION = 60
+
+_cola = queue.Queue()
+_estado = {'app': None, 'pid': None, 'hilos': 2}
+_candado = threading.Lock()
+
+
+# ============================================
+# RECEPCIÓN
+# ============================================
+
+def firma_valida(cuerpo, firma, secreto):
+    """Compara en tiempo constante 'sha256=<hmac>' del cuerpo crudo."""
+    if not secreto or not firma or not firma.startswith('sha256='):
+        return False
+    esperada = hmac.new(secreto.encode(), cuerpo, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperada, firma[len('sha256='):])
+
+
+def _payload_boton(mensaje):
+    if mensaje.get('type') == 'button':
+        return mensaje.get('button', {}).get('payload')
+    if mensaje.get('type') == 'interactive':
+        interactivo = mensaje.get('interactive', {})
+        return (interactivo.get('button_reply') or interactivo.get('list_reply') or {}).get('id')
+    return None
+
+
+def _extraer_mensajes(evento):
+    """Filas de MensajeEntrante a partir del JSON de un evento del webhook."""
+    filas = []
+    for entrada in evento.get('entry', []):
+        for cambio in entrada.get('changes', []):
+            valor = cambio.get('value', {})
+            nombres = {c.get('wa_id'): c.get('profile', {}).get('name') for c in valor.get('contacts', [])}
+            for mensaje in valor.get('messages', []):
+                filas.append({
+                    'wamid': mensaje['id'],
+                    'telefono': mensaje['from'],
+                    'nombre': nombres.get(mensaje['from']),
+                    'tipo': mensaje.get('type', 'desconocido'),
+                    'payload': _payload_boton(mensaje),
+                    'cuerpo': json.dumps(mensaje, ensure_ascii=False),
+                    'estado': 'pendiente',
+                    'recibido_at': datetime.now(),
+                })
+    return filas
+
+
+def _insertar_sin_duplicados(filas):
+    """INSERT ... ON CONFLICT (wamid) DO NOTHING; devuelve los ids nuevos."""
+    sentencia = insert_con_conflicto(MensajeEntrante, db.engine).values(filas).on_conflict_do_nothing(
+        index_elements=['wamid']
+    ).returning(MensajeEntrante.id)
+    ids = db.session.scalars(sentencia).all()
+    db.session.commit()
+    return ids
+
+
+@webhook_bp.route('/whatsapp', methods=['GET'])
+def verificar_webhook():
+    """Verificación de suscripción de Meta (hub.challenge)."""
+    if (request.args.get('hub.mode') == 'subscribe'
+            and request.args.get('hub.verify_token') == os.environ.get('WHATSAPP_VERIFY_TOKEN')
+            and os.environ.get('WHATSAPP_VERIFY_TOKEN')):
+        return request.args.get('hub.challenge', ''), 200
+    abort(403)
+
+
+@webhook_bp.route('/whatsapp', methods=['POST'])
+def recibir_webhook():
+    """Guarda los mensajes del evento y responde 200 sin procesarlos."""
+    cuerpo = request.get_data()
+    if not firma_valida(cuerpo, request.headers.get('X-Hub-Signature-256'), os.environ.get('WHATSAPP_APP_SECRET')):
+        incrementar('webhook_mensajes_total', {'resultado': 'firma_invalida'})
+        abort(403)
+    try:
+        filas = _extraer_mensajes(json.loads(cuerpo))
+    except (ValueError, KeyError, AttributeError):
+        return jsonify({'status': 'ignorado'}), 200  # Un 4xx haría que Meta reintente sin fin
+
+    if filas:
+        nuevos = _insertar_sin_duplicados(filas)
+        incrementar('webhook_mensajes_total', {'resultado': 'nuevo'}, len(nuevos))
+        incrementar('webhook_mensajes_total', {'resultado': 'duplicado'}, len(filas) - len(nuevos))
+        encolar(nuevos)
+    return jsonify({'status': 'ok'}), 200
+
+
+# ============================================
+# PROCESAMIENTO EN SEGUNDO PLANO
+# ============================================
+
+def _responder(telefono, texto=None, contenido=None):
+    status, detalle = enviar_mensaje_detallado(telefono, texto or '', contenido=contenido)
+    if status is None or status >= 400:
+        raise RuntimeError(f'No se pudo responder: {detalle}')
+
+
+def _ultimo_pendiente(telefono, negocio_id=None):
+    consulta = Agendamiento.query.filter(
+        Agendamiento.cliente_telefono == telefono, Agendamiento.estado == 'pendiente'
+    )
+    if negocio_id is not None:
+        consulta = consulta.filter(Agendamiento.id_negocio == negocio_id)
+    return consulta.order_by(Agendamiento.fecha_solicitud.desc()).first()
+
+
+def _agendar(mensaje, negocio_id):
+    # El negocio y sus agendamientos viven en la partición de su ciudad
+    with en_ciudad(ciudad_de_negocio(negocio_id)):
+        negocio = db.session.get(Negocio, negocio_id)
+        if negocio is None:
+            return _responder(mensaje.telefono, 'El negocio ya no está disponible.')
+        if _ultimo_pendiente(mensaje.telefono, negocio_id) is None:
+            db.session.add(Agendamiento(
+                cliente_nombre=mensaje.nombre or mensaje.telefono, cliente_telefono=mensaje.telefono,
+                id_negocio=negocio_id, estado='pendiente',
+            ))
+            db.session.commit()
+        contenido = preparar_respuesta_whatsapp('confirmacion_agendamiento', negocio)
+    _responder(mensaje.telefono, contenido=contenido)
+
+
+def _confirmar(mensaje, negocio_id):
+    with en_ciudad(ciudad_de_negocio(negocio_id)):
+        agendamiento = _ultimo_pendiente(mensaje.telefono, negocio_id)
+        if agendamiento is None:
+            return _responder(mensaje.telefono, 'No encontramos una solicitud pendiente para confirmar.')
+        agendamiento.estado = 'confirmado'
+        db.session.commit()
+        nombre = agendamiento.negocio.nombre
+    _responder(mensaje.telefono, f'✅ Tu agendamiento con {nombre} quedó confirmado.')
+
+
+def _cancelar(mensaje, _=None):
+    def pendiente_en_particion():
+        agendamiento = _ultimo_pendiente(mensaje.telefono)
+        return (agendamiento.fecha_solicitud, agendamiento.id_negocio) if agendamiento else None
+
+    # El último pendiente del teléfono puede estar en cualquier partición
+    pendientes = [p for p in en_todas_las_ciudades(pendiente_en_particion) if p is not None]
+    if pendientes:
+        negocio_id = max(pendientes, key=lambda p: p[0] or datetime.min)[1]
+        with en_ciudad(ciudad_de_negocio(negocio_id)):
+            agendamiento = _ultimo_pendiente(mensaje.telefono, negocio_id)
+            if agendamiento is not None:
+                agendamiento.estado = 'cancelado'
+                db.session.commit()
+    _responder(mensaje.telefono, 'Solicitud cancelada. ¡Escríbenos cuando quieras!')
+
+
+# Prefijo del id del botón -> manejador(mensaje, id numérico o None)
+ACCIONES = {
+    'agendar': _agendar,
+    'confirmar': _confirmar,
+    'cancelar': _cancelar,
+}
+
+
+def _procesando_abandonado(ahora):
+    return and_(
+        MensajeEntrante.estado == 'procesando',
+        or_(MensajeEntrante.reclamado_at.is_(None), MensajeEntrante.reclamado_at < ahora - PLAZO_PROCESANDO),
+    )
+
+
+def procesar_mensaje(mensaje_id):
+    """Reclama el mensaje (pendiente o abandonado -> procesando) y ejecuta su acción."""
+    ahora = datetime.now()
+    reclamado = db.session.execute(
+        update(MensajeEntrante)
+        .where(MensajeEntrante.id == mensaje_id,
+               or_(MensajeEntrante.estado == 'pendiente', _procesando_abandonado(ahora)))
+        .values(estado='procesando', reclamado_at=ahora)
+    ).rowcount
+    db.session.commit()
+    if not reclamado:
+        return  # Otro worker ya lo tomó
+    mensaje = db.session.get(MensajeEntrante, mensaje_id)
+
+    accion, _, argumento = (mensaje.payload or '').partition('_')
+    manejador = ACCIONES.get(accion)
+    try:
+        if manejador is None:
+            mensaje.estado = 'ignorado'  # Texto libre: lo atiende el agente en n8n
+        else:
+            manejador(mensaje, int(argumento) if argumento.isdigit() else None)
+            mensaje.estado = 'procesado'
+    except Exception as e:
+        db.session.rollback()
+        mensaje.estado, mensaje.error = 'error', str(e)[:500]
+    mensaje.procesado_at = datetime.now()
+    db.session.commit()
+
+
+def _trabajador():
+    while True:
+        mensaje_id = _cola.get()
+        try:
+            with _estado['app'].app_context():
+                procesar_mensaje(mensaje_id)
+        except Exception:
+            _estado['app'].logger.exception('Error procesando el mensaje entrante %s', mensaje_id)
+        finally:
+            _cola.task_done()
+
+
+def _recuperar_pendientes():
+    """
+    Reencola periódicamente los pendientes sin atender y los que quedaron
+    'procesando' por la caída o el reinicio de un worker.
+    """
+    while True:
+        try:
+            ahora = datetime.now()
+            with _estado['app'].app_context():
+                ids = db.session.scalars(
+                    select(MensajeEntrante.id).where(or_(
+                        and_(MensajeEntrante.estado == 'pendiente',
+                             MensajeEntrante.recibido_at < ahora - ANTIGUEDAD_RECUPERACION),
+                        _procesando_abandonado(ahora),
+                    )).order_by(MensajeEntrante.recibido_at).limit(500)
+                ).all()
+            for mensaje_id in ids:
+                _cola.put(mensaje_id)
+        except Exception:
+            # Un error puntual (p. ej. base bloqueada) no debe detener la recuperación
+            _estado['app'].logger.exception('Error recuperando mensajes entrantes pendientes')
+        time.sleep(INTERVALO_RECUPERACION)
+
+
+def iniciar_trabajadores():
+    """
+    Arranca los hilos en el proceso actual. Se llama al iniciar cada worker
+    (gunicorn.conf.py) para atender lo pendiente sin esperar tráfico nuevo.
+    """
+    with _candado:
+        if _estado['pid'] == os.getpid():
+            return
+        _estado['pid'] = os.getpid()
+        for i in range(_estado['hilos']):
+            threading.Thread(target=_trabajador, name=f'webhook-{i}', daemon=True).start()
+        threading.Thread(target=_recuperar_pendientes, name='webhook-recuperacion', daemon=True).start()
+
+
+def encolar(ids):
+    iniciar_trabajadores()
+    for mensaje_id in ids:
+        _cola.put(mensaje_id)
+
+
+def configurar_webhook(app):
+    """
+    Registra /webhook/whatsapp. Variables: WHATSAPP_APP_SECRET (firma),
+    WHATSAPP_VERIFY_TOKEN (suscripción) y WEBHOOK_HILOS (2).
+    """
+    _estado['app'] = app
+    _estado['hilos'] = int(os.environ.get('WEBHOOK_HILOS', 2))
+    app.register_blueprint(webhook_bp)